@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import argparse, os, random, socket, socketserver, threading, time
+
+TRANSFER_BLOCK_SIZE = 64 * 1024
+
+
+def get_args():
+    '''
+    Define and obtain script arguments
+    :return: Arguments object
+    '''
+    parser = argparse.ArgumentParser(prog='ftp_standin.py', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="""
+        + ============================================================ +
+        |  European Nucleotide Archive (ENA) Analysis Submission Tool  |
+        |                                                              |
+        |  FTP server standing in for the Webin upload area, with      |
+        |  injected latency and dropped transfers, for benchmarks.     |
+        + =========================================================== +
+        """)
+    parser.add_argument('-r', '--root', help='Directory holding the uploaded files', type=str, required=True)
+    parser.add_argument('-po', '--port', help='Port to listen on. Default: 2121', type=int, default=2121, required=False)
+    parser.add_argument('-lt', '--latency', help='Seconds added before each reply on the control connection. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-bw', '--bandwidth', help='Maximum bytes per second received by each transfer. Default: no limit', type=float, required=False)
+    parser.add_argument('-dr', '--drop_rate', help='Probability that an upload is dropped part way through. Default: 0', type=float, default=0, required=False)
+    args = parser.parse_args()
+    return args
+
+
+class ftp_handler(socketserver.StreamRequestHandler):
+    # Class which serves an FTP control connection, with the commands used by ftp_upload.py
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write((line + '\r\n').encode())
+
+    def local_path(self, argument):
+        return os.path.join(self.server.root, os.path.basename(argument)) if argument else None
+
+    def handle(self):
+        self.rest = 0
+        self.passive = None
+        self.reply('220 Benchmark FTP stand-in ready')
+        for raw in self.rfile:
+            command, _, argument = raw.decode().strip().partition(' ')
+            handler = getattr(self, 'ftp_' + command.upper(), None)
+            if handler is None:
+                self.reply('502 Command not implemented')
+            elif handler(argument) is False:
+                return
+
+    def data_connection(self):
+        """
+        Accept the data connection of a transfer on the passive socket
+        :return: Socket of the data connection
+        """
+        connection, _ = self.passive.accept()
+        self.passive.close()
+        self.passive = None
+        return connection
+
+    def ftp_USER(self, argument):
+        self.reply('331 Password required')
+
+    def ftp_PASS(self, argument):
+        self.reply('230 Logged in')
+
+    def ftp_TYPE(self, argument):
+        self.reply('200 Type set')
+
+    def ftp_NOOP(self, argument):
+        self.reply('200 OK')
+
+    def ftp_QUIT(self, argument):
+        self.reply('221 Goodbye')
+        return False
+
+    def ftp_PASV(self, argument):
+        self.passive = socket.socket()
+        self.passive.bind((self.server.server_address[0], 0))
+        self.passive.listen(1)
+        host, port = self.passive.getsockname()[:2]
+        self.reply('227 Entering Passive Mode ({},{},{})'.format(host.replace('.', ','), port >> 8, port & 255))
+
+    def ftp_REST(self, argument):
+        self.rest = int(argument)
+        self.reply('350 Restarting at {}'.format(self.rest))
+
+    def ftp_SIZE(self, argument):
+        path = self.local_path(argument)
+        if os.path.isfile(path):
+            self.reply('213 {}'.format(os.path.getsize(path)))
+        else:
+            self.reply('550 No such file')
+
+    def ftp_STOR(self, argument, append=False):
+        path = self.local_path(argument)
+        self.reply('150 Opening data connection')
+        connection = self.data_connection()
+        drop_after = None
+        if self.server.drop_rate and self.server.random.random() < self.server.drop_rate:
+            drop_after = self.server.random.randint(0, 4 * 1024 * 1024)         # Bytes received before the transfer is dropped
+        received, start = 0, time.monotonic()
+        with open(path, 'ab' if append or self.rest else 'wb') as f:
+            if self.rest:
+                f.truncate(self.rest)
+            while True:
+                block = connection.recv(TRANSFER_BLOCK_SIZE)
+                if not block:
+                    break
+                f.write(block)
+                received += len(block)
+                if drop_after is not None and received >= drop_after:
+                    break
+                if self.server.bandwidth:
+                    delay = received / self.server.bandwidth - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+        connection.close()
+        self.rest = 0
+        if drop_after is not None and received >= drop_after:
+            self.reply('426 Connection closed, transfer aborted')
+        else:
+            self.reply('226 Transfer complete')
+
+    def ftp_APPE(self, argument):
+        self.ftp_STOR(argument, append=True)
+
+    def ftp_RETR(self, argument):
+        path = self.local_path(argument)
+        if not os.path.isfile(path):
+            self.reply('550 No such file')
+            return
+        self.reply('150 Opening data connection')
+        connection = self.data_connection()
+        with open(path, 'rb') as f:
+            f.seek(self.rest)
+            try:
+                for block in iter(lambda: f.read(TRANSFER_BLOCK_SIZE), b''):
+                    connection.sendall(block)
+            except OSError:
+                pass            # The client closed the connection having read the range it needed
+        connection.close()
+        self.rest = 0
+        self.reply('226 Transfer complete')
+
+    def ftp_OPTS(self, argument):
+        if argument.upper().startswith('MLST'):
+            self.reply('200 MLST OPTS type;size;modify;')
+        else:
+            self.reply('501 Option not understood')
+
+    def ftp_LIST(self, argument):
+        self.reply('150 Opening data connection')
+        connection = self.data_connection()
+        listing = ''
+        for name in sorted(os.listdir(self.server.root)):
+            stat = os.stat(os.path.join(self.server.root, name))
+            listing += '-rw-r--r-- 1 webin webin {} {} {}\r\n'.format(stat.st_size, time.strftime('%b %d %H:%M', time.gmtime(stat.st_mtime)), name)
+        connection.sendall(listing.encode())
+        connection.close()
+        self.reply('226 Transfer complete')
+
+    def ftp_MLSD(self, argument):
+        self.reply('150 Opening data connection')
+        connection = self.data_connection()
+        listing = ''
+        for name in sorted(os.listdir(self.server.root)):
+            stat = os.stat(os.path.join(self.server.root, name))
+            listing += 'type=file;size={};modify={}; {}\r\n'.format(stat.st_size, time.strftime('%Y%m%d%H%M%S', time.gmtime(stat.st_mtime)), name)
+        connection.sendall(listing.encode())
+        connection.close()
+        self.reply('226 Transfer complete')
+
+
+class ftp_standin(socketserver.ThreadingTCPServer):
+    # Class which stands in for the Webin upload area, run in a background thread by the benchmarks or on its own
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, root, port=0, latency=0, bandwidth=None, drop_rate=0, seed=0, handler=ftp_handler):
+        super().__init__(('127.0.0.1', port), handler)
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)           # Seeded, so failures are injected alike in each run
+        os.makedirs(root, exist_ok=True)
+
+    def start(self):
+        """
+        Serve in a background thread
+        :return: Port the server listens on
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+
+if __name__ == '__main__':
+    args = get_args()       # Get script arguments
+    server = ftp_standin(args.root, args.port, args.latency, args.bandwidth, args.drop_rate)
+    print('> Serving {} over FTP on port {}'.format(args.root, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+import argparse, csv, itertools, json, os, random, shlex, shutil, statistics, subprocess, sys, tempfile, time, yaml
+from ftp_standin import ftp_standin
+from webin_standin import webin_standin
+
+SUBMISSION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'bin', 'analysis_submission.py')
+BASE_CONFIG = os.path.join(os.path.dirname(SUBMISSION_SCRIPT), 'config.yaml')
+STAGES = ('hash', 'upload', 'verify', 'xml', 'submit', 'receipt')
+DATA_BLOCK_SIZE = 1024 * 1024
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+MODES = ('batch', 'single')          # Analyses submitted together from a manifest, or one process per analysis as a pipeline does once per sample
+
+
+def get_args():
+    '''
+    Define and obtain script arguments
+    :return: Arguments object
+    '''
+    parser = argparse.ArgumentParser(prog='run_benchmarks.py', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="""
+        + ============================================================ +
+        |  European Nucleotide Archive (ENA) Analysis Submission Tool  |
+        |                                                              |
+        |  Benchmarks of batch and single submissions to local         |
+        |  stand-ins for the Webin upload area and REST API.           |
+        + =========================================================== +
+        """)
+    parser.add_argument('-fs', '--file_sizes', help='Sizes of the data files, comma separated, with an optional K, M or G suffix. Default: 1M,16M', type=str, default='1M,16M', required=False)
+    parser.add_argument('-fc', '--file_counts', help='Numbers of files per analysis, comma separated. Default: 1,4', type=str, default='1,4', required=False)
+    parser.add_argument('-ac', '--analysis_counts', help='Numbers of analyses per batch, comma separated. Default: 1,8', type=str, default='1,8', required=False)
+    parser.add_argument('-md', '--modes', help='How the analyses are submitted, comma separated. Options: batch, from a manifest in one process, or single, running analysis_submission.py once per analysis. Default: batch', type=str, default='batch', required=False)
+    parser.add_argument('-rp', '--repeats', help='Number of times each combination is run. Default: 3', type=int, default=3, required=False)
+    parser.add_argument('-fl', '--ftp_latency', help='Seconds added before each reply of the FTP server. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-fb', '--ftp_bandwidth', help='Maximum bytes per second received by each FTP transfer. Default: no limit', type=float, required=False)
+    parser.add_argument('-fd', '--ftp_drop_rate', help='Probability that an FTP upload is dropped part way through. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-wl', '--webin_latency', help='Seconds taken by the Webin stand-in to answer each request. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-wf', '--webin_failure_rate', help='Probability that a submission is answered with HTTP 500. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-qp', '--queued_polls', help='Polls of a queued submission answered with HTTP 202 before its receipt is returned. Default: 2', type=int, default=2, required=False)
+    parser.add_argument('-sd', '--seed', help='Seed of the data files and of the injected failures. Default: 0', type=int, default=0, required=False)
+    parser.add_argument('-sa', '--submission_args', help='Further arguments for analysis_submission.py, as a single quoted string (e.g. "-uw 4 -hw 2 -as true")', type=str, default='', required=False)
+    parser.add_argument('-wd', '--work_dir', help='Directory to hold the data files and output of each run. Default: a temporary directory, removed afterwards', type=str, required=False)
+    parser.add_argument('-o', '--output', help='JSON file to write the results to', type=str, required=False)
+    parser.add_argument('-bl', '--baseline', help='JSON results of a previous run to compare against. Exits with status 1 if the throughput of a combination falls by more than the tolerance', type=str, required=False)
+    parser.add_argument('-tl', '--tolerance', help='Fraction by which throughput may fall below the baseline before it is reported as a regression. Default: 0.2', type=float, default=0.2, required=False)
+    args = parser.parse_args()
+    unknown = [mode for mode in args.modes.split(',') if mode not in MODES]
+    if unknown:
+        parser.error('unknown modes: {}, options are {}'.format(', '.join(unknown), ', '.join(MODES)))
+    return args
+
+
+def parse_size(size):
+    """
+    Convert a size with an optional K, M or G suffix to bytes
+    :param size: Size (e.g. 16M)
+    :return: Number of bytes
+    """
+    size = size.strip().upper()
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def percentile(values, fraction):
+    """
+    Obtain a percentile of values by the nearest rank method
+    :param values: List of numbers
+    :param fraction: Percentile as a fraction (e.g. 0.99)
+    :return: The percentile, or None if there are no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def create_data_file(path, size, seed):
+    """
+    Write a data file of random bytes, the same for the same size and seed, unless it already exists
+    :param path: Path of the file
+    :param size: Size of the file in bytes
+    :param seed: Seed of the bytes, a string so it is the same in every process
+    """
+    if os.path.isfile(path) and os.path.getsize(path) == size:
+        return
+    generator = random.Random(seed)
+    with open(path + '.tmp', 'wb') as f:
+        for offset in range(0, size, DATA_BLOCK_SIZE):
+            f.write(generator.randbytes(min(DATA_BLOCK_SIZE, size - offset)))           # Random, so the data does not compress any better than real analyses
+    os.replace(path + '.tmp', path)
+
+
+def create_analyses(data_dir, size, file_count, analysis_count, seed):
+    """
+    Create the data files of analyses, each with its own files so none are skipped as shared
+    :param data_dir: Directory to hold the data files
+    :param size: Size of each data file in bytes
+    :param file_count: Number of files per analysis
+    :param analysis_count: Number of analyses
+    :param seed: Seed of the data files
+    :return: List of tuples of the run accession and list of file paths of each analysis
+    """
+    analyses = []
+    for analysis in range(analysis_count):
+        files = []
+        for index in range(file_count):
+            path = os.path.join(data_dir, 'data_{}_{}_{}.txt'.format(size, analysis, index))
+            create_data_file(path, size, '{}-{}-{}-{}'.format(seed, size, analysis, index))
+            files.append(path)
+        analyses.append(('ERR{:07d}'.format(analysis + 1), files))
+    return analyses
+
+
+def write_manifest(manifest, analyses):
+    """
+    Write a manifest of analyses
+    :param manifest: Path of the TSV manifest to write
+    :param analyses: List of tuples of the run accession and list of file paths of each analysis
+    """
+    with open(manifest, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['run_list', 'file', 'analysis_type', 'analysis_date'])
+        for run, files in analyses:
+            writer.writerow([run, ','.join(files), 'PATHOGEN_ANALYSIS', '2024-01-01'])
+
+
+def submission_commands(mode, manifest, analyses, output_dir, submission_args):
+    """
+    Create the commands submitting the analyses of a run
+    :param mode: batch, a single command submitting the manifest, or single, a command per analysis
+    :param manifest: Path of the manifest
+    :param analyses: List of tuples of the run accession and list of file paths of each analysis
+    :param output_dir: Output directory of the run
+    :param submission_args: List of further arguments for analysis_submission.py
+    :return: List of commands, run one after another
+    """
+    common = ['-p', 'PRJEB1', '-au', 'Webin-0', '-ap', 'benchmark', '-o', output_dir, '-t', 'true', '-pv', 'false'] + submission_args           # The SRA schemas would otherwise be downloaded from ENA
+    if mode == 'batch':
+        return [[sys.executable, SUBMISSION_SCRIPT, '-m', manifest] + common]
+    return [[sys.executable, SUBMISSION_SCRIPT, '-r', run, '-f', ','.join(files), '-a', 'PATHOGEN_ANALYSIS', '-ad', '2024-01-01'] + common for run, files in analyses]
+
+
+def write_config(output_dir, ftp_port, webin_url):
+    """
+    Write the configuration of a run, pointing the tool at the stand-in servers
+    :param output_dir: Output directory of the run
+    :param ftp_port: Port of the FTP stand-in
+    :param webin_url: URL of the Webin REST API stand-in
+    """
+    with open(BASE_CONFIG) as f:
+        configuration = yaml.safe_load(f)
+    configuration.update({'WEBIN_FTP_HOST': '127.0.0.1', 'WEBIN_FTP_PORT': ftp_port, 'WEBIN_API_URL': webin_url})
+    with open(os.path.join(output_dir, 'config.yaml'), 'w') as f:
+        yaml.safe_dump(configuration, f)
+
+
+def run_submission(commands, output_dir):
+    """
+    Submit analyses, each command as a separate process so its peak memory use can be measured
+    :param commands: List of commands, run one after another
+    :param output_dir: Output directory of the run
+    :return: Tuple of seconds taken, peak RSS of the largest process in bytes, exit status of the first to fail and number of analyses accessioned
+    """
+    peak, returncode = 0, 0
+    with open(os.path.join(output_dir, 'submission.log'), 'w') as log:
+        start = time.monotonic()
+        for command in commands:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(SUBMISSION_SCRIPT))
+            _, status, usage = os.wait4(process.pid, 0)
+            peak = max(peak, usage.ru_maxrss * 1024)            # ru_maxrss is in kilobytes on Linux
+            returncode = returncode or os.waitstatus_to_exitcode(status)
+        seconds = time.monotonic() - start
+    with open(os.path.join(output_dir, 'submission.log')) as log:
+        accessioned = sum(1 for line in log if line.startswith('> Analysis ID:'))
+    return seconds, peak, returncode, accessioned
+
+
+def read_metrics(output_dir):
+    """
+    Read the durations of each stage recorded by a run
+    :param output_dir: Output directory of the run
+    :return: Dictionary of each stage to a list of durations, and the number of retries
+    """
+    durations, retries = {stage: [] for stage in STAGES}, 0
+    metrics_file = os.path.join(output_dir, 'metrics.jsonl')
+    if not os.path.isfile(metrics_file):
+        return durations, retries
+    with open(metrics_file) as f:
+        for line in f:
+            metric = json.loads(line)
+            durations.setdefault(metric['stage'], []).append(metric['duration'])
+            retries += 1 if metric.get('error') else 0
+    return durations, retries
+
+
+def run_cell(args, work_dir, data_dir, mode, size, file_count, analysis_count):
+    """
+    Run the benchmark of a combination of mode, file size, file count and analysis count
+    :param args: Arguments object
+    :param work_dir: Directory holding the output of each run
+    :param data_dir: Directory holding the data files
+    :param mode: batch or single
+    :param size: Size of each data file in bytes
+    :param file_count: Number of files per analysis
+    :param analysis_count: Number of analyses
+    :return: Dictionary of results
+    """
+    manifest = os.path.join(data_dir, 'manifest_{}_{}_{}.tsv'.format(size, file_count, analysis_count))
+    analyses = create_analyses(data_dir, size, file_count, analysis_count, args.seed)
+    write_manifest(manifest, analyses)
+    total_bytes = size * file_count * analysis_count
+    walls, peaks, durations, failures, retries = [], [], {stage: [] for stage in STAGES}, 0, 0
+    for repeat in range(args.repeats):
+        run_dir = os.path.join(work_dir, 'run_{}_{}_{}_{}_{}'.format(mode, size, file_count, analysis_count, repeat))
+        shutil.rmtree(run_dir, ignore_errors=True)          # Each run starts without a ledger, checksum cache or uploaded files
+        os.makedirs(run_dir)
+        ftp_server = ftp_standin(os.path.join(run_dir, 'upload_area'), latency=args.ftp_latency, bandwidth=args.ftp_bandwidth, drop_rate=args.ftp_drop_rate, seed=args.seed + repeat)
+        webin_server = webin_standin(latency=args.webin_latency, failure_rate=args.webin_failure_rate, queued_polls=args.queued_polls, seed=args.seed + repeat)
+        try:
+            write_config(run_dir, ftp_server.start(), webin_server.start())
+            seconds, peak, status, accessioned = run_submission(submission_commands(mode, manifest, analyses, run_dir, shlex.split(args.submission_args)), run_dir)
+        finally:
+            ftp_server.shutdown()
+            ftp_server.server_close()
+            webin_server.shutdown()
+            webin_server.server_close()
+        if status != 0 or accessioned != analysis_count:
+            failures += 1
+            print('> ERROR - Run {} accessioned {} of {} analyses with status {}, see {}'.format(repeat + 1, accessioned, analysis_count, status, os.path.join(run_dir, 'submission.log')), file=sys.stderr)
+        walls.append(seconds)
+        peaks.append(peak)
+        run_durations, run_retries = read_metrics(run_dir)
+        retries += run_retries
+        for stage, values in run_durations.items():
+            durations.setdefault(stage, []).extend(values)
+
+    wall = statistics.median(walls)
+    return {'mode': mode, 'file_size': size, 'file_count': file_count, 'analysis_count': analysis_count, 'bytes': total_bytes, 'repeats': args.repeats,
+            'failed_runs': failures, 'retries': retries, 'wall_seconds': round(wall, 3), 'throughput': round(total_bytes / wall) if wall > 0 else None,
+            'analyses_per_second': round(analysis_count / wall, 3) if wall > 0 else None, 'peak_rss': max(peaks),
+            'stages': {stage: {'count': len(values), 'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99)} for stage, values in durations.items() if values}}
+
+
+def format_row(result):
+    """
+    Format the results of a combination as a line of the summary table
+    :param result: Dictionary of results
+    :return: Line of text
+    """
+    latencies = ' '.join('{}={:.3f}/{:.3f}'.format(stage, result['stages'][stage]['p50'], result['stages'][stage]['p99']) for stage in STAGES if stage in result['stages'])
+    return '{:>6} {:>9} {:>5} {:>8} {:>9.3f} {:>10.1f} {:>9.1f}  {}'.format(result.get('mode', 'batch'), result['file_size'], result['file_count'], result['analysis_count'], result['wall_seconds'],
+                                                                    (result['throughput'] or 0) / SIZE_UNITS['M'], result['peak_rss'] / SIZE_UNITS['M'], latencies)
+
+
+def compare_baseline(results, baseline_file, tolerance):
+    """
+    Compare throughput against the results of a previous run
+    :param results: List of dictionaries of results
+    :param baseline_file: JSON results of the previous run
+    :param tolerance: Fraction by which throughput may fall before it is a regression
+    :return: List of messages describing regressions
+    """
+    with open(baseline_file) as f:
+        baseline = {(result.get('mode', 'batch'), result['file_size'], result['file_count'], result['analysis_count']): result for result in json.load(f)['results']}          # Results from before modes were added are of batches
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['mode'], result['file_size'], result['file_count'], result['analysis_count']))
+        if previous and previous['throughput'] and result['throughput'] is not None and result['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append('{}: {} x {} byte file(s) in {} analyses: {:.1f} MB/s, down from {:.1f} MB/s'.format(
+                result['mode'], result['file_count'], result['file_size'], result['analysis_count'], result['throughput'] / SIZE_UNITS['M'], previous['throughput'] / SIZE_UNITS['M']))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = get_args()       # Get script arguments
+    sizes = [parse_size(size) for size in args.file_sizes.split(',')]
+    file_counts = [int(count) for count in args.file_counts.split(',')]
+    analysis_counts = [int(count) for count in args.analysis_counts.split(',')]
+    modes = args.modes.split(',')
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='ena_benchmarks_')
+    data_dir = os.path.join(work_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    try:
+        print('{:>6} {:>9} {:>5} {:>8} {:>9} {:>10} {:>9}  {}'.format('mode', 'file_size', 'files', 'analyses', 'wall_s', 'MB/s', 'rss_MB', 'stage p50/p99 seconds'))
+        for mode, size, file_count, analysis_count in itertools.product(modes, sizes, file_counts, analysis_counts):
+            result = run_cell(args, work_dir, data_dir, mode, size, file_count, analysis_count)
+            results.append(result)
+            print(format_row(result), flush=True)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'work_dir')}
+        with open(args.output, 'w') as f:
+            json.dump({'settings': settings, 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print('> Results written to {}'.format(args.output))
+
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print('> REGRESSION - {}'.format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import argparse, http.server, itertools, json, random, re, threading, time, uuid
+
+
+def get_args():
+    '''
+    Define and obtain script arguments
+    :return: Arguments object
+    '''
+    parser = argparse.ArgumentParser(prog='webin_standin.py', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="""
+        + ============================================================ +
+        |  European Nucleotide Archive (ENA) Analysis Submission Tool  |
+        |                                                              |
+        |  Server standing in for the Webin REST API, with injected    |
+        |  latency and failures, for benchmarks.                       |
+        + =========================================================== +
+        """)
+    parser.add_argument('-po', '--port', help='Port to listen on. Default: 8088', type=int, default=8088, required=False)
+    parser.add_argument('-lt', '--latency', help='Seconds taken to answer each request. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-fr', '--failure_rate', help='Probability that a submission is answered with HTTP 500. Default: 0', type=float, default=0, required=False)
+    parser.add_argument('-qp', '--queued_polls', help='Polls of a queued submission answered with HTTP 202 before its receipt is returned. Default: 2', type=int, default=2, required=False)
+    args = parser.parse_args()
+    return args
+
+
+class webin_handler(http.server.BaseHTTPRequestHandler):
+    # Class which answers submissions and receipt polls as the Webin REST API does, accessioning every analysis
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, body, content_type='application/xml'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.failure_rate and self.server.draw() < self.server.failure_rate:
+            return self.reply(500, b'Injected failure', 'text/plain')
+        if self.path.rstrip('/').endswith('/submit/queue'):
+            submission_id = 'ERA-SUBMIT-' + uuid.uuid4().hex
+            with self.server.lock:
+                self.server.queued[submission_id] = [0, body]
+            return self.reply(202, json.dumps({'submissionId': submission_id}).encode(), 'application/json')
+        if self.path.rstrip('/').endswith('/submit'):
+            return self.reply(200, self.server.receipt(body))
+        self.reply(404, b'Not found', 'text/plain')
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        match = re.search(r'/submit/poll/([^/?]+)', self.path)
+        with self.server.lock:
+            queued = self.server.queued.get(match.group(1)) if match else None
+            if queued is not None:
+                queued[0] += 1
+        if queued is None:
+            return self.reply(404, b'Not found', 'text/plain')
+        if queued[0] <= self.server.queued_polls:
+            return self.reply(202, b'{"status": "QUEUED"}', 'application/json')
+        self.reply(200, self.server.receipt(queued[1]))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class webin_standin(http.server.ThreadingHTTPServer):
+    # Class which stands in for the Webin REST API, run in a background thread by the benchmarks or on its own
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0, failure_rate=0, queued_polls=2, seed=0):
+        super().__init__(('127.0.0.1', port), webin_handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.queued_polls = queued_polls
+        self.queued = {}
+        self.accessions = itertools.count(1)
+        self.random = random.Random(seed)           # Seeded, so failures are injected alike in each run
+        self.lock = threading.Lock()
+
+    def draw(self):
+        with self.lock:
+            return self.random.random()
+
+    def receipt(self, body):
+        """
+        Create a successful receipt for a submission, accessioning each analysis it holds
+        :param body: Body of the submission request
+        :return: Receipt XML
+        """
+        analyses = ''
+        for alias in re.findall(rb'<ANALYSIS [^>]*alias="([^"]+)"', body):
+            with self.lock:
+                accession = next(self.accessions)
+            analyses += '<ANALYSIS accession="ERZ{:07d}" alias="{}" status="PRIVATE"/>'.format(accession, alias.decode())
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<RECEIPT receiptDate="{}" submissionFile="submission.xml" success="true">{}'
+                '<SUBMISSION accession="ERA0000001" alias="submission"/><MESSAGES><INFO>Submission has been committed.</INFO></MESSAGES>'
+                '<ACTIONS>ADD</ACTIONS></RECEIPT>').format(time.strftime('%Y-%m-%dT%H:%M:%S'), analyses).encode()
+
+    def start(self):
+        """
+        Serve in a background thread
+        :return: Base URL of the stand-in Webin REST API
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:{}/ena/submit/webin-v2/'.format(self.server_address[1])
+
+
+if __name__ == '__main__':
+    args = get_args()       # Get script arguments
+    server = webin_standin(args.port, args.latency, args.failure_rate, args.queued_polls)
+    print('> Serving the Webin REST API stand-in on http://127.0.0.1:{}/ena/submit/webin-v2/'.format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
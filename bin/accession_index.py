@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import os, sqlite3
+from lazy_modules import lazy_module
+
+csv = lazy_module('csv')            # Imported on first use, as reports are only read when they have changed
+
+INDEX_FILENAME = 'accession_index.sqlite'
+TAIL_SIZE = 4096            # Bytes before the offset of a report kept to check that it was only appended to
+LOOKUP_BATCH_SIZE = 500         # Accessions looked up per query, below the SQLite limit on parameters
+REPORT_COLUMNS = {          # Columns of an ENA report holding accessions, and the kind of each
+    'run_accession': 'run',
+    'sample_accession': 'sample',
+    'secondary_sample_accession': 'sample',
+    'study_accession': 'project',
+    'secondary_study_accession': 'project',
+}
+
+
+class accession_index:
+    # Class which holds the run, sample and project accessions of reports downloaded from ENA in SQLite, so the references of analyses can be checked before upload
+    def __init__(self, parent_dir):
+        self.index_file = os.path.join(parent_dir, INDEX_FILENAME)
+        self.connection = sqlite3.connect(self.index_file, timeout=60)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, header TEXT NOT NULL, '
+                                    'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, offset INTEGER NOT NULL, tail BLOB)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS accessions (accession TEXT PRIMARY KEY, kind TEXT NOT NULL, project TEXT, '
+                                    'report INTEGER NOT NULL) WITHOUT ROWID')           # Project of runs, and the primary accession of secondary project accessions
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(reports)')]
+            if 'tail' not in columns:           # Index written before the end of each read was kept, so its reports are read again
+                self.connection.execute('ALTER TABLE reports ADD COLUMN tail BLOB')
+
+    @staticmethod
+    def report_rows(lines, columns):
+        """
+        Read the accessions of rows of a report
+        :param lines: Iterable of rows of the report
+        :param columns: Header of the report
+        :return: Generator of tuples of accession, kind and project
+        """
+        for row in csv.DictReader(lines, fieldnames=columns, delimiter='\t'):
+            project = row.get('study_accession') or row.get('secondary_study_accession') or None
+            for column, kind in REPORT_COLUMNS.items():
+                if row.get(column):
+                    yield row[column], kind, project if kind != 'sample' else None          # Samples may be shared across projects
+
+    @staticmethod
+    def read_tail(f, offset):
+        """
+        Read the bytes of a report just before an offset
+        :param f: Report file object, opened in binary mode
+        :param offset: Byte position in the report
+        :return: Up to TAIL_SIZE bytes ending at the offset
+        """
+        f.seek(max(offset - TAIL_SIZE, 0))
+        return f.read(offset - f.tell())
+
+    def refresh(self, report):
+        """
+        Bring the index up to date with a report, reading only rows appended since it was last read
+        :param report: Path of a TSV report of ENA accessions, with a header naming its columns
+        :return: Number of rows read
+        """
+        path = os.path.abspath(report)
+        stat = os.stat(path)
+        with open(path, 'rb') as f:           # Binary, so offsets into the report are byte positions
+            header = f.readline().decode()
+            header_end = f.tell()
+            columns = header.rstrip('\r\n').split('\t')
+            if not REPORT_COLUMNS.keys() & set(columns):
+                raise ValueError('{} has none of the columns {}'.format(report, ', '.join(REPORT_COLUMNS)))
+            row = self.connection.execute('SELECT id, header, size, mtime_ns, offset, tail FROM reports WHERE path = ?', (path,)).fetchone()
+            if row is not None and (row[2], row[3]) == (stat.st_size, stat.st_mtime_ns):
+                return 0
+            with self.connection:
+                if row is not None and row[1] == header and row[4] <= stat.st_size and self.read_tail(f, row[4]) == row[5]:
+                    report_id = row[0]          # Reports are appended to, so only rows after the previous read are new, read_tail leaves f there
+                else:
+                    if row is not None:
+                        self.connection.execute('DELETE FROM accessions WHERE report = ?', (row[0],))
+                    report_id = self.connection.execute('INSERT OR REPLACE INTO reports (path, header, size, mtime_ns, offset) VALUES (?, ?, 0, 0, 0)',
+                                                        (path, header)).lastrowid
+                    f.seek(header_end)            # Rewritten rather than appended to, so every row is read again
+                rows = [0]
+
+                def report_lines():
+                    for line in f:
+                        rows[0] += 1
+                        yield line.decode()
+
+                self.connection.executemany('INSERT OR REPLACE INTO accessions (accession, kind, project, report) VALUES (?, ?, ?, ?)',
+                                            (entry + (report_id,) for entry in self.report_rows(report_lines(), columns)))          # Streamed, so memory use does not grow with the report
+                offset = f.tell()
+                self.connection.execute('UPDATE reports SET size = ?, mtime_ns = ?, offset = ?, tail = ? WHERE id = ?',
+                                        (stat.st_size, stat.st_mtime_ns, offset, self.read_tail(f, offset), report_id))
+        return rows[0]
+
+    def lookup(self, accessions):
+        """
+        Look up accessions in the index, several to a query rather than one query each
+        :param accessions: Iterable of accessions
+        :return: Dictionary of each accession found to a tuple of its kind and project
+        """
+        accessions = sorted(set(accessions))            # Sorted, so each query reads neighbouring pages of the index
+        found = {}
+        for start in range(0, len(accessions), LOOKUP_BATCH_SIZE):
+            batch = accessions[start:start + LOOKUP_BATCH_SIZE]
+            rows = self.connection.execute('SELECT accession, kind, project FROM accessions WHERE accession IN ({})'.format(', '.join('?' * len(batch))), batch)
+            found.update((accession, (kind, project)) for accession, kind, project in rows)
+        return found
+
+    def reference_errors(self, analyses):
+        """
+        Check the references of analyses against the index, runs belonging to the project of their analysis
+        :param analyses: List of dictionaries of analysis information
+        :return: List of lists of error messages, one per analysis, empty for analyses whose references are all known
+        """
+        projects = [(analysis.get('project') or '').split(',') for analysis in analyses]          # An analysis may reference several projects, separated by commas
+        found = self.lookup(accession for analysis, analysis_projects in zip(analyses, projects) for accession in analysis_projects + list(analysis.get('run_list') or []) + list(analysis.get('sample_list') or []))
+        errors = []
+        for analysis, analysis_projects in zip(analyses, projects):
+            analysis_errors = []
+            known_projects = set()
+            for accession in analysis_projects:
+                project = found.get(accession, (None, None))
+                if project[0] != 'project':
+                    analysis_errors.append('project {} is not in the accession index'.format(accession))
+                else:
+                    known_projects.add(project[1])
+            for kind, accessions in (('run', analysis.get('run_list') or []), ('sample', analysis.get('sample_list') or [])):
+                for accession in accessions:
+                    entry = found.get(accession, (None, None))
+                    if entry[0] != kind:
+                        analysis_errors.append('{} {} is not in the accession index'.format(kind, accession))
+                    elif kind == 'run' and known_projects and entry[1] not in known_projects | {None}:
+                        analysis_errors.append('run {} belongs to project {}, not {}'.format(accession, entry[1], analysis.get('project')))
+            errors.append(analysis_errors)
+        return errors
+
+    def close(self):
+        self.connection.close()
@@ -2,26 +2,55 @@
 
 __author__ = "Nadim Rahman"
 
-import argparse, hashlib, json, os, subprocess, sys, time, yaml
-import xml.etree.ElementTree as ET
+import argparse, logging, marshal, os, sys, time
+from collections import namedtuple
 from datetime import datetime
-from sra_objects import createWebinXML
+from accession_index import accession_index
+from checksum_cache import checksum_cache
+from lazy_modules import lazy_module
+from receipt_poller import POLL_TIMEOUT, receipt_poller
+from retry import SUBMISSION_RETRY, UPLOAD_RETRY, PermanentError, TransientError, http_error
+from ftp_upload import WEBIN_FTP_HOST, WEBIN_FTP_PORT, ftp_connection_pool, ftp_uploader, format_throughput, upload_inventory, upload_state
+from preflight_validation import UNKNOWN_MD5, check_accessions, preflight_validator
+from sra_objects import createBatchWebinXML, createWebinXML
+from stream_compression import COMPRESSION_WORKERS, compression_for
+from submission_ledger import submission_ledger
+from submission_metrics import METRICS, METRICS_FILENAME
+from webin_client import WEBIN_TIMEOUT, webin_session
 
-import logging
-import sys
-
-#Creating and Configuring Logger
+# Imported on first use, as many invocations, such as --help or a single analysis from a pipeline, need few of them
+asyncio = lazy_module('asyncio')
+csv = lazy_module('csv')
+ET = lazy_module('xml.etree.ElementTree')
+ftplib = lazy_module('ftplib')
+futures = lazy_module('concurrent.futures')
+hashlib = lazy_module('hashlib')
+http_client = lazy_module('http.client')
+json = lazy_module('json')
+yaml = lazy_module('yaml')
 
 Log_Format = "%(levelname)s %(asctime)s - %(message)s"
+logger = logging.getLogger()
 
-logging.basicConfig(stream = sys.stdout, 
-                    filemode = "w",
-                    format = Log_Format, 
-                    level = logging.DEBUG)
+CONFIG_CACHE_FILENAME = 'config_cache.marshal'
+MD5_CHUNK_SIZE = 8 * 1024 * 1024          # Bytes read per chunk when calculating checksums, bounds memory regardless of file size
+ANALYSIS_TYPES = ['PATHOGEN_ANALYSIS', 'COVID19_CONSENSUS', 'COVID19_FILTERED_VCF', 'PHYLOGENY_ANALYSIS']            # Can add more options if you wish to share more analysis types
+analysis_result = namedtuple('analysis_result', ['alias', 'state', 'accession', 'submission_id', 'error', 'timings'])           # Outcome of an analysis, with the seconds spent in each stage
 
-logger = logging.getLogger()
+def positive_int(value):
+    '''
+    Argument type for counts which must be at least 1, such as numbers of workers
+    :param value: Argument value
+    :return: Integer value
+    '''
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid int value: {!r}'.format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, got {}'.format(number))
+    return number
 
-logger.debug("analysis_submission: ")
 
 def get_args():
     '''
@@ -40,36 +69,87 @@ def get_args():
     parser.add_argument('-p', '--project', help='Valid ENA project accession to submit analysis to (e.g. PRJXXXXXXX)', type=str, required=True)
     parser.add_argument('-s', '--sample_list', help='ENA sample accessions/s to link with the analysis submission, accepts a list of accessions (e.g. ERSXXXXX,ERSXXXXX) or a file with list of accessions separated by new line', required=False)
     parser.add_argument('-r', '--run_list', help='ENA run accession/s to link with the analysis submission, accepts a list of accessions (e.g. ERRXXXXX,ERRXXXXX) or a file with a list of accessions separated by new line', required=False)
-    parser.add_argument('-f', '--file', help='Files of analysis to submit to the project, accepts a list of files (e.g. path/to/file1.csv.gz,path/to/file2.txt.gz)', type=str, required=True)
-    parser.add_argument('-a', '--analysis_type', help='Type of analysis to submit. Options: PATHOGEN_ANALYSIS, COVID19_CONSENSUS, COVID19_FILTERED_VCF, PHYLOGENY_ANALYSIS', choices=['PATHOGEN_ANALYSIS', 'COVID19_CONSENSUS', 'COVID19_FILTERED_VCF', 'PHYLOGENY_ANALYSIS'], required=True)         # Can add more options if you wish to share more analysis types
-    parser.add_argument('-au', '--analysis_username', help='Valid Webin submission account ID (e.g. Webin-XXXXX) used to carry out the submission', type=str, required=True)
-    parser.add_argument('-ap', '--analysis_password', help='Password for Webin submission account', type=str, required=True)
+    parser.add_argument('-f', '--file', help='Files of analysis to submit to the project, accepts a list of files (e.g. path/to/file1.csv.gz,path/to/file2.txt.gz). Required unless a manifest is provided', type=str, required=False)
+    parser.add_argument('-a', '--analysis_type', help='Type of analysis to submit. Options: PATHOGEN_ANALYSIS, COVID19_CONSENSUS, COVID19_FILTERED_VCF, PHYLOGENY_ANALYSIS. Required unless a manifest is provided', choices=ANALYSIS_TYPES, required=False)
+    parser.add_argument('-m', '--manifest', help='TSV (with header) or JSON file describing several analyses to submit in batch, one per row/object, with fields run_list, sample_list, file, analysis_type and analysis_date, and optionally project', type=str, required=False)
     parser.add_argument('-ad', '--analysis_date', help='Specify date of analysis', type=str, required=False)
-    parser.add_argument('-o', '--output_location', help='A parent directory to pull configuration file and store outputs.', type=str, required=False)
-    parser.add_argument('-as', '--asynchronous', help='Specify usage of the asynchronous Webin API for submissions. Options are true/t or false/f. Default: false/f', type=str.lower, choices=['true', 't', 'false', 'f'], required=False)
-    parser.add_argument('-t', '--test', help='Specify whether to use ENA test server for submission. Options are true/t or false/f', type=str.lower, choices=['true', 't', 'false', 'f'], required=True)
+    add_submission_arguments(parser)
     args = parser.parse_args()
+    if args.manifest is None and (args.file is None or args.analysis_type is None):
+        parser.error('the following arguments are required without a manifest: -f/--file, -a/--analysis_type')
 
     if args.test in ['true', 't']:
         args.test = True
     elif args.test in ['false', 'f']:
         args.test = False
-    logger.debug("args: %s", args)    
     return args
 
 
+def add_submission_arguments(parser):
+    '''
+    Define the arguments shared by single, batch and server submissions, covering the Webin account and how analyses are processed
+    :param parser: Argument parser object
+    '''
+    parser.add_argument('-cs', '--chunk_size', help='Maximum number of analyses from a manifest or server jobs to include in each Webin XML and submission. Default: 500', type=positive_int, default=500, required=False)
+    parser.add_argument('-au', '--analysis_username', help='Valid Webin submission account ID (e.g. Webin-XXXXX) used to carry out the submission', type=str, required=True)
+    parser.add_argument('-ap', '--analysis_password', help='Password for Webin submission account', type=str, required=True)
+    parser.add_argument('-o', '--output_location', help='A parent directory to pull configuration file and store outputs.', type=str, required=False)
+    parser.add_argument('-as', '--asynchronous', help='Specify usage of the asynchronous Webin API for submissions. Options are true/t or false/f. Default: false/f', type=str.lower, choices=['true', 't', 'false', 'f'], required=False)
+    parser.add_argument('-hw', '--hash_workers', help='Number of processes used to calculate MD5 checksums of analysis files in parallel. Default: 1', type=positive_int, default=1, required=False)
+    parser.add_argument('-cc', '--checksum_cache', help='Specify usage of a persistent checksum cache in the output location, so unchanged files are not hashed again. Options are true/t or false/f. Default: true/t', type=str.lower, choices=['true', 't', 'false', 'f'], default='true', required=False)
+    parser.add_argument('-pv', '--preflight', help='Specify validation of the Webin XML against the SRA schemas before any files are uploaded. The schemas are downloaded to the output location on first use. Options are true/t or false/f. Default: true/t', type=str.lower, choices=['true', 't', 'false', 'f'], default='true', required=False)
+    parser.add_argument('-ai', '--accession_index', help='TSV reports of ENA accessions with a header, comma separated (e.g. from the ENA portal API with fields run_accession, sample_accession and study_accession). The runs, samples and project of each analysis are checked against them before any files are uploaded. Reports are indexed in the output location, reading only rows appended since the previous run', type=str, required=False)
+    parser.add_argument('-mt', '--metrics', help='Specify recording of the duration, size, throughput, retries and queue wait of each hashing, upload, verification, Webin XML build, submission and receipt as JSON lines in {} in the output location. Options are true/t or false/f. Default: true/t'.format(METRICS_FILENAME), type=str.lower, choices=['true', 't', 'false', 'f'], default='true', required=False)
+    parser.add_argument('-pm', '--prometheus_file', help='Path of a file to write totals of the metrics to in the Prometheus text format, e.g. for the node exporter textfile collector', type=str, required=False)
+    parser.add_argument('-ld', '--ledger', help='Specify usage of a submission ledger in the output location, so a rerun skips analyses and files which were already processed. Options are true/t or false/f. Default: true/t', type=str.lower, choices=['true', 't', 'false', 'f'], default='true', required=False)
+    parser.add_argument('-cz', '--compress', help='Specify compression of uncompressed analysis files as they are uploaded, with BGZF for VCF files and gzip for others. The Webin XML is then built after upload, with the checksums of the compressed files. Options are true/t or false/f. Default: false/f', type=str.lower, choices=['true', 't', 'false', 'f'], default='false', required=False)
+    parser.add_argument('-cw', '--compression_workers', help='Number of threads compressing each file being uploaded. Default: {}'.format(COMPRESSION_WORKERS), type=positive_int, default=COMPRESSION_WORKERS, required=False)
+    parser.add_argument('-uw', '--upload_workers', help='Number of files to upload to Webin concurrently, each over its own pooled FTP connection. Default: 1', type=positive_int, default=1, required=False)
+    parser.add_argument('-vs', '--verification', help='Strategy used to verify uploaded files. size: compare the MD5 of the bytes sent and the remote file size, sampled: additionally compare byte ranges read back from the upload area, download: download each file in full to compare MD5 values. Default: size', choices=['size', 'sampled', 'download'], default='size', required=False)
+    parser.add_argument('-pt', '--poll_timeout', help='Seconds to poll for the receipts of submissions made with the asynchronous Webin API, 0 to skip polling. Default: {}'.format(POLL_TIMEOUT), type=int, default=POLL_TIMEOUT, required=False)
+    parser.add_argument('-wt', '--webin_timeout', help='Seconds to wait on the Webin REST API before a request is abandoned. Default: {}'.format(WEBIN_TIMEOUT), type=int, default=WEBIN_TIMEOUT, required=False)
+    parser.add_argument('-l', '--log_level', help='Level of logging output, XML documents are only logged at DEBUG. Default: INFO', type=str.upper, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', required=False)
+    parser.add_argument('-t', '--test', help='Specify whether to use ENA test server for submission. Options are true/t or false/f', type=str.lower, choices=['true', 't', 'false', 'f'], required=True)
+
+
 def read_config(parent_dir):
     """
-    Read in the configuration file
+    Read in the configuration file, from a snapshot of it parsed by a previous run while the file is unchanged
     :param parent_dir: The optional parent directory which houses the configuration file
     :return: A dictionary referring to tool configuration
     """
     config_file = os.path.join(parent_dir, 'config.yaml')
+    cache_file = os.path.join(parent_dir, CONFIG_CACHE_FILENAME)
+    stat = os.stat(config_file)
+    try:
+        with open(cache_file, 'rb') as f:
+            mtime_ns, size, configuration = marshal.load(f)
+        if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size):            # Parsed from the configuration file as it is now
+            return configuration
+    except (OSError, EOFError, ValueError, TypeError):
+        pass            # No snapshot, or one written by another version of Python
+
     with open(config_file) as f:
         configuration = yaml.safe_load(f)
+    try:
+        snapshot = marshal.dumps((stat.st_mtime_ns, stat.st_size, configuration))
+        temporary_file = '{}.{}.tmp'.format(cache_file, os.getpid())          # Named per process, as many runs may share an output location
+        with open(temporary_file, 'wb') as f:
+            f.write(snapshot)
+        os.replace(temporary_file, cache_file)
+    except (OSError, ValueError):
+        pass            # Read-only output locations, or values such as dates which marshal cannot hold, are parsed each time
     return configuration
 
 
+def configure_logging(level):
+    """
+    Send logging output to standard output, set up by the scripts rather than on import so the tool can be used as a library
+    :param level: Name of the logging level (e.g. INFO)
+    """
+    logging.basicConfig(stream=sys.stdout, format=Log_Format, level=level)
+
+
 def convert_to_list(string):
     """
     Convert a string to a list by a particular separator
@@ -88,10 +168,166 @@ def convert_to_list(string):
     return li
 
 
+def open_metrics(args):
+    """
+    Start recording metrics as specified by the script arguments
+    :param args: Script arguments
+    """
+    METRICS.open(os.path.join(args.output_location, METRICS_FILENAME) if args.metrics in ['true', 't'] else None, args.prometheus_file)
+
+
+def remote_file_name(file):
+    """
+    Obtain the name of a data file in the upload area
+    :param file: Dictionary of information on the file
+    :return: File name, with the extension of any compression applied on upload
+    """
+    return file.get('remote_name') or os.path.basename(file.get('name'))
+
+
+def local_md5(file):
+    """
+    Obtain the MD5 value of a data file as it is on disk, which identifies it across runs
+    :param file: Dictionary of information on the file
+    :return: MD5 checksum value
+    """
+    return file.get('source_md5') or file.get('md5_value')
+
+
+def md5_checksum(file, chunk_size=MD5_CHUNK_SIZE):
+    """
+    Calculate the MD5 checksum of a file, reading it in fixed size chunks into a reusable buffer
+    :param file: Path of the file to checksum
+    :param chunk_size: Number of bytes to read at a time
+    :return: MD5 checksum value
+    """
+    md5 = hashlib.md5()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            md5.update(view[:size])
+    return md5.hexdigest()
+
+
+def read_manifest(manifest, project):
+    """
+    Read the analyses to submit in batch from a manifest
+    :param manifest: TSV file with a header line or JSON file with a list of objects, describing an analysis per row/object
+    :param project: Project accession used for analyses which do not specify their own
+    :return: List of dictionaries of analysis information
+    """
+    with open(manifest) as f:
+        if manifest.lower().endswith('.json'):
+            rows = json.load(f)
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ValueError('Manifest {} must hold a list of objects, one per analysis'.format(manifest))
+        else:
+            rows = list(csv.DictReader(f, delimiter='\t'))
+
+    return [read_analysis(row, project, 'Analysis {} of manifest {}'.format(line, manifest)) for line, row in enumerate(rows, 1)]
+
+
+def read_analysis(row, project, description):
+    """
+    Read the information of an analysis from a row of a manifest or a job
+    :param row: Dictionary of analysis fields, lists given either as lists or comma separated strings
+    :param project: Project accession used if the analysis does not specify its own
+    :param description: Description of the analysis for error messages
+    :return: Dictionary of analysis information
+    """
+    analysis = {'project': row.get('project') or project, 'analysis_type': row.get('analysis_type'), 'analysis_date': row.get('analysis_date') or None}
+    for field in ('run_list', 'sample_list', 'file'):
+        value = row.get(field) or ""
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        analysis[field] = value if value else ""            # Empty references are held as an empty string, as for single submissions
+    if analysis['analysis_type'] not in ANALYSIS_TYPES:
+        raise ValueError('{} has an invalid analysis type: {}'.format(description, analysis['analysis_type']))
+    if not analysis['file']:
+        raise ValueError('{} has no files'.format(description))
+    if not analysis['project']:
+        raise ValueError('{} has no project'.format(description))
+    errors = check_accessions(analysis['project'], analysis['run_list'], analysis['sample_list'])
+    if errors:
+        raise ValueError('{} has {}'.format(description, ', '.join(errors)))
+    return analysis
+
+
+def check_references(analyses, args):
+    """
+    Check the references of analyses against the accession index, updated with the reports given
+    :param analyses: List of dictionaries of analysis information
+    :param args: Script arguments
+    :return: List of the analyses whose references are all known, the others are given an error
+    """
+    index = accession_index(args.output_location)
+    try:
+        for report in args.accession_index.split(','):
+            index.refresh(report)
+        errors = index.reference_errors(analyses)
+    finally:
+        index.close()
+
+    checked = []
+    for analysis, analysis_errors in zip(analyses, errors):
+        if analysis_errors:
+            print("Analysis {} has invalid references, not submitting: {}".format(analysis.get('alias'), '; '.join(analysis_errors)), file=sys.stderr)
+            analysis['error'] = 'Invalid references: {}'.format('; '.join(analysis_errors))
+        else:
+            checked.append(analysis)
+    return checked
+
+
+def alias_stem(configuration, runs, samples):
+    """
+    Create the part of an alias which identifies an analysis across runs of the tool
+    :param configuration: A dictionary referring to tool configuration
+    :param runs: List of run accessions referenced by the analysis
+    :param samples: List of sample accessions referenced by the analysis
+    :return: Alias string without a timestamp
+    """
+    if len(runs) == 1:
+        alias = str(configuration['ALIAS']) + '_' + str(runs[0])
+        if samples != "" and len(samples) == 1:         # If there is a single sample reference provided, add this to the alias
+            alias += '_' + str(samples[0])
+    else:
+        alias = str(configuration['ALIAS'])
+    return alias
+
+
+def create_alias(configuration, runs, samples, timestamp_now):
+    """
+    Create an appropriate alias to tag a submission
+    :param configuration: A dictionary referring to tool configuration
+    :param runs: List of run accessions referenced by the analysis
+    :param samples: List of sample accessions referenced by the analysis
+    :param timestamp_now: Formatted date and time string of the submission
+    :return: Alias string
+    """
+    return alias_stem(configuration, runs, samples) + "_" + str(timestamp_now)
+
+
+def timed_md5_checksum(file):
+    """
+    Calculate the MD5 value of a file, timing the calculation, so the time it waited for a worker can be told from the time spent hashing
+    :param file: Path of the file
+    :return: Tuple of MD5 checksum value, time the calculation started and its duration in seconds
+    """
+    started = time.time()           # Wall clock time, comparable across worker processes
+    return md5_checksum(file), started, time.time() - started
+
+
 class file_handling:
-    def __init__(self, file_list, file_type):
+    def __init__(self, file_list, file_type, workers=1, cache=None, compress=False):
         self.file_list = file_list
         self.type = file_type
+        self.workers = workers
+        self.cache = cache
+        self.compress = compress
 
     def calculate_md5(self, file):
         """
@@ -100,16 +336,56 @@ class file_handling:
         :return: MD5 checksum value
         """
         print(file)
-        return hashlib.md5(open(file, 'rb').read()).hexdigest()
+        return md5_checksum(file)
+
+    def calculate_checksums(self):
+        """
+        Calculate MD5 values for all analysis data files, using a pool of processes when more than one worker is requested
+        and skipping files whose checksum is held in the checksum cache
+        :return: Dictionary of file name to MD5 checksum value
+        """
+        checksums = {}
+        identities = {}
+        if self.cache is not None:
+            for file in self.file_list:
+                identities[file] = self.cache.file_identity(file)      # Identity is taken before hashing, so a file modified meanwhile is not cached as unchanged
+                cached_md5 = self.cache.lookup(identities[file])
+                if cached_md5 is not None:
+                    print('{} (cached)'.format(file))
+                    checksums[file] = cached_md5
+        to_hash = [file for file in dict.fromkeys(self.file_list) if file not in checksums]
+
+        submitted = time.time()
+        if self.workers > 1 and len(to_hash) > 1:
+            with futures.ProcessPoolExecutor(max_workers=min(self.workers, len(to_hash))) as executor:
+                timed = dict(zip(to_hash, executor.map(timed_md5_checksum, to_hash)))
+        else:
+            timed = {}
+            for file in to_hash:
+                started = time.time()
+                timed[file] = (self.calculate_md5(file), started, time.time() - started)
+        hashed = {}
+        for file, (file_md5, started, duration) in timed.items():
+            METRICS.record('hash', duration, file=os.path.basename(file), bytes=os.path.getsize(file), queue_wait=max(started - submitted, 0))
+            hashed[file] = file_md5
+
+        if self.cache is not None:
+            for file, file_md5 in hashed.items():
+                self.cache.store(identities[file], file_md5)
+        checksums.update(hashed)
+        return checksums
 
-    def construct_file_info(self):
+    def construct_file_info(self, checksums=None):
         """
         Construct information on analysis data file(s) to be submitted
+        :param checksums: Optional dictionary of file name to MD5 checksum value, for files already hashed
         :return: List of dictionary/ies consisting of file information
         """
         files_information = []
+        if checksums is None:
+            checksums = self.calculate_checksums()          # Calculate an MD5 checksum value for each file to be submitted
         for file in self.file_list:             # To be changed in future with dictionary of file types
-            file_md5 = self.calculate_md5(file)  # Calculate an MD5 checksum value for file to be submitted
+            file_md5 = checksums[file]
             if self.type == "COVID19_CONSENSUS":
                 file_type = "fasta"
             elif self.type == "COVID19_FILTERED_VCF":
@@ -118,12 +394,16 @@ class file_handling:
                 file_type = "other"
             file_information = {'name': file, 'type': file_type,
                                 'md5_value': file_md5}  # Create dictionary of information
+            compression = compression_for(file, file_type) if self.compress else None
+            if compression is not None:
+                # The MD5 value of the compressed file is only known once it has been uploaded
+                file_information.update({'md5_value': None, 'source_md5': file_md5, 'compression': compression, 'remote_name': os.path.basename(file) + '.gz'})
             files_information.append(file_information)
         return files_information
 
 
 class upload_and_submit:
-    def __init__(self, analysis_file, analysis_username, analysis_password, datestamp, parent_dir, api_service, test):
+    def __init__(self, analysis_file, analysis_username, analysis_password, datestamp, parent_dir, api_service, test, upload_workers=1, ftp_host=WEBIN_FTP_HOST, ftp_port=WEBIN_FTP_PORT, ftp_pool=None, verification='size', analyses=None, webin=None, webin_url=None, webin_timeout=WEBIN_TIMEOUT, poll_timeout=0, ledger=None, alias=None, inventory=None, compression_workers=COMPRESSION_WORKERS):
         self.analysis_file = analysis_file
         self.analysis_username = analysis_username
         self.analysis_password = analysis_password
@@ -131,182 +411,865 @@ class upload_and_submit:
         self.parent_dir = parent_dir
         self.api_service = api_service
         self.test = test
+        self.upload_workers = upload_workers
+        self.verification = verification
+        self.analyses = analyses            # Information on each analysis when several are submitted together
+        self.poll_timeout = poll_timeout
+        self.submission_id = None           # Set when a submission is made with the asynchronous Webin API
+        self.queued_at = None           # Time the submission was queued by this run, to measure how long Webin takes to process it
+        self.ledger = ledger
+        self.alias = alias
+        self.compression_workers = compression_workers
+        self.sent = {}          # MD5 value and size of the bytes sent for each file name, which differ from the local file where it was compressed
+        self.owns_webin = webin is None
+        self.webin = webin if webin is not None else webin_session(analysis_username, analysis_password, test, webin_url, webin_timeout)
+        self.owns_ftp_pool = ftp_pool is None          # A pool passed in is shared with other submissions and is left open
+        self.ftp_pool = ftp_pool if ftp_pool is not None else ftp_connection_pool(analysis_username, analysis_password, upload_workers, ftp_host, ftp_port)
+        if inventory is None and ledger is not None:
+            inventory = upload_inventory(ftp_uploader(self.ftp_pool))           # Only listed if a file is found in the ledger
+        self.inventory = inventory
+
+    def aliases(self):
+        """
+        Obtain the aliases of the analyses in this submission
+        :return: List of aliases
+        """
+        if self.analyses is not None:
+            return [analysis.get('alias') for analysis in self.analyses]
+        return [self.alias] if self.alias is not None else []
+
+    def update_ledger(self, state, submission_id=None, accessions=None):
+        """
+        Record that the analyses of this submission have completed a stage
+        :param state: Stage the analyses have completed
+        :param submission_id: Optional submission ID from the asynchronous Webin API
+        :param accessions: Optional dictionary of alias to analysis accession
+        """
+        if self.ledger is None:
+            return
+        for alias in self.aliases():
+            self.ledger.update_analysis(alias, state, submission_id, (accessions or {}).get(alias))
+
+    def record_error(self, error):
+        """
+        Record why the submission of the analyses failed, for reporting back to whoever requested them
+        :param error: Error message
+        """
+        for analysis in self.analyses or []:
+            analysis['error'] = error
+
+    def file_verified(self, file):
+        """
+        Check whether a data file with the same name and MD5 was uploaded and verified before, and is still in the upload area
+        :param file: Dictionary of information on the file
+        :return: Boolean
+        """
+        remote_name = remote_file_name(file)
+        entry = self.ledger.file_entry(local_md5(file), remote_name) if self.ledger is not None else None
+        if entry is None or entry['state'] != 'verified':
+            return False
+        if file.get('compression') is not None and entry['md5_sent'] is None:
+            return False
+        size_sent = entry['size_sent'] if entry['size_sent'] is not None else os.path.getsize(file.get('name'))
+        if self.inventory is not None:
+            try:
+                if self.inventory.size(remote_name) != size_sent:
+                    return False
+            except ftplib.all_errors:
+                return False
+        self.sent[file.get('name')] = (entry['md5_sent'] or local_md5(file), size_sent)
+        return True
+
+    def update_file_ledger(self, file, state, result):
+        """
+        Record that a data file has completed a stage
+        :param file: Dictionary of information on the file
+        :param state: Stage the file has completed
+        :param result: Dictionary of transfer information for the file
+        """
+        self.sent[file.get('name')] = (result.get('md5'), result.get('bytes'))
+        if self.ledger is not None:
+            self.ledger.update_file(local_md5(file), remote_file_name(file), state, result.get('md5'), result.get('bytes'))
+        if self.inventory is not None and state == 'verified':
+            self.inventory.record(remote_file_name(file), result.get('bytes'))
+
+    def declare_checksums(self, analysis_file):
+        """
+        Set the MD5 values of files compressed on upload to those of the bytes sent, for the analysis XML
+        :param analysis_file: List of dictionaries of file information
+        """
+        for file in analysis_file:
+            if file.get('compression') is not None:
+                file['md5_value'] = self.sent.get(file.get('name'), (None, None))[0]
+
+    def upload_attempt(self, uploader, file, state=None, retries=0, queue_wait=None):
+        """
+        Upload a data file once, recording its metrics
+        :param uploader: FTP uploader object holding the connection pool
+        :param file: Dictionary of information on the file to upload
+        :param state: Optional upload state object, to resume an interrupted transfer
+        :param retries: Number of earlier attempts to upload the file
+        :param queue_wait: Optional seconds the upload waited for a worker
+        :return: Dictionary of transfer information for the file
+        """
+        start, position = time.monotonic(), state.position if state is not None else 0
+        try:
+            result = uploader.upload_file(file.get('name'), remote_file_name(file), state, file.get('compression'))
+        except ftplib.all_errors as e:
+            sent = state.position - position if state is not None and file.get('compression') is None else None           # Bytes which arrived before the transfer was interrupted
+            METRICS.record('upload', time.monotonic() - start, file=remote_file_name(file), bytes=sent, retries=retries, queue_wait=queue_wait, error=str(e))
+            raise
+        METRICS.record('upload', result.get('seconds'), file=remote_file_name(file), bytes=result.get('bytes') - result.get('resumed_from', 0), retries=retries, queue_wait=queue_wait)
+        return result
+
+    def verify_upload(self, uploader, file, result):
+        """
+        Check the integrity of an uploaded data file according to the verification strategy, recording its metrics
+        :param uploader: FTP uploader object holding the connection pool
+        :param file: Dictionary of information on the uploaded file
+        :param result: Dictionary of transfer information for the file
+        :return: Error message, or None if the file was uploaded intact
+        """
+        start = time.monotonic()
+        try:
+            error = self.compare_upload(uploader, file, result)
+        except ftplib.all_errors as e:
+            METRICS.record('verify', time.monotonic() - start, file=result.get('remote_name'), error=str(e))
+            raise
+        METRICS.record('verify', time.monotonic() - start, file=result.get('remote_name'), error=error)
+        return error
+
+    def compare_upload(self, uploader, file, result):
+        """
+        Compare an uploaded data file with the file sent according to the verification strategy
+        :param uploader: FTP uploader object holding the connection pool
+        :param file: Dictionary of information on the uploaded file
+        :param result: Dictionary of transfer information for the file
+        :return: Error message, or None if the file was uploaded intact
+        """
+        md5uploaded = file.get('md5_value')         # The MD5 calculated before the file upload
+        if file.get('compression') is not None:
+            md5uploaded = result.get('md5')         # Compressed as it was sent, so there is no earlier MD5 to compare with
+        remote_name = result.get('remote_name')
+
+        if self.verification == 'download':
+            downloadmd5 = uploader.download_md5(remote_name)       # Obtain the MD5 of the submitted file
+            logger.debug('MD5 of %s: %s sent, %s in the upload area', remote_name, md5uploaded, downloadmd5)
+            if md5uploaded != downloadmd5:
+                return 'MD5 mismatch, expected {} but found {} in the upload area'.format(md5uploaded, downloadmd5)
+            return None
+
+        # The bytes sent must hash to the MD5 in the analysis XML and all of them must have arrived
+        if md5uploaded != result.get('md5'):
+            return 'MD5 mismatch, expected {} but {} was sent, the file may have changed since it was hashed'.format(md5uploaded, result.get('md5'))
+        remote_size = uploader.remote_size(remote_name)
+        if remote_size != result.get('bytes'):
+            return 'Size mismatch, {} bytes were sent but {} bytes are in the upload area'.format(result.get('bytes'), remote_size)
+
+        if self.verification == 'sampled' and file.get('compression') is None:
+            mismatched = uploader.compare_samples(file.get('name'), remote_name, remote_size)
+            if mismatched:
+                return 'Byte ranges at offsets {} differ from the file in the upload area'.format(mismatched)
+        return None
+
+    def transfer_file(self, uploader, file, state=None, attempts=0):
+        """
+        Upload a data file to ENA and check its integrity, retrying the file on failure
+        :param uploader: FTP uploader object holding the connection pool
+        :param file: Dictionary of information on the file to upload
+        :param state: Optional upload state object of an interrupted earlier attempt, so the transfer resumes from it
+        :param attempts: Number of earlier attempts to upload the file
+        :return: Error message, or None if the file was uploaded intact
+        """
+        if self.file_verified(file):
+            print("Analysis file {} was already uploaded and verified, skipping".format(file.get('name')))
+            return None
+
+        state = state if state is not None else upload_state()          # Kept across attempts so an interrupted transfer resumes rather than starting again
+
+        def attempt():
+            nonlocal state, attempts
+            attempts += 1
+            try:
+                result = self.upload_attempt(uploader, file, state, attempts - 1)
+            except (FileNotFoundError, IsADirectoryError, PermissionError) as e:
+                raise PermanentError('Cannot read file: {}'.format(e))
+            except ftplib.error_perm as e:
+                raise PermanentError('Transfer refused: {}'.format(e))          # 5xx reply, e.g. the login or file name was rejected
+            except ftplib.all_errors as e:
+                raise TransientError('Transfer interrupted: {}'.format(e))
+            print("Uploaded {}".format(format_throughput(result)))
+            self.update_file_ledger(file, 'uploaded', result)
+            try:
+                error = self.verify_upload(uploader, file, result)
+            except ftplib.all_errors as e:
+                raise TransientError('Verification failed: {}'.format(e))
+            if error is not None:
+                state = upload_state()          # The copy in the upload area is not intact, so it is replaced in full
+                raise TransientError(error)
+            self.update_file_ledger(file, 'verified', result)
+
+        try:
+            UPLOAD_RETRY.run(attempt, 'upload analysis file {}'.format(file.get('name')))
+        except (TransientError, PermanentError) as e:
+            print("Analysis file {} could not be uploaded: {}".format(file.get('name'), e), file=sys.stderr)
+            return str(e)
+        return None
 
-    def upload_to_ENA(self, trialcount):
+    def upload_to_ENA(self):
         """
         Upload data file(s) to ENA
-        :param trialcount: Submission attempt number
         :return: Lists of successful file upload and list of any errors during upload
         """
         upload_errors = []
         upload_success = []
 
-        # Process each file that needs to be submitted
-        for file in self.analysis_file:
-            command = "curl -T {}  ftp://webin.ebi.ac.uk --user {}:{}".format(file.get('name'), self.analysis_username, self.analysis_password)         # Command to upload file to Webin
-            md5downloaded = "curl -s ftp://webin.ebi.ac.uk/{} --user {}:{} | md5sum | cut -f1 -d ' '".format(os.path.basename(file.get('name')), self.analysis_username, self.analysis_password)       # Command to check the MD5 value for the submitted file
-            md5uploaded = file.get('md5_value')         # The MD5 calculated before the file upload
-            print('-' * 100)
-            print("CURL command:\n{}".format(command))
-            print("MD5 Download command:\n{}".format(md5downloaded))
-            print("MD5 uploaded:\n{}".format(md5uploaded))
-            print('-' * 100)
-
-            # Upload the file to Webin
-            sp = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = sp.communicate()
-
-            # Obtain the MD5 of the submitted file
-            downloadmd5, downloaderr = subprocess.Popen(md5downloaded, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            downloadmd5 = downloadmd5.decode().strip(' \t\n\r')
-
-            print('*' * 100)
-            print("--> {} {} {} <--".format(os.path.basename(file.get('name')), md5uploaded, downloadmd5))
-            print('*' * 100)
-
-            if md5uploaded == downloadmd5:
-                # File integrity proven with matching MD5 values pre and post upload
-                if out:
-                    upload_success.append(file.get('name'))
-                    print("Standard output of subprocess:")
-                    print(out.decode())
-                if err:
-                    upload_success.append(file.get('name'))
-                    print("Standard error of subprocess:")
-                    print(err.decode())
-                if sp.returncode != 0:
-                    upload_errors.append({file.get('name'): err.decode()})
-                    print(err.decode(), file=sys.stderr)
-                print("Returncode of subprocess:", sp.returncode)
-                return upload_success, upload_errors
+        # Process the files that need to be submitted concurrently, up to the number of upload workers
+        files = list({file.get('name'): file for file in self.analysis_file}.values())          # Files shared by several analyses are uploaded once
+        uploader = ftp_uploader(self.ftp_pool, self.compression_workers)
+        with futures.ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            errors = list(executor.map(lambda file: self.transfer_file(uploader, file), files))
+
+        for file, error in zip(files, errors):
+            if error is None:
+                upload_success.append(file.get('name'))
             else:
-                # Failed file integrity check, try at least 10 times before failure
-                print("Analysis file {} may be corrupt, MD5 values do not match.".format(file.get('name')))
-                time.sleep(10)
-                trialcount += 1
-                if trialcount > 5:
-                    upload_errors.append({file.get('name'): err.decode()})
-                    return upload_success, upload_errors
-                else:
-                    self.upload_to_ENA(trialcount)
-
-    def save_accession(self, accession):
+                upload_errors.append({file.get('name'): error})
+        return upload_success, upload_errors
+
+    def save_accession(self, accession, analysis_file=None):
         """
         Retrieve the analysis accession of a successful result
         :param accession: Successfully submitted accession to be saved
+        :param analysis_file: Information on the file(s) the accession refers to, defaults to all files of the submission
         :return: Analysis accession from the receipt XML
         """
         successful_subs = os.path.join(self.parent_dir, 'successful_submissions.txt')
         with open(successful_subs, 'a') as f:
-            for file in self.analysis_file:
+            for file in (analysis_file if analysis_file is not None else self.analysis_file):
                 f.write(str(accession) + "\t" + str(file.get('name')) + "\t" + str(self.datestamp) + "\n")             # Saves the analysis accession, local path to file and date of submission
 
-    def retrieve_xml_info(self, output, error, attempts, webin_loc):
+    def retrieve_xml_info(self, output, status):
+        """
+        Handle information from an XML receipt following submission
+        :param output: Response body of the submission
+        :param status: HTTP status of the response
+        :return: Analysis accession, or dictionary of alias to analysis accession when several analyses were submitted
+        """
+        try:
+            root = ET.fromstring(output.decode())
+        except (ET.ParseError, UnicodeDecodeError):
+            raise http_error(status, 'HTTP {}, no receipt returned: {}'.format(status, output.decode(errors='replace')))
+        if root.get('success') == 'true':  # If submission successful, obtain the analysis accession
+            return self.save_receipt_accessions(root)
+        messages = [error.text for error in root.iter('ERROR')]
+        raise PermanentError('Receipt reports errors: {}'.format(messages))          # Validation errors recur however often the submission is made
+
+    def save_receipt_accessions(self, root):
         """
-        Handle information from an XML output following submission
-        :param output: Output requests object from submission
-        :param error: Error output requests object from submission
-        :param attempts: Number of attempts for submission
-        :param webin_loc Full path of the Webin XML
-        :return: Analysis accession or error message
+        Save the analysis accession(s) from a successful receipt
+        :param root: Root element of the receipt XML
+        :return: Analysis accession, or dictionary of alias to analysis accession when several analyses were submitted
         """
-        root = ET.fromstring(output.decode())
-        receipt_attributes = root.attrib
-        if receipt_attributes.get('success') == 'true':  # If submission successful, obtain the analysis accession
-            analysis_attributes = root[0].attrib  # Dictionary of XML attributes for the analysis object
+        if self.analyses is None:
+            analysis_attributes = root.find('ANALYSIS').attrib  # Dictionary of XML attributes for the analysis object
             analysis_accession = analysis_attributes.get('accession')
             self.save_accession(analysis_accession)
+            self.update_ledger('accessioned', accessions={self.alias: analysis_accession})
             print('> Analysis ID: {}'.format(analysis_accession))
             return analysis_accession
-        elif receipt_attributes.get('success') == 'false':  # Retry submission if unsuccessful
-            time.sleep(10)
-            attempts += 1
-            if attempts > 3:
-                analysis_accession = '> ERROR - Submission failed for {}_{}.xml: {}'.format(webin_loc, self.datestamp, error.decode())
-                print(analysis_accession)
-                return analysis_accession
-            else:
-                self.submission(attempts)
 
-    def retrieve_json_info(self, output, error, attempts, webin_loc):
+        # Several analyses were submitted, match each accession to its analysis by alias
+        analyses = {analysis.get('alias'): analysis for analysis in self.analyses}
+        analysis_accessions = {}
+        for analysis in root.findall('ANALYSIS'):
+            alias, analysis_accession = analysis.get('alias'), analysis.get('accession')
+            analysis_accessions[alias] = analysis_accession
+            self.save_accession(analysis_accession, analyses.get(alias, {}).get('analysis_file', []))
+            if alias in analyses:
+                analyses[alias]['accession'] = analysis_accession
+            print('> Analysis ID: {} ({})'.format(analysis_accession, alias))
+        self.update_ledger('accessioned', accessions=analysis_accessions)
+        return analysis_accessions
+
+    def save_polled_receipt(self, submission_id, receipt):
+        """
+        Handle the receipt of a submission made with the asynchronous Webin API, once it has been processed
+        :param submission_id: Submission ID returned by the submit/queue service
+        :param receipt: Receipt XML obtained by polling
+        :return: Analysis accession(s), or None if the submission failed
+        """
+        start = time.monotonic()
+        try:
+            root = ET.fromstring(receipt)
+        except ET.ParseError as e:
+            METRICS.record('receipt', time.monotonic() - start, alias=self.alias, bytes=len(receipt), status=200, error='Malformed receipt')
+            raise TransientError('Malformed receipt: {}'.format(e))            # Polled again until the timeout, rather than abandoning the submission
+        queue_wait = time.monotonic() - self.queued_at if self.queued_at is not None else None          # Time Webin took to process the submission, when it was queued by this run
+        if root.get('success') == 'true':
+            accessions = self.save_receipt_accessions(root)
+            METRICS.record('receipt', time.monotonic() - start, alias=self.alias, bytes=len(receipt), status=200, queue_wait=queue_wait)
+            return accessions
+        messages = [error.text for error in root.iter('ERROR')]
+        METRICS.record('receipt', time.monotonic() - start, alias=self.alias, bytes=len(receipt), status=200, queue_wait=queue_wait, error='Receipt reports errors')
+        print('> ERROR - Submission {} failed for {}_{}.xml: {}'.format(submission_id, os.path.join(self.parent_dir, 'webin'), self.datestamp, messages))
+        self.record_error('Receipt reports errors: {}'.format(messages))
+        return None
+
+    def retrieve_json_info(self, output, status):
         """
         Handle information from JSON output following the submission
-        :param output: Output requests object from submission
-        :param error: Error output requests object from submission
-        :param attempts: Number of attempts for submission
-        :param webin_loc Full path of the Webin XML
-        :return: Submission accession or error message
+        :param output: Response body of the submission
+        :param status: HTTP status of the response
+        :return: Submission accession
         """
-        output = json.loads(output)         # Convert JSON into dictionary object
         try:
-            submission_id = output['submissionId']
-            self.save_accession(submission_id)
-            print('> Submission ID: {}'.format(submission_id))
-            return submission_id
-        except:
-            # If the output could not obtained, retry the submission
-            time.sleep(10)
-            attempts += 1
-            if attempts > 3:
-                submission_id = '> ERROR - Submission failed for {}_{}.xml: {}'.format(webin_loc, self.datestamp, error.decode())
-                print(submission_id)
-                return submission_id
-            else:
-                self.submission(attempts)
+            submission_id = json.loads(output)['submissionId']         # Convert JSON into dictionary object
+        except (ValueError, KeyError, TypeError):
+            raise http_error(status, 'HTTP {}, no submission ID returned: {}'.format(status, output.decode(errors='replace')))
+        self.save_accession(submission_id)
+        self.submission_id = submission_id
+        self.queued_at = time.monotonic()
+        for analysis in self.analyses or []:
+            analysis['submission_id'] = submission_id
+        self.update_ledger('submitted', submission_id=submission_id)
+        print('> Submission ID: {}'.format(submission_id))
+        return submission_id
 
-    def submission(self, attempts):
+    def submission(self):
         """
-        Carry out the submission
-        :param attempts: The number of times the submission has been attempted
-        :return: Command string and output
+        Carry out the submission, retrying it while it fails with a transient error
+        :return: Submission URL and output
         """
         webin_loc = os.path.join(self.parent_dir, 'webin')          # Prefix for the name of the Webin XML with file path
+        xml_filepath = '{}_{}.xml'.format(webin_loc, self.datestamp)
+        url = self.webin.base_url + self.api_service
+        responses = [b'']
+        attempts = 0
 
-        # Construct the appropriate submission command and run
-        if self.test is True:
-            command = 'curl -u {}:{} -X POST -H "accept: */*"  -H "Content-Type: multipart/form-data" -F "file=@{}_{}.xml;type=text/xml" "https://wwwdev.ebi.ac.uk/ena/submit/webin-v2/{}"'.format(
-                self.analysis_username, self.analysis_password, webin_loc,
-                self.datestamp, self.api_service)
-        else:
-            command = 'curl -u {}:{} -X POST -H "accept: */*"  -H "Content-Type: multipart/form-data" -F "file=@{}_{}.xml;type=txt/xml" "https://www.ebi.ac.uk/ena/submit/webin-v2/{}"'.format(
-                self.analysis_username, self.analysis_password, webin_loc,
-                self.datestamp, self.api_service)
-        sp = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = sp.communicate()
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            # Post the Webin XML to the test or production service over the persistent session
+            start = time.monotonic()
+            try:
+                status, out = self.webin.submit(self.api_service, xml_filepath)
+            except (OSError, http_client.HTTPException) as e:
+                METRICS.record('submit', time.monotonic() - start, alias=self.alias, file=os.path.basename(xml_filepath), retries=attempts - 1, error=str(e))
+                raise TransientError('Request failed: {}'.format(e))
+            METRICS.record('submit', time.monotonic() - start, alias=self.alias, file=os.path.basename(xml_filepath), bytes=os.path.getsize(xml_filepath), retries=attempts - 1, status=status)
+            responses.append(out)
 
-        # Retrieve the resulting accession or attempt if it has failed
-        if self.api_service == 'submit':
-            accession = self.retrieve_xml_info(out, err, attempts, webin_loc)           # Analysis ID is retrieved
-        elif self.api_service == 'submit/queue':
-            accession = self.retrieve_json_info(out, err, attempts, webin_loc)          # Submission ID is retrieved which needs to be polled
+            # Retrieve the resulting accession
+            start = time.monotonic()
+            accession = None
+            try:
+                if self.api_service == 'submit':
+                    accession = self.retrieve_xml_info(out, status)           # Analysis ID is retrieved
+                elif self.api_service == 'submit/queue':
+                    accession = self.retrieve_json_info(out, status)          # Submission ID is retrieved which needs to be polled
+            except (TransientError, PermanentError) as e:
+                METRICS.record('receipt', time.monotonic() - start, alias=self.alias, bytes=len(out), status=status, error=str(e))
+                raise
+            METRICS.record('receipt', time.monotonic() - start, alias=self.alias, bytes=len(out), status=status)
+            return accession
+
+        try:
+            SUBMISSION_RETRY.run(attempt, 'submit {}_{}.xml'.format(webin_loc, self.datestamp))         # The ledger is only moved on once Webin returns a receipt or submission ID
+        except (TransientError, PermanentError) as e:
+            print('> ERROR - Submission failed for {}_{}.xml: {}'.format(webin_loc, self.datestamp, e))
+            self.record_error(str(e))
 
-        return command, out
+        return url, responses[-1]
 
     def submit_data(self):
         """
         Coordinate the upload of data files and submission to ENA
-        :return: Upload of file(s) and curl command
+        :return: Upload of file(s) and submission
         """
-        trialcount = 0
-        success, errors = self.upload_to_ENA(trialcount)      # Upload the data files to ENA prior to submission
+        try:
+            success, errors = self.upload_to_ENA()      # Upload the data files to ENA prior to submission
+
+            # Attempt the submission according to whether the upload was successful
+            if not errors:
+                self.update_ledger('verified')
+                url, out = self.submission()
+                print("-" * 100)
+                print("Submitted to: {}\n".format(url))
+                print("Returned output: \n")
+                print(out.decode())
+                print("-" * 100)
+
+                # Resolve the analysis accession of a queued submission
+                if self.submission_id is not None and self.poll_timeout:
+                    poll_receipts([self], self.webin, self.poll_timeout)
+            else:
+                print("File upload errors detected, aborted file upload:\n {}".format(errors))
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Close the FTP connection pool and Webin session, unless they were passed in to be shared with other submissions
+        """
+        if self.owns_ftp_pool:
+            self.ftp_pool.close()
+        if self.owns_webin:
+            self.webin.close()
+
+
+def poll_receipts(submissions, webin, timeout):
+    """
+    Poll for the receipts of submissions made with the asynchronous Webin API and save the resulting analysis accessions
+    :param submissions: List of upload and submission objects, those with a submission ID are polled
+    :param webin: Webin session object
+    :param timeout: Seconds to poll for before giving up on outstanding submissions
+    :return: Dictionary of submission ID to receipt XML for the completed submissions
+    """
+    outstanding = {submission.submission_id: submission for submission in submissions if submission.submission_id is not None}
+    print('> Polling for the receipts of {} queued submission(s)'.format(len(outstanding)))
+    poller = receipt_poller(webin, timeout=timeout)
+    return poller.poll(list(outstanding), on_receipt=lambda submission_id, receipt: outstanding[submission_id].save_polled_receipt(submission_id, receipt))
 
-        # Attempt the submission according to whether the upload was successful
+
+class submission_pipeline:
+    # Class which overlaps the hashing, upload, verification and submission of batched analyses, with bounded queues between the stages
+    def __init__(self, configuration, args, api_service, timestamp_now, ftp_pool, webin, cache=None, ledger=None, inventory=None):
+        self.configuration = configuration
+        self.args = args
+        self.api_service = api_service
+        self.timestamp_now = timestamp_now
+        self.ftp_pool = ftp_pool
+        self.webin = webin
+        self.cache = cache
+        self.ledger = ledger
+        self.uploader = ftp_uploader(ftp_pool, args.compression_workers)
+        self.validator = preflight_validator(args.output_location, configuration.get('SRA_SCHEMA_URL')) if args.preflight in ['true', 't'] else None
+        self.xml_builder = createBatchWebinXML(str(configuration['ALIAS']) + '_' + timestamp_now, configuration, [], timestamp_now, args.output_location)        # Builds the XML of single analyses for validation
+        self.transfer = upload_and_submit([], args.analysis_username, args.analysis_password, timestamp_now, args.output_location, api_service, args.test,
+                                          args.upload_workers, ftp_pool=ftp_pool, verification=args.verification, webin=webin, ledger=ledger,
+                                          inventory=inventory, compression_workers=args.compression_workers)     # Verifies and retries files of any analysis
+        self.checksums = {}         # Tasks per file name, so files shared by several analyses are hashed, uploaded and verified once
+        self.uploads = {}
+        self.verifications = {}
+        self.submissions = []
+        self.failed = []
+        self.queued = {}            # Analyses queued with the asynchronous Webin API by a previous run, by submission ID
+        self.chunks = 0
+
+    async def calculate_checksum(self, file):
+        """
+        Obtain the MD5 value of a data file, from the checksum cache or by hashing it in the hash executor
+        :param file: Path of the file
+        :return: MD5 checksum value
+        """
+        identity = None
+        if self.cache is not None:
+            identity = self.cache.file_identity(file)
+            cached_md5 = self.cache.lookup(identity)
+            if cached_md5 is not None:
+                return cached_md5
+        submitted = time.time()
+        file_md5, started, duration = await asyncio.get_running_loop().run_in_executor(self.hash_executor, timed_md5_checksum, file)
+        METRICS.record('hash', duration, file=os.path.basename(file), bytes=os.path.getsize(file), queue_wait=max(started - submitted, 0))
+        if self.cache is not None:
+            self.cache.store(identity, file_md5)
+        return file_md5
+
+    def upload_file(self, file, queued):
+        """
+        Upload a data file, capturing any failure so that it can be retried at verification
+        :param file: Dictionary of information on the file to upload
+        :param queued: Time the upload was queued for a worker
+        :return: Tuple of transfer information, or None if the upload failed or was already verified by a previous run, error message and upload state
+        """
+        if self.transfer.file_verified(file):
+            print("Analysis file {} was already uploaded and verified, skipping".format(file.get('name')))
+            return None, None, None
+        state = upload_state()          # Handed to the retrying transfer if this attempt is interrupted, so it resumes from the bytes already sent
+        try:
+            result = self.transfer.upload_attempt(self.uploader, file, state, queue_wait=time.monotonic() - queued)
+        except ftplib.all_errors as e:
+            return None, 'Transfer interrupted: {}'.format(e), state
+        print("Uploaded {}".format(format_throughput(result)))
+        self.transfer.update_file_ledger(file, 'uploaded', result)
+        return result, None, state
+
+    def verify_file(self, file, result, error, state):
+        """
+        Check the integrity of an uploaded data file, falling back to the retrying transfer if the upload failed or is not intact
+        :param file: Dictionary of information on the file
+        :param result: Transfer information for the file, or None if the upload failed
+        :param error: Error message of the upload
+        :param state: Upload state object of the upload
+        :return: Error message, or None if the file was uploaded intact
+        """
+        if result is not None:
+            try:
+                error = self.transfer.verify_upload(self.uploader, file, result)
+            except ftplib.all_errors as e:
+                error = 'Verification failed: {}'.format(e)
+            if error is None:
+                self.transfer.update_file_ledger(file, 'verified', result)
+                return None
+            state = None            # The copy in the upload area is not intact, so it is replaced in full
+        if error is None:
+            return None
+        print("Analysis file {} not uploaded intact, retrying: {}".format(file.get('name'), error), file=sys.stderr)
+        return self.transfer.transfer_file(self.uploader, file, state, attempts=1)
+
+    def once(self, tasks, key, start):
+        """
+        Start work for a key only once, later requests for the same key await the original task
+        :param tasks: Dictionary of key to task
+        :param key: Key identifying the work, e.g. a file name
+        :param start: Callable returning a coroutine or future for the work, called if there is no task for the key yet
+        :return: Task for the key
+        """
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(start())
+        return tasks[key]
+
+    async def prepare(self, analysis):
+        """
+        Hash stage, construct the file information of an analysis
+        """
+        files = analysis.get('file')
+        compress = self.args.compress in ['true', 't']
+        if not self.preflight(analysis, file_handling(files, analysis.get('analysis_type'), compress=compress).construct_file_info(dict.fromkeys(files, UNKNOWN_MD5))):
+            return False            # Rejected before any time is spent hashing its files
+        try:
+            checksums = await asyncio.gather(*(self.once(self.checksums, file, lambda file=file: self.calculate_checksum(file)) for file in files))
+        except OSError as e:
+            print("Could not read files of {}, not submitting: {}".format(analysis.get('alias'), e), file=sys.stderr)
+            analysis['error'] = 'Could not read files: {}'.format(e)
+            self.failed.append(analysis)
+            return False
+        analysis['analysis_file'] = file_handling(files, analysis.get('analysis_type'), compress=compress).construct_file_info(dict(zip(files, checksums)))
+        if self.ledger is None:
+            return True
+
+        # Skip analyses completed by a previous run, and reuse the alias of those which were interrupted
+        record = self.ledger.record_analysis(analysis.pop('alias_stem'), self.ledger.files_md5(analysis['analysis_file']), analysis.get('alias'))
+        analysis['alias'] = record['alias']
+        if record['state'] == 'accessioned':
+            print("> Analysis {} was already submitted as {}, skipping".format(record['alias'], record['accession']))
+            analysis['accession'] = record['accession']
+            return False
+        if record['submission_id'] is not None and self.api_service == 'submit/queue':
+            print("> Analysis {} was already queued as {}, polling for its receipt".format(record['alias'], record['submission_id']))
+            analysis['submission_id'] = record['submission_id']
+            self.queued.setdefault(record['submission_id'], []).append(analysis)
+            return False
+        return True
+
+    def preflight(self, analysis, analysis_file):
+        """
+        Validate the XML of an analysis against the SRA schemas, before its files are hashed and uploaded
+        :param analysis: Dictionary of analysis information
+        :param analysis_file: List of dictionaries of file information, with placeholder checksums
+        :return: Whether the analysis should continue to hashing
+        """
+        if self.validator is None:
+            return True
+        analysis_file = [dict(file, md5_value=file.get('md5_value') or UNKNOWN_MD5) for file in analysis_file]
+        errors = self.validator.validate(self.xml_builder.build_single(dict(analysis, analysis_file=analysis_file)))
         if not errors:
-            attempts = 0
-            command, out = self.submission(attempts)
-            print("-" * 100)
-            print("CURL submission command: \n")
-            print(command)
-            print("Returned output: \n")
-            print(out.decode())
-            print("-" * 100)
-        else:
-            print("File upload errors detected, aborted file upload:\n {}".format(errors))
+            return True
+        print("Analysis {} failed validation, not submitting: {}".format(analysis.get('alias'), '; '.join(errors)), file=sys.stderr)
+        analysis['error'] = 'Invalid Webin XML: {}'.format('; '.join(errors))
+        self.failed.append(analysis)
+        return False
+
+    async def upload(self, analysis):
+        """
+        Upload stage, transfer the files of an analysis to the upload area
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(self.once(self.uploads, file.get('name'), lambda file=file: loop.run_in_executor(self.upload_executor, self.upload_file, file, time.monotonic()))
+                                         for file in analysis.get('analysis_file')))
+        analysis['upload_results'] = results
+        return True
+
+    async def verify(self, analysis):
+        """
+        Verification stage, check the integrity of the uploaded files of an analysis
+        """
+        loop = asyncio.get_running_loop()
+        self.update_ledger(analysis, 'uploaded')
+        errors = await asyncio.gather(*(self.once(self.verifications, file.get('name'), lambda file=file, result=result, error=error, state=state: loop.run_in_executor(self.verify_executor, self.verify_file, file, result, error, state))
+                                        for file, (result, error, state) in zip(analysis.get('analysis_file'), analysis.pop('upload_results'))))
+        upload_errors = [{file.get('name'): error} for file, error in zip(analysis.get('analysis_file'), errors) if error is not None]
+        if upload_errors:
+            print("File upload errors detected for {}, not submitting:\n {}".format(analysis.get('alias'), upload_errors))
+            analysis['error'] = 'File upload errors: {}'.format(upload_errors)
+            self.failed.append(analysis)
+            return False
+        self.update_ledger(analysis, 'verified')
+        return True
+
+    def update_ledger(self, analysis, state):
+        """
+        Record that an analysis has completed a stage
+        :param analysis: Dictionary of analysis information
+        :param state: Stage the analysis has completed
+        """
+        if self.ledger is not None:
+            self.ledger.update_analysis(analysis.get('alias'), state)
+
+    def queued_submissions(self):
+        """
+        Create submission objects for the analyses queued by a previous run, so their receipts can be polled
+        :return: List of upload and submission objects with a submission ID
+        """
+        submissions = []
+        for submission_id, analyses in self.queued.items():
+            analysis_file = [file for analysis in analyses for file in analysis.get('analysis_file')]
+            submission_obj = upload_and_submit(analysis_file, self.args.analysis_username, self.args.analysis_password, self.timestamp_now, self.args.output_location, self.api_service, self.args.test,
+                                               self.args.upload_workers, ftp_pool=self.ftp_pool, analyses=analyses, webin=self.webin, ledger=self.ledger)
+            submission_obj.submission_id = submission_id
+            submissions.append(submission_obj)
+        return submissions
+
+    def submit_chunk(self, chunk):
+        """
+        Submission stage, build the Webin XML for a chunk of analyses with uploaded files and submit it
+        :param chunk: List of dictionaries of analysis information
+        """
+        self.chunks += 1
+        chunk_stamp = '{}_{}'.format(self.timestamp_now, self.chunks)         # Distinguishes the Webin XML of each chunk
+        print('> Submitting chunk {} of {} analyses'.format(self.chunks, len(chunk)))
+        for analysis in chunk:
+            self.transfer.declare_checksums(analysis.get('analysis_file'))
+        start = time.monotonic()
+        create_xml_object = createBatchWebinXML(str(self.configuration['ALIAS']) + '_' + chunk_stamp, self.configuration, chunk, chunk_stamp, self.args.output_location)
+        xml_filepath = create_xml_object.build_webin()
+        METRICS.record('xml', time.monotonic() - start, file=os.path.basename(xml_filepath), bytes=os.path.getsize(xml_filepath))
+
+        analysis_file = [file for analysis in chunk for file in analysis.get('analysis_file')]
+        submission_obj = upload_and_submit(analysis_file, self.args.analysis_username, self.args.analysis_password, chunk_stamp, self.args.output_location, self.api_service, self.args.test,
+                                           self.args.upload_workers, ftp_pool=self.ftp_pool, verification=self.args.verification, analyses=chunk, webin=self.webin, ledger=self.ledger)
+        url, out = submission_obj.submission()
+        print("Submitted to: {}\nReturned output: \n{}".format(url, out.decode()))
+        self.submissions.append(submission_obj)
+
+    async def stage(self, name, handler, inbox, outbox, workers, consumers):
+        """
+        Run a pipeline stage, with workers passing analyses from the inbox through the handler to the outbox
+        :param name: Name of the stage, under which the time spent on each analysis is recorded
+        :param handler: Coroutine function processing an analysis, returning whether it should continue to the next stage
+        :param inbox: Queue of analyses, ending with a None per worker
+        :param outbox: Queue for the next stage
+        :param workers: Number of analyses processed at once
+        :param consumers: Number of workers of the next stage, each of which is sent a None when this stage is finished
+        """
+        async def worker():
+            while True:
+                analysis = await inbox.get()
+                if analysis is None:
+                    break
+                start = time.monotonic()
+                proceed = await handler(analysis)
+                analysis.setdefault('timings', {})[name] = time.monotonic() - start
+                if proceed:
+                    await outbox.put(analysis)
 
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(consumers):
+            await outbox.put(None)
+
+    async def submit_stage(self, inbox):
+        """
+        Collect analyses into chunks and submit each once full, or once no more analyses are to come
+        :param inbox: Queue of analyses with verified files, ending with None
+        """
+        loop = asyncio.get_running_loop()
+        chunk = []
+        while True:
+            analysis = await inbox.get()
+            if analysis is not None:
+                chunk.append(analysis)
+            if chunk and (analysis is None or len(chunk) == self.args.chunk_size):
+                start = time.monotonic()
+                await loop.run_in_executor(self.submit_executor, self.submit_chunk, chunk)
+                for submitted in chunk:
+                    submitted.setdefault('timings', {})['submit'] = time.monotonic() - start
+                chunk = []
+            if analysis is None:
+                break
+
+    async def run(self, analyses):
+        """
+        Pass analyses through the hash, upload, verification and submission stages, so that later analyses are hashed and
+        uploaded while earlier ones are submitted
+        :param analyses: List of dictionaries of analysis information
+        """
+        hash_workers = max(self.args.hash_workers, 1)
+        upload_workers = max(self.args.upload_workers, 1)
+        queues = [asyncio.Queue(maxsize=2 * max(hash_workers, upload_workers)) for _ in range(4)]       # Bounded so no stage runs far ahead of the next
+
+        async def feed():
+            for analysis in analyses:
+                await queues[0].put(analysis)
+            for _ in range(hash_workers):
+                await queues[0].put(None)
+
+        self.hash_executor = futures.ProcessPoolExecutor(max_workers=hash_workers) if hash_workers > 1 else futures.ThreadPoolExecutor(max_workers=1)
+        self.upload_executor = futures.ThreadPoolExecutor(max_workers=upload_workers)
+        self.verify_executor = futures.ThreadPoolExecutor(max_workers=upload_workers)
+        self.submit_executor = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            await asyncio.gather(feed(),
+                                 self.stage('hash', self.prepare, queues[0], queues[1], hash_workers, upload_workers),
+                                 self.stage('upload', self.upload, queues[1], queues[2], upload_workers, upload_workers),
+                                 self.stage('verify', self.verify, queues[2], queues[3], upload_workers, 1),
+                                 self.submit_stage(queues[3]))
+        finally:
+            for executor in (self.hash_executor, self.upload_executor, self.verify_executor, self.submit_executor):
+                executor.shutdown()
+
+
+def submit_batch(analyses, configuration, args, api_service, timestamp_now, cache=None, ledger=None, ftp_pool=None, webin=None, inventory=None):
+    """
+    Submit the analyses read from a manifest in chunks, each chunk as a single Webin XML and submission. Hashing, upload
+    and submission are pipelined, so chunks are submitted while the files of later analyses are still being processed
+    :param analyses: List of dictionaries of analysis information
+    :param configuration: A dictionary referring to tool configuration
+    :param args: Script arguments
+    :param api_service: Webin API service to submit to
+    :param timestamp_now: Formatted date and time string of the submission
+    :param cache: Optional checksum cache object
+    :param ledger: Optional submission ledger object
+    :param ftp_pool: Optional FTP connection pool to use, rather than one opened for the batch
+    :param webin: Optional Webin session object to use, rather than one opened for the batch
+    :param inventory: Optional inventory of the upload area to use, rather than listing it for the batch
+    """
+    aliases = set()
+    for index, analysis in enumerate(analyses, 1):
+        analysis['analysis_date'] = analysis.get('analysis_date') or timestamp_now
+        stem = alias_stem(configuration, analysis.get('run_list'), analysis.get('sample_list'))
+        alias = stem + '_' + timestamp_now
+        if alias in aliases:
+            alias += '_' + str(index)           # Aliases must be unique within a submission
+            stem += '_' + str(index)
+        aliases.add(alias)
+        analysis['alias'] = alias
+        analysis['alias_stem'] = stem
+
+    # Analyses referring to accessions unknown to the index are rejected before any files are uploaded
+    checked = analyses
+    if args.accession_index is not None:
+        try:
+            checked = check_references(analyses, args)
+        except (OSError, ValueError) as e:
+            print("Could not update the accession index, not submitting: {}".format(e), file=sys.stderr)
+            for analysis in analyses:
+                analysis['error'] = 'Could not update the accession index: {}'.format(e)
+            return
+
+    # Connections to Webin are shared across chunks
+    owns_ftp_pool, owns_webin = ftp_pool is None, webin is None
+    if owns_ftp_pool:
+        ftp_pool = ftp_connection_pool(args.analysis_username, args.analysis_password, args.upload_workers,
+                                       configuration.get('WEBIN_FTP_HOST', WEBIN_FTP_HOST), configuration.get('WEBIN_FTP_PORT', WEBIN_FTP_PORT))
+    if owns_webin:
+        webin = webin_session(args.analysis_username, args.analysis_password, args.test, configuration.get('WEBIN_API_URL'), args.webin_timeout)
+    try:
+        pipeline = submission_pipeline(configuration, args, api_service, timestamp_now, ftp_pool, webin, cache, ledger, inventory)
+        asyncio.run(pipeline.run(checked))
+        pipeline.submissions.extend(pipeline.queued_submissions())
+        rejected = len(pipeline.failed) + len(analyses) - len(checked)
+        if rejected:
+            print("> {} of {} analyses were not submitted due to file, reference or validation errors".format(rejected, len(analyses)))
+
+        # Queued submissions of all chunks are polled together once everything has been submitted
+        if api_service == 'submit/queue' and args.poll_timeout:
+            poll_receipts(pipeline.submissions, webin, args.poll_timeout)
+    finally:
+        if owns_ftp_pool:
+            ftp_pool.close()
+        if owns_webin:
+            webin.close()
+    METRICS.flush()
+
+
+def analysis_outcome(analysis):
+    """
+    Summarise the outcome of an analysis which has been through submission
+    :param analysis: Dictionary of analysis information
+    :return: Analysis result object, in state accessioned, queued (submitted with the asynchronous API, without a receipt yet) or failed
+    """
+    error = analysis.get('error')
+    if analysis.get('accession') is not None:
+        state = 'accessioned'
+    elif error is not None:
+        state = 'failed'
+    elif analysis.get('submission_id') is not None:
+        state = 'queued'
+    else:
+        state, error = 'failed', 'No accession was returned'
+    return analysis_result(analysis.get('alias'), state, analysis.get('accession'), analysis.get('submission_id'), error, dict(analysis.get('timings', {})))
+
+
+def submit_analyses(analyses, configuration, credentials, test=True, asynchronous=False, output_location='.', project=None, **options):
+    """
+    Submit analyses from Python rather than the command line, through the same pipeline as a batch submission
+    :param analyses: List of dictionaries of analysis fields, as for the rows of a manifest
+    :param configuration: A dictionary referring to tool configuration, or the directory holding config.yaml
+    :param credentials: Tuple of Webin submission account ID and password
+    :param test: Whether to submit to the ENA test server
+    :param asynchronous: Whether to use the asynchronous Webin API
+    :param output_location: Directory to store the Webin XML, accessions, checksum cache and ledger in
+    :param project: Project accession used for analyses which do not specify their own
+    :param options: Further options named as the command line arguments, e.g. upload_workers=4, verification='sampled', ledger=False
+    :return: List of analysis result objects, in the order of the analyses, those which could not be read having failed with the reason
+    """
+    username, password = credentials
+    parser = argparse.ArgumentParser()
+    add_submission_arguments(parser)
+    args = parser.parse_args(['-au', username, '-ap', password, '-t', 'true', '-o', output_location])         # Defaults of the command line
+    for option, value in options.items():
+        if not hasattr(args, option):
+            raise TypeError('Unknown submission option: {}'.format(option))
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        setattr(args, option, value)
+    args.test = test
+    api_service = 'submit/queue' if asynchronous else 'submit'
+    if isinstance(configuration, str):
+        configuration = read_config(configuration)
+
+    # Rows which cannot be read fail on their own, with the others still submitted
+    read, valid = [], []
+    for index, row in enumerate(analyses, 1):
+        try:
+            analysis = read_analysis(row, project, 'Analysis {}'.format(index))
+            valid.append(analysis)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            analysis = {'error': str(e)}
+        read.append(analysis)
+    if not valid:
+        return [analysis_outcome(analysis) for analysis in read]
+    timestamp_now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    cache = checksum_cache(output_location) if args.checksum_cache in ['true', 't'] else None
+    ledger = submission_ledger(output_location) if args.ledger in ['true', 't'] else None
+    open_metrics(args)
+    try:
+        submit_batch(valid, configuration, args, api_service, timestamp_now, cache, ledger)
+    finally:
+        if cache is not None:
+            cache.close()
+        if ledger is not None:
+            ledger.close()
+        METRICS.close()
+    return [analysis_outcome(analysis) for analysis in read]
 
 
 if __name__=='__main__':
     args = get_args()       # Get script arguments
+    configure_logging(args.log_level)
+    logger.debug("args: %s", {name: value for name, value in vars(args).items() if name != 'analysis_password'})          # The password is never logged
 
     if args.output_location is not None:
         # Check that the output directory exists, as this would be a prefix.
@@ -316,6 +1279,7 @@ if __name__=='__main__':
     else:
         args.output_location = '.'          # Default is the current working directory, unless specified
     configuration = read_config(args.output_location)           # Configuration from YAML
+    open_metrics(args)
 
     # Handle indication of asynchronous Webin API
     if args.asynchronous in ['true', 't']:
@@ -334,32 +1298,95 @@ if __name__=='__main__':
     else:
         runs = ""
 
+    timestamp_now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")  # Get a formatted date and time string
+    cache = checksum_cache(args.output_location) if args.checksum_cache in ['true', 't'] else None         # Persisted checksums of files hashed in previous runs
+    ledger = submission_ledger(args.output_location) if args.ledger in ['true', 't'] else None            # Progress of analyses and files across runs
+
+    if args.manifest is not None or args.compress in ['true', 't']:
+        try:
+            if args.manifest is not None:
+                analyses = read_manifest(args.manifest, args.project)
+            else:           # Checksums of compressed files are only known once uploaded, which the batch pipeline builds the XML after
+                analyses = [read_analysis({'run_list': runs, 'sample_list': samples, 'file': args.file, 'analysis_type': args.analysis_type, 'analysis_date': args.analysis_date}, args.project, 'Analysis')]
+        except (OSError, ValueError) as e:
+            print('ERROR: Could not read analyses: {}... Exiting.'.format(e))
+            sys.exit()
+        submit_batch(analyses, configuration, args, api_service, timestamp_now, cache, ledger)
+        if cache is not None:
+            cache.close()
+        if ledger is not None:
+            ledger.close()
+        METRICS.close()
+        sys.exit()
+
     if ',' in args.file:
         files = list(args.file.split(','))
     else:
         files = [args.file]
 
+    accession_errors = check_accessions(args.project, runs, samples)
+    if accession_errors:
+        print('ERROR: Analysis has {}... Exiting.'.format(', '.join(accession_errors)))
+        sys.exit()
+
     # Define sections to include in analysis XML
-    timestamp_now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S") # Get a formatted date and time string
     analysis_date = timestamp_now if not args.analysis_date else args.analysis_date
+    alias = create_alias(configuration, runs, samples, timestamp_now)      # Create an appropriate alias to tag submissions
+    if args.accession_index is not None:
+        try:
+            if not check_references([{'alias': alias, 'project': args.project, 'run_list': runs, 'sample_list': samples}], args):
+                sys.exit()
+        except (OSError, ValueError) as e:
+            print('ERROR: Could not update the accession index: {}... Exiting.'.format(e))
+            sys.exit()
 
-    # Create an appropriate alias to tag submissions
-    if len(runs) == 1:
-        alias = str(configuration['ALIAS']) + '_' + str(runs[0])
-        if samples != "" and len(samples) == 1:         # If there is a single sample reference provided, add this to the alias
-            alias += '_' + str(samples[0])
-        alias += "_" + str(timestamp_now)
-    else:
-        alias = configuration['ALIAS'] + '_' + str(timestamp_now)
+    if args.preflight in ['true', 't']:
+        # Validate the XML with placeholder checksums before hashing, so a malformed analysis is rejected at once
+        placeholder_file = file_handling(files, args.analysis_type).construct_file_info(dict.fromkeys(files, UNKNOWN_MD5))
+        validation_xml = createBatchWebinXML(alias, configuration, [], timestamp_now, args.output_location).build_single({'alias': alias, 'project': args.project, 'analysis_date': analysis_date, 'analysis_file': placeholder_file,
+                                                                                                                       'analysis_type': args.analysis_type, 'sample_list': samples, 'run_list': runs})
+        validation_errors = preflight_validator(args.output_location, configuration.get('SRA_SCHEMA_URL')).validate(validation_xml)
+        if validation_errors:
+            print('ERROR: Webin XML is invalid, not submitting: {}... Exiting.'.format('; '.join(validation_errors)))
+            sys.exit()
 
     # Obtain file information
-    file_preparation_obj = file_handling(files, args.analysis_type)     # Instantiate object for analysis file handling information
+    file_preparation_obj = file_handling(files, args.analysis_type, args.hash_workers, cache)     # Instantiate object for analysis file handling information
     analysis_file = file_preparation_obj.construct_file_info()      # Obtain information on file/s to be submitted for the analysis XML
+    if cache is not None:
+        cache.close()
+
+    # Skip an analysis completed by a previous run, and reuse the alias of one which was interrupted
+    queued_submission_id = None
+    if ledger is not None:
+        record = ledger.record_analysis(alias_stem(configuration, runs, samples), ledger.files_md5(analysis_file), alias)
+        alias = record['alias']
+        if record['state'] == 'accessioned':
+            print('> Analysis {} was already submitted as {}, skipping'.format(alias, record['accession']))
+            sys.exit()
+        if record['submission_id'] is not None and api_service == 'submit/queue':
+            queued_submission_id = record['submission_id']
 
     # Create the Webin XML for submission
     create_xml_object = createWebinXML(alias, configuration, args.project, analysis_date, timestamp_now, analysis_file, args.analysis_type, args.output_location, sample_accession=samples, run_accession=runs)
+    start = time.monotonic()
     webin_xml = create_xml_object.build_webin()
+    METRICS.record('xml', time.monotonic() - start, alias=alias, file=os.path.basename(create_xml_object.webin_filepath()))
 
     # Upload data files and submit to ENA
-    submission_obj = upload_and_submit(analysis_file, args.analysis_username, args.analysis_password, timestamp_now, args.output_location, api_service, args.test)
-    submission = submission_obj.submit_data()
+    submission_obj = upload_and_submit(analysis_file, args.analysis_username, args.analysis_password, timestamp_now, args.output_location, api_service, args.test,
+                                       args.upload_workers, configuration.get('WEBIN_FTP_HOST', WEBIN_FTP_HOST), configuration.get('WEBIN_FTP_PORT', WEBIN_FTP_PORT),
+                                       verification=args.verification, webin_url=configuration.get('WEBIN_API_URL'), webin_timeout=args.webin_timeout,
+                                       poll_timeout=args.poll_timeout, ledger=ledger, alias=alias)
+    try:
+        if queued_submission_id is not None:
+            print('> Analysis {} was already queued as {}, polling for its receipt'.format(alias, queued_submission_id))
+            submission_obj.submission_id = queued_submission_id
+            poll_receipts([submission_obj], submission_obj.webin, args.poll_timeout)
+        else:
+            submission = submission_obj.submit_data()
+    finally:
+        submission_obj.close()          # Closing again after submit_data has no effect
+    if ledger is not None:
+        ledger.close()
+    METRICS.close()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import os, sqlite3, time
+
+CACHE_FILENAME = 'checksum_cache.sqlite'
+CACHE_MAX_AGE_DAYS = 30         # Entries not used within this many days are evicted when the cache is opened
+
+
+class checksum_cache:
+    # Class which persists MD5 checksums of analysis files, keyed by file identity, so unchanged files are not hashed again
+    def __init__(self, parent_dir, max_age_days=CACHE_MAX_AGE_DAYS):
+        self.cache_file = os.path.join(parent_dir, CACHE_FILENAME)
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.connection = sqlite3.connect(self.cache_file, timeout=60)      # Generous timeout as parallel tasks may share an output location
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS checksums (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+                                    'inode INTEGER NOT NULL, md5 TEXT NOT NULL, last_used REAL NOT NULL)')
+        self.evict()
+
+    @staticmethod
+    def file_identity(file):
+        """
+        Obtain the identity of a file, any change to which invalidates its cached checksum
+        :param file: Path of the file
+        :return: Tuple of absolute path, size, modification time in nanoseconds and inode
+        """
+        stat = os.stat(file)
+        return os.path.abspath(file), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def lookup(self, identity):
+        """
+        Retrieve a cached checksum for a file
+        :param identity: File identity as returned by file_identity
+        :return: MD5 checksum value, or None if the file is not cached or has changed since it was cached
+        """
+        path, size, mtime_ns, inode = identity
+        row = self.connection.execute('SELECT size, mtime_ns, inode, md5 FROM checksums WHERE path = ?', (path,)).fetchone()
+        if row is None or tuple(row[:3]) != (size, mtime_ns, inode):
+            return None
+        with self.connection:
+            self.connection.execute('UPDATE checksums SET last_used = ? WHERE path = ?', (time.time(), path))
+        return row[3]
+
+    def store(self, identity, md5):
+        """
+        Save the checksum of a file, replacing any stale entry for the same path
+        :param identity: File identity as returned by file_identity, taken before the file was hashed
+        :param md5: MD5 checksum value of the file
+        """
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO checksums (path, size, mtime_ns, inode, md5, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                                    identity + (md5, time.time()))
+
+    def evict(self):
+        """
+        Remove entries which have not been used within the maximum age of the cache
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM checksums WHERE last_used < ?', (time.time() - self.max_age,))
+
+    def close(self):
+        self.connection.close()
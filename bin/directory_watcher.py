@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+import argparse, ctypes, ctypes.util, errno, os, re, select, signal, sqlite3, struct, sys, time
+from datetime import datetime
+from analysis_submission import ANALYSIS_TYPES, add_submission_arguments, analysis_outcome, configure_logging, open_metrics, positive_int, read_analysis, read_config, submit_batch
+from checksum_cache import checksum_cache
+from ftp_upload import WEBIN_FTP_HOST, WEBIN_FTP_PORT, ftp_connection_pool, ftp_uploader, upload_inventory
+from submission_ledger import submission_ledger
+from submission_metrics import METRICS
+from webin_client import webin_session
+
+INDEX_FILENAME = 'watch_index.sqlite'
+DEFAULT_PATTERN = r'^(?P<run>[EDS]RR\d+)[._]'           # Files named after the run they analyse, e.g. ERR1234567.consensus.fasta.gz
+SETTLE_TIME = 60            # Seconds since a file was last modified before it is considered complete
+POLL_INTERVAL = 300         # Seconds between rescans when inotify is unavailable
+RETRY_INTERVAL = 600            # Seconds before files whose submission failed are first submitted again, doubling after each further failure
+MAX_RETRY_INTERVAL = 24 * 60 * 60
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')            # Watch descriptor, mask, cookie and length of the name which follows
+
+
+def get_args():
+    '''
+    Define and obtain script arguments
+    :return: Arguments object
+    '''
+    parser = argparse.ArgumentParser(prog='directory_watcher.py', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="""
+        + ============================================================ +
+        |  European Nucleotide Archive (ENA) Analysis Submission Tool  |
+        |                                                              |
+        |  Watcher which submits analysis files as they are written    |
+        |  to pipeline output directories.                             |
+        + =========================================================== +
+        """)
+    parser.add_argument('-p', '--project', help='Valid ENA project accession to submit analyses to (e.g. PRJXXXXXXX)', type=str, required=True)
+    parser.add_argument('-a', '--analysis_type', help='Type of analysis to submit. Options: PATHOGEN_ANALYSIS, COVID19_CONSENSUS, COVID19_FILTERED_VCF, PHYLOGENY_ANALYSIS', choices=ANALYSIS_TYPES, required=True)
+    parser.add_argument('-wd', '--watch_directory', help='Directories to watch for analysis files, including their subdirectories (e.g. path/to/results1,path/to/results2)', type=str, required=True)
+    parser.add_argument('-fp', '--file_pattern', help='Regular expression matched against file names, files not matching are ignored. Named groups run and sample give the accessions to reference, and files with the same values are submitted as one analysis. '
+                                                      'Default: WATCH_PATTERN of the configuration file, or {}'.format(DEFAULT_PATTERN.replace('%', '%%')), type=str, required=False)
+    parser.add_argument('-gs', '--group_size', help='Number of files an analysis must have before it is submitted. Default: 1', type=positive_int, default=1, required=False)
+    parser.add_argument('-st', '--settle_time', help='Seconds since a file was last modified before it is considered complete. Default: {}'.format(SETTLE_TIME), type=int, default=SETTLE_TIME, required=False)
+    parser.add_argument('-pi', '--poll_interval', help='Seconds between rescans of the directories when inotify is unavailable or disabled. Default: {}'.format(POLL_INTERVAL), type=int, default=POLL_INTERVAL, required=False)
+    parser.add_argument('-ri', '--retry_interval', help='Seconds before the files of an analysis which failed to submit are submitted again, doubled after each further failure up to a day. Default: {}'.format(RETRY_INTERVAL), type=int, default=RETRY_INTERVAL, required=False)
+    parser.add_argument('-in', '--inotify', help='Specify usage of inotify to be notified of new files, rather than rescanning the directories. Options are true/t or false/f. Default: true/t', type=str.lower, choices=['true', 't', 'false', 'f'], default='true', required=False)
+    add_submission_arguments(parser)
+    args = parser.parse_args()
+
+    if args.test in ['true', 't']:
+        args.test = True
+    elif args.test in ['false', 'f']:
+        args.test = False
+    return args
+
+
+class scan_index:
+    # Class which persists the files and directories seen by the watcher, so a restart neither resubmits files nor relists unchanged directories
+    def __init__(self, parent_dir):
+        self.index_file = os.path.join(parent_dir, INDEX_FILENAME)
+        self.connection = sqlite3.connect(self.index_file, timeout=60)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+                                    'state TEXT NOT NULL, accession TEXT, updated REAL NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS files_state ON files (state)')
+
+    def file(self, path):
+        """
+        Obtain the entry of a file
+        :param path: Path of the file
+        :return: Tuple of size, modification time and state, or None if the file has not been seen
+        """
+        return self.connection.execute('SELECT size, mtime_ns, state FROM files WHERE path = ?', (path,)).fetchone()
+
+    def pending_files(self):
+        """
+        Obtain the files seen but not yet submitted, including those whose submission failed
+        :return: List of paths
+        """
+        return [row[0] for row in self.connection.execute("SELECT path FROM files WHERE state IN ('pending', 'failed')")]
+
+    def failed_files(self):
+        """
+        Obtain the files whose submission failed
+        :return: List of tuples of path and time the failure was recorded
+        """
+        return self.connection.execute("SELECT path, updated FROM files WHERE state = 'failed'").fetchall()
+
+    def record_file(self, path, stat, state, accession=None):
+        """
+        Record the state of a file
+        :param path: Path of the file
+        :param stat: Result of os.stat for the file
+        :param state: pending, submitted or failed
+        :param accession: Optional accession of the analysis the file was submitted in
+        """
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, state, accession, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                                    (path, stat.st_size, stat.st_mtime_ns, state, accession, time.time()))
+
+    def forget_file(self, path):
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def directory_mtime(self, path):
+        """
+        Obtain the modification time of a directory when it was last listed
+        :param path: Path of the directory
+        :return: Modification time in nanoseconds, or None if the directory has not been listed
+        """
+        row = self.connection.execute('SELECT mtime_ns FROM directories WHERE path = ?', (path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def subdirectories(self, path):
+        return [row[0] for row in self.connection.execute('SELECT path FROM directories WHERE parent = ?', (path,))]
+
+    def record_directory(self, path, parent, mtime_ns):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)', (path, parent, mtime_ns))
+
+    def forget_directory(self, path):
+        with self.connection:
+            prefix = path.rstrip(os.sep) + os.sep
+            self.connection.execute('DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?', (path, len(prefix), prefix))
+
+    def close(self):
+        self.connection.close()
+
+
+class inotify_watch:
+    # Class which receives inotify events for new files and subdirectories of a set of directories through libc, raising OSError where inotify is unavailable
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}           # Watch descriptor to directory path
+
+    def add(self, path):
+        """
+        Watch a directory for files which are written or moved into it, and for new subdirectories
+        :param path: Path of the directory
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return          # Removed since it was listed
+            raise OSError(error, 'inotify_add_watch failed for {}'.format(path))         # ENOSPC, the limit on watches is reached
+        self.directories[wd] = path
+
+    def read(self, timeout):
+        """
+        Wait for events
+        :param timeout: Seconds to wait for the first event
+        :return: List of tuples of path and whether it is a directory, or None if events were lost and the directories must be rescanned
+        """
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not readable:
+            return []
+        events = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                self.directories.pop(wd, None)
+            elif wd in self.directories and name:
+                events.append((os.path.join(self.directories[wd], os.fsdecode(name)), bool(mask & IN_ISDIR)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class directory_watcher:
+    # Class which finds analysis files in watched directories and groups them into analyses once they have stopped changing
+    def __init__(self, directories, pattern, index, settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL, group_size=1, use_inotify=True, retry_interval=RETRY_INTERVAL):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.pattern = re.compile(pattern)
+        self.index = index
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.group_size = group_size
+        self.retry_interval = retry_interval
+        self.pending = {}           # Path of each file not yet submitted to the key of its analysis
+        self.failures = {}          # Path of each file whose submission failed to the number of failures since the watcher started
+        self.last_scan = 0
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = inotify_watch()
+            except (OSError, AttributeError) as e:
+                print('> inotify is unavailable, rescanning every {} seconds: {}'.format(poll_interval, e))
+        for path in index.pending_files():
+            self.consider(path, retry=True)         # Files whose submission failed before a restart are submitted again
+
+    def group_key(self, path):
+        """
+        Obtain the key of the analysis a file belongs to from its name
+        :param path: Path of the file
+        :return: Tuple of the named groups matched in the file name, or None if the file name does not match the pattern
+        """
+        name = os.path.basename(path)
+        if name.startswith('.'):
+            return None         # Hidden files, e.g. temporary files of rsync
+        match = self.pattern.search(name)
+        if match is None:
+            return None
+        return tuple(sorted((group, value) for group, value in match.groupdict().items() if value))
+
+    def consider(self, path, retry=False):
+        """
+        Add a file to the pending files, unless it does not match the pattern or was submitted unchanged before
+        :param path: Path of the file
+        :param retry: Whether to add the file if its submission failed, even if it is unchanged
+        """
+        if path in self.pending:
+            return
+        key = self.group_key(path)
+        if key is None:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.index.forget_file(path)
+            return
+        known = self.index.file(path)
+        if known is not None and known[2] != 'pending' and known[:2] == (stat.st_size, stat.st_mtime_ns) and not (retry and known[2] == 'failed'):
+            return
+        self.pending[path] = key
+        self.index.record_file(path, stat, 'pending')
+
+    def scan(self):
+        """
+        Scan the watched directories for files, only listing directories which have changed since they were last listed
+        """
+        for directory in self.directories:
+            self.scan_directory(directory, None)
+        self.last_scan = time.monotonic()
+
+    def scan_directory(self, path, parent):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self.index.forget_directory(path)
+            return
+        if self.inotify is not None:
+            self.watch(path)            # Before listing, so files created meanwhile are not missed
+        if self.index.directory_mtime(path) == mtime_ns:
+            subdirectories = self.index.subdirectories(path)            # No entries were added or removed since the last listing
+        else:
+            subdirectories = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.is_file():
+                        self.consider(entry.path)
+        for subdirectory in subdirectories:
+            self.scan_directory(subdirectory, path)
+        self.index.record_directory(path, parent, mtime_ns)         # Only once its subdirectories are recorded, with the time taken before listing so changes made meanwhile cause a relisting
+
+    def watch(self, path):
+        try:
+            self.inotify.add(path)
+        except OSError as e:
+            print('> Could not watch {}, rescanning every {} seconds instead: {}'.format(path, self.poll_interval, e))
+            self.inotify.close()
+            self.inotify = None
+
+    def ready_analyses(self):
+        """
+        Group the pending files into analyses, taking those whose files have all settled
+        :return: Tuple of a dictionary of analysis key to list of file paths, and seconds until another pending file settles
+        """
+        now = time.time()
+        settled, unsettled = {}, set()
+        next_check = self.poll_interval
+        for path, key in list(self.pending.items()):
+            try:
+                age = now - os.stat(path).st_mtime
+            except FileNotFoundError:
+                del self.pending[path]
+                self.index.forget_file(path)
+                continue
+            if age < self.settle_time:
+                unsettled.add(key)
+                next_check = min(next_check, self.settle_time - age)
+            else:
+                settled.setdefault(key, []).append(path)
+        ready = {key: sorted(files) for key, files in settled.items() if key not in unsettled and len(files) >= self.group_size}
+        for files in ready.values():
+            for path in files:
+                del self.pending[path]
+        return ready, next_check
+
+    def retry_failed(self):
+        """
+        Add the files whose submission failed back to the pending files once their retry interval has passed
+        :return: Seconds until the retry interval of another failed file passes
+        """
+        now = time.time()
+        next_retry = self.poll_interval
+        for path, updated in self.index.failed_files():
+            if path in self.pending:
+                continue
+            interval = min(self.retry_interval * 2 ** (self.failures.get(path, 1) - 1), MAX_RETRY_INTERVAL)
+            if now - updated >= interval:
+                print('> Submitting {} again'.format(path))
+                self.consider(path, retry=True)
+            else:
+                next_retry = min(next_retry, interval - (now - updated))
+        return next_retry
+
+    def wait(self, timeout):
+        """
+        Wait for new files, from inotify events or by rescanning once the poll interval has passed
+        :param timeout: Seconds to wait
+        """
+        if self.inotify is None:
+            time.sleep(max(min(timeout, self.last_scan + self.poll_interval - time.monotonic()), 0))
+            if time.monotonic() - self.last_scan >= self.poll_interval:
+                self.scan()
+            return
+        events = self.inotify.read(timeout)
+        if events is None:
+            print('> inotify events were lost, rescanning')
+            self.scan()
+            return
+        for path, is_directory in events:
+            if is_directory:
+                self.scan_directory(path, os.path.dirname(path))
+            else:
+                self.consider(path)
+
+    def record(self, files, state, accession=None):
+        """
+        Record the outcome of submitting files
+        :param files: List of file paths
+        :param state: submitted or failed
+        :param accession: Optional accession of the analysis
+        """
+        for path in files:
+            if state == 'failed':
+                self.failures[path] = self.failures.get(path, 0) + 1
+            else:
+                self.failures.pop(path, None)
+            try:
+                self.index.record_file(path, os.stat(path), state, accession)
+            except FileNotFoundError:
+                self.failures.pop(path, None)
+                self.index.forget_file(path)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+if __name__=='__main__':
+    args = get_args()       # Get script arguments
+    configure_logging(args.log_level)
+
+    if args.output_location is not None:
+        if os.path.isdir(args.output_location) is not True:
+            print('ERROR: Please provide a valid and existing output directory... Exiting.')
+            sys.exit()
+    else:
+        args.output_location = '.'          # Default is the current working directory, unless specified
+    configuration = read_config(args.output_location)           # Configuration from YAML
+    open_metrics(args)
+    api_service = 'submit/queue' if args.asynchronous in ['true', 't'] else 'submit'
+    pattern = args.file_pattern or configuration.get('WATCH_PATTERN', DEFAULT_PATTERN)
+
+    index = scan_index(args.output_location)
+    watcher = directory_watcher(args.watch_directory.split(','), pattern, index, args.settle_time, args.poll_interval, args.group_size, args.inotify in ['true', 't'], args.retry_interval)
+    cache = checksum_cache(args.output_location) if args.checksum_cache in ['true', 't'] else None
+    ledger = submission_ledger(args.output_location) if args.ledger in ['true', 't'] else None
+    ftp_pool = ftp_connection_pool(args.analysis_username, args.analysis_password, args.upload_workers,
+                                   configuration.get('WEBIN_FTP_HOST', WEBIN_FTP_HOST), configuration.get('WEBIN_FTP_PORT', WEBIN_FTP_PORT))
+    webin = webin_session(args.analysis_username, args.analysis_password, args.test, configuration.get('WEBIN_API_URL'), args.webin_timeout)
+    inventory = upload_inventory(ftp_uploader(ftp_pool))            # Listing of the upload area, kept current across batches
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('> Watching {} for files matching {}'.format(', '.join(watcher.directories), pattern))
+    try:
+        watcher.scan()
+        while True:
+            next_retry = watcher.retry_failed()
+            ready, next_check = watcher.ready_analyses()
+            if ready:
+                # Settled analyses are submitted together as a batch, over connections kept open between batches
+                analyses = []
+                for key, files in ready.items():
+                    references = dict(key)
+                    try:
+                        analyses.append(read_analysis({'analysis_type': args.analysis_type, 'file': files, 'run_list': references.get('run'), 'sample_list': references.get('sample')},
+                                                      args.project, 'Analysis of {}'.format(', '.join(files))))
+                    except ValueError as e:
+                        print('{}, not submitting'.format(e), file=sys.stderr)
+                        watcher.record(files, 'failed')
+                if not analyses:
+                    continue
+                timestamp_now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+                print('> Submitting {} analyses from {} files'.format(len(analyses), sum(len(analysis['file']) for analysis in analyses)))
+                submit_batch(analyses, configuration, args, api_service, timestamp_now, cache, ledger, ftp_pool, webin, inventory)
+                for analysis in analyses:
+                    result = analysis_outcome(analysis)
+                    watcher.record(analysis.get('file'), 'failed' if result.state == 'failed' else 'submitted', result.accession)
+                continue
+            watcher.wait(min(next_check, next_retry))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        index.close()
+        if cache is not None:
+            cache.close()
+        if ledger is not None:
+            ledger.close()
+        ftp_pool.close()
+        webin.close()
+        METRICS.close()
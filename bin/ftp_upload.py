@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+import os, queue, random, threading, time
+from contextlib import contextmanager
+from lazy_modules import lazy_module
+from stream_compression import COMPRESSION_WORKERS, compressed_reader
+
+ftplib = lazy_module('ftplib')          # Imported on first use, with the ssl module it loads
+hashlib = lazy_module('hashlib')
+
+WEBIN_FTP_HOST = 'webin.ebi.ac.uk'
+WEBIN_FTP_PORT = 21
+TRANSFER_BLOCK_SIZE = 1024 * 1024           # Bytes sent or received per block on an FTP data connection
+HASH_CHECKPOINT_INTERVAL = 64 * 1024 * 1024         # Bytes between saved hash states, bounds the data re-read locally when resuming an upload
+SAMPLE_COUNT = 8            # Number of byte ranges compared when verifying an upload by sampling
+SAMPLE_SIZE = 64 * 1024
+INVENTORY_MAX_AGE = 3600            # Seconds before the listing of the upload area is taken again, between these it is kept current with the transfers made
+
+
+class ftp_connection_pool:
+    # Class which keeps a bounded pool of authenticated FTP connections to the Webin upload area, reused across transfers
+    def __init__(self, username, password, size=1, host=WEBIN_FTP_HOST, port=WEBIN_FTP_PORT, timeout=120):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()           # Most recently used connections first, these are the least likely to have timed out
+        self.slots = threading.BoundedSemaphore(size)
+
+    def connect(self):
+        """
+        Open and authenticate a new connection to the upload area
+        :return: FTP connection object
+        """
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login(self.username, self.password)
+        ftp.voidcmd('TYPE I')           # Binary mode for transfers and SIZE queries
+        return ftp
+
+    def discard(self, ftp):
+        """
+        Close a connection which is broken or no longer needed
+        :param ftp: FTP connection object
+        """
+        try:
+            ftp.quit()
+        except (*ftplib.all_errors, AttributeError):
+            ftp.close()
+
+    def acquire(self):
+        """
+        Obtain a connection from the pool, waiting for one if the pool is at capacity
+        :return: FTP connection object
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    ftp = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                try:
+                    ftp.voidcmd('NOOP')         # Idle connections may have been closed by the server
+                    return ftp
+                except ftplib.all_errors:
+                    self.discard(ftp)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, ftp, broken=False):
+        """
+        Return a connection to the pool
+        :param ftp: FTP connection object
+        :param broken: Whether the connection failed during use and should not be reused
+        """
+        if broken:
+            self.discard(ftp)
+        else:
+            self.idle.put(ftp)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except BaseException:
+            self.release(ftp, broken=True)          # State of the control connection is unknown after a failure
+            raise
+        self.release(ftp)
+
+    def close(self):
+        """
+        Close all idle connections in the pool
+        """
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+class upload_state:
+    # Class which holds the progress of a file upload across attempts, so an interrupted transfer can continue with a correct MD5
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.position = 0
+        self.checkpoints = [(0, self.md5.copy())]
+
+    def update(self, block):
+        """
+        Account for a block of the file which has been sent
+        :param block: Bytes sent
+        """
+        self.md5.update(block)
+        self.position += len(block)
+        if self.position - self.checkpoints[-1][0] >= HASH_CHECKPOINT_INTERVAL:
+            self.checkpoints.append((self.position, self.md5.copy()))
+
+    def rewind(self, f, offset):
+        """
+        Restore the hash state at an offset of the file, re-reading the local bytes after the closest earlier checkpoint
+        :param f: File object of the file being uploaded
+        :param offset: Position in the file to continue the upload from
+        """
+        while self.checkpoints[-1][0] > offset:
+            self.checkpoints.pop()
+        self.position, md5 = self.checkpoints[-1]
+        self.md5 = md5.copy()
+        f.seek(self.position)
+        while self.position < offset:
+            block = f.read(min(offset - self.position, TRANSFER_BLOCK_SIZE))
+            if not block:
+                break
+            self.update(block)
+
+
+class ftp_uploader:
+    # Class which transfers analysis data files to and from the Webin upload area using a pool of FTP connections
+    def __init__(self, pool, compression_workers=COMPRESSION_WORKERS):
+        self.pool = pool
+        self.compression_workers = compression_workers
+
+    def upload_file(self, file, remote_name=None, state=None, compression=None):
+        """
+        Upload a data file to the Webin upload area, continuing from the bytes already present if a previous attempt was interrupted
+        :param file: Path of the file to upload
+        :param remote_name: Name of the file in the upload area, defaults to the file name
+        :param state: Upload state object kept across attempts to upload the file
+        :param compression: Optional gzip or bgzf, to compress the file as it is sent
+        :return: Dictionary of transfer information for the file, with the size and MD5 of the bytes sent
+        """
+        remote_name = remote_name or os.path.basename(file)
+        state = state if state is not None else upload_state()         # Hashes the bytes as they are sent, so the upload itself can be checked without reading the file again
+        start = time.monotonic()
+
+        with self.pool.connection() as ftp, open(file, 'rb') as f:
+            offset = 0
+            if compression is not None:
+                state = upload_state()          # Compressed output is not kept, so an interrupted upload is sent again in full
+                ftp.storbinary('STOR {}'.format(remote_name), compressed_reader(f, compression, self.compression_workers), blocksize=TRANSFER_BLOCK_SIZE, callback=state.update)
+            else:
+                if state.position:
+                    offset = self.query_size(ftp, remote_name) or 0
+                    if offset > state.position:
+                        offset = 0          # More data is present than was ever sent, so it is not from this upload
+                state.rewind(f, offset)
+                if offset:
+                    print("Resuming upload of {} from byte {}".format(remote_name, offset))
+                    ftp.storbinary('APPE {}'.format(remote_name), f, blocksize=TRANSFER_BLOCK_SIZE, callback=state.update)
+                else:
+                    ftp.storbinary('STOR {}'.format(remote_name), f, blocksize=TRANSFER_BLOCK_SIZE, callback=state.update)
+        seconds = time.monotonic() - start
+        transferred = state.position - offset
+        return {'name': file, 'remote_name': remote_name, 'bytes': state.position, 'md5': state.md5.hexdigest(), 'resumed_from': offset,
+                'seconds': seconds, 'throughput': transferred / seconds if seconds else 0.0}
+
+    def remote_size(self, remote_name):
+        """
+        Obtain the size of a file in the upload area
+        :param remote_name: Name of the file in the upload area
+        :return: Size of the file in bytes, or None if the file does not exist
+        """
+        with self.pool.connection() as ftp:
+            return self.query_size(ftp, remote_name)
+
+    def query_size(self, ftp, remote_name):
+        """
+        Query the size of a file in the upload area over a connection, using SIZE or MLST where SIZE is not supported
+        :param ftp: FTP connection object
+        :param remote_name: Name of the file in the upload area
+        :return: Size of the file in bytes, or None if the file does not exist
+        """
+        try:
+            return ftp.size(remote_name)
+        except ftplib.error_perm as e:
+            if not str(e).startswith('502'):
+                return None         # 550, the file is not present
+        try:
+            response = ftp.sendcmd('MLST {}'.format(remote_name))
+        except ftplib.error_perm:
+            return None
+        for line in response.splitlines()[1:-1]:
+            for fact in line.strip().split(';'):
+                if fact.lower().startswith('size='):
+                    return int(fact.split('=', 1)[1])
+        return None
+
+    def list_sizes(self):
+        """
+        List the files in the upload area with a single MLSD command, or LIST where MLSD is not supported
+        :return: Dictionary of file name to size in bytes
+        """
+        with self.pool.connection() as ftp:
+            try:
+                ftp.sendcmd('OPTS MLST type;size;')
+            except ftplib.error_perm:
+                pass            # Not every server lets the facts be chosen, most list type and size by default
+            try:
+                return {name: int(facts['size']) for name, facts in ftp.mlsd() if facts.get('type') == 'file' and 'size' in facts}
+            except ftplib.error_perm as e:
+                if not str(e).startswith(('500', '502')):
+                    raise
+            lines = []
+            ftp.retrlines('LIST', lines.append)
+        sizes = {}
+        for line in lines:
+            fields = line.split(None, 8)            # Unix style listing, e.g. -rw-r--r-- 1 owner group 1024 Jan 01 00:00 name
+            if len(fields) == 9 and line.startswith('-') and fields[4].isdigit():
+                sizes[fields[8]] = int(fields[4])
+        return sizes
+
+    def read_remote_range(self, ftp, remote_name, offset, length):
+        """
+        Read a byte range of a file in the upload area, starting the transfer at an offset with REST
+        :param ftp: FTP connection object
+        :param remote_name: Name of the file in the upload area
+        :param offset: Position of the first byte to read
+        :param length: Number of bytes to read
+        :return: Bytes read from the file
+        """
+        data = bytearray()
+        with ftp.transfercmd('RETR {}'.format(remote_name), rest=offset) as conn:
+            while len(data) < length:
+                block = conn.recv(min(length - len(data), TRANSFER_BLOCK_SIZE))
+                if not block:
+                    break
+                data.extend(block)
+        try:
+            ftp.voidresp()
+        except ftplib.error_temp:
+            pass            # 426, the server reports the transfer closed before the end of the file
+        return bytes(data)
+
+    def compare_samples(self, file, remote_name, size, count=SAMPLE_COUNT, sample_size=SAMPLE_SIZE):
+        """
+        Compare byte ranges of a local file with the copy in the upload area, including the start and end of the file
+        :param file: Path of the local file
+        :param remote_name: Name of the file in the upload area
+        :param size: Size of the file in bytes
+        :param count: Number of byte ranges to compare
+        :param sample_size: Number of bytes in each range
+        :return: List of offsets of the byte ranges which differ
+        """
+        last = max(size - sample_size, 0)
+        offsets = {0, last}
+        if last > 1:
+            offsets.update(random.sample(range(1, last), min(count - 2, last - 1)))
+        mismatched = []
+        with self.pool.connection() as ftp, open(file, 'rb') as f:
+            for offset in sorted(offsets):
+                f.seek(offset)
+                if f.read(sample_size) != self.read_remote_range(ftp, remote_name, offset, sample_size):
+                    mismatched.append(offset)
+        return mismatched
+
+    def download_md5(self, remote_name):
+        """
+        Calculate the MD5 checksum of a file in the upload area by downloading it
+        :param remote_name: Name of the file in the upload area
+        :return: MD5 checksum value
+        """
+        md5 = hashlib.md5()
+        with self.pool.connection() as ftp:
+            ftp.retrbinary('RETR {}'.format(remote_name), md5.update, blocksize=TRANSFER_BLOCK_SIZE)
+        return md5.hexdigest()
+
+
+class upload_inventory:
+    # Class which holds the sizes of the files in the Webin upload area, listed once and then kept current with the transfers made rather than queried per file
+    def __init__(self, uploader, max_age=INVENTORY_MAX_AGE):
+        self.uploader = uploader
+        self.max_age = max_age
+        self.sizes = None
+        self.listed = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """
+        List the upload area, unless it was listed within the maximum age
+        """
+        if self.listed is not None and time.monotonic() - self.listed < self.max_age:
+            return
+        self.listed = time.monotonic()
+        try:
+            self.sizes = self.uploader.list_sizes()
+        except ftplib.all_errors as e:
+            print("Could not list the upload area, querying files individually: {}".format(e))
+            self.sizes = None
+
+    def size(self, remote_name):
+        """
+        Obtain the size of a file in the upload area
+        :param remote_name: Name of the file in the upload area
+        :return: Size of the file in bytes, or None if the file does not exist
+        """
+        with self.lock:
+            self.refresh()
+            if self.sizes is not None:
+                return self.sizes.get(remote_name)
+        return self.uploader.remote_size(remote_name)
+
+    def record(self, remote_name, size):
+        """
+        Account for a file transferred to the upload area
+        :param remote_name: Name of the file in the upload area
+        :param size: Size of the file in bytes
+        """
+        with self.lock:
+            if self.sizes is not None:
+                self.sizes[remote_name] = size
+
+
+def format_throughput(result):
+    """
+    Format the transfer information of a file for reporting
+    :param result: Dictionary of transfer information as returned by ftp_uploader.upload_file
+    :return: Summary string of the transfer
+    """
+    return '{} - {} bytes in {:.2f}s ({:.2f} MB/s)'.format(result.get('remote_name'), result.get('bytes') - result.get('resumed_from', 0),
+                                                           result.get('seconds'), result.get('throughput') / (1024 * 1024))
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+import importlib
+
+
+class lazy_module:
+    # Class which stands in for a module until one of its attributes is first used, so modules which are slow to import, and unused by many invocations, do not delay the start of each one
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attribute):
+        value = getattr(importlib.import_module(self.__name__), attribute)          # The import system's module locks make the first use from several threads safe
+        setattr(self, attribute, value)         # Later uses are ordinary attribute lookups
+        return value
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name__)
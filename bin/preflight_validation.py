@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import os, re, sys, threading, time
+from urllib.parse import urljoin, urlsplit
+from lazy_modules import lazy_module
+
+etree = lazy_module('lxml.etree')          # Imported on first use, as are the modules to download schemas, which are needed only weekly
+request = lazy_module('urllib.request')
+
+SCHEMA_URL = 'https://ftp.ebi.ac.uk/pub/databases/ena/doc/xsd/sra_1_5/'
+SCHEMA_DIRECTORY = 'sra_schemas'            # Directory within the output location holding downloaded schemas
+SCHEMA_MAX_AGE_DAYS = 7         # Downloaded schemas older than this are refreshed, keeping the copy held if ENA cannot be reached
+SCHEMA_TIMEOUT = 30
+SCHEMA_RETRY_HOURS = 1          # Hours before a failed download is attempted again, doubling after each further failure up to the maximum age
+SCHEMA_FILES = {'SUBMISSION_SET': 'SRA.submission.xsd', 'ANALYSIS_SET': 'SRA.analysis.xsd'}          # Schema of each set within the Webin XML
+XSD_NAMESPACE = '{http://www.w3.org/2001/XMLSchema}'
+UNKNOWN_MD5 = '0' * 32          # Stands in for the checksums of files compressed on upload, which are only known once uploaded
+ACCESSION_PATTERNS = {
+    'project': re.compile(r'PRJ[EDN][A-Z]\d+|[EDS]RP\d{6,}'),
+    'sample': re.compile(r'SAM[EDN][A-Z]?\d+|[EDS]RS\d{6,}'),
+    'run': re.compile(r'[EDS]RR\d{6,}'),
+}
+COMPILED_SCHEMAS = {}           # Compiled schemas by path and modification time, shared by every validator in the process
+SCHEMA_LOCK = threading.Lock()
+
+
+def check_accessions(project, runs, samples):
+    """
+    Check the format of the accessions referenced by an analysis
+    :param project: Project accession, or several separated by commas
+    :param runs: List of run accessions, or an empty string
+    :param samples: List of sample accessions, or an empty string
+    :return: List of error messages, empty if every accession is well formed
+    """
+    errors = []
+    for kind, accessions in (('project', project.split(',') if project else []), ('run', runs or []), ('sample', samples or [])):
+        for accession in accessions:
+            if ACCESSION_PATTERNS[kind].fullmatch(accession) is None:
+                errors.append('invalid {} accession {!r}'.format(kind, accession))
+    return errors
+
+
+class schema_store:
+    # Class which keeps the SRA schemas on disk, downloading them with the schemas they include on first use, and compiles each once per process
+    def __init__(self, parent_dir, base_url=None, max_age_days=SCHEMA_MAX_AGE_DAYS):
+        self.directory = os.path.join(parent_dir, SCHEMA_DIRECTORY)
+        self.base_url = base_url or SCHEMA_URL
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.attempted = set()          # Schemas whose download was attempted, so an unreachable server does not hold up every analysis
+        self.retry_interval = SCHEMA_RETRY_HOURS * 60 * 60
+
+    def download(self, url, downloaded):
+        """
+        Download a schema and those it includes or imports, pointing references between them at the local copies
+        :param url: URL of the schema
+        :param downloaded: Set of URLs already downloaded in this refresh
+        :return: File name of the local copy
+        """
+        name = os.path.basename(urlsplit(url).path)
+        if url in downloaded:
+            return name
+        downloaded.add(url)
+        with request.urlopen(url, timeout=SCHEMA_TIMEOUT) as response:
+            document = etree.fromstring(response.read(), base_url=url)
+        for reference in document.iter(XSD_NAMESPACE + 'include', XSD_NAMESPACE + 'import'):
+            location = reference.get('schemaLocation')
+            if location is not None:
+                reference.set('schemaLocation', self.download(urljoin(url, location), downloaded))
+        path = os.path.join(self.directory, name)
+        etree.ElementTree(document).write(path + '.tmp', xml_declaration=True, encoding='UTF-8')
+        os.replace(path + '.tmp', path)         # Readers never see a partly written schema
+        return name
+
+    def schema_path(self, name):
+        """
+        Obtain the local copy of a schema, downloading it if it is missing or stale
+        :param name: File name of the schema
+        :return: Path of the schema, or None if it is neither held nor can be downloaded
+        """
+        path = os.path.join(self.directory, name)
+        if name in self.attempted or (os.path.isfile(path) and time.time() - os.path.getmtime(path) < self.max_age) or self.backing_off(name):
+            return path if os.path.isfile(path) else None
+        self.attempted.add(name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.download(urljoin(self.base_url, name), set())
+        except (OSError, etree.XMLSyntaxError) as e:
+            print('Could not download schema {}: {}'.format(name, e), file=sys.stderr)
+            self.record_failure(name)
+        else:
+            self.clear_failures(name)
+        return path if os.path.isfile(path) else None
+
+    def failure_path(self, name):
+        return os.path.join(self.directory, name + '.failed')
+
+    def failures(self, name):
+        """
+        Obtain the failed downloads of a schema recorded by previous runs
+        :param name: File name of the schema
+        :return: Tuple of the number of consecutive failures and the time of the last, or None if the last download succeeded
+        """
+        try:
+            with open(self.failure_path(name)) as f:
+                return int(f.read().strip() or 1), os.fstat(f.fileno()).st_mtime
+        except (OSError, ValueError):
+            return None
+
+    def backing_off(self, name):
+        """
+        Check whether a schema failed to download too recently to be attempted again, so offline runs do not each wait for the download to time out
+        :param name: File name of the schema
+        :return: True if the download should not be attempted
+        """
+        failures = self.failures(name)
+        if failures is None:
+            return False
+        count, last_failure = failures
+        return time.time() - last_failure < min(self.retry_interval * 2 ** (count - 1), self.max_age)
+
+    def record_failure(self, name):
+        failures = self.failures(name)
+        try:
+            with open(self.failure_path(name) + '.tmp', 'w') as f:
+                f.write('{}\n'.format(failures[0] + 1 if failures is not None else 1))
+            os.replace(self.failure_path(name) + '.tmp', self.failure_path(name))
+        except OSError:
+            pass            # The output location is not writable, each run attempts the download
+
+    def clear_failures(self, name):
+        try:
+            os.remove(self.failure_path(name))
+        except FileNotFoundError:
+            pass
+
+    def schema(self, name):
+        """
+        Obtain a compiled schema
+        :param name: File name of the schema
+        :return: XMLSchema object, or None if the schema is unavailable
+        """
+        with SCHEMA_LOCK:
+            path = self.schema_path(name)
+            if path is None:
+                return None
+            key = (os.path.abspath(path), os.path.getmtime(path))
+            if key not in COMPILED_SCHEMAS:
+                try:
+                    COMPILED_SCHEMAS[key] = etree.XMLSchema(etree.parse(path))
+                except (etree.XMLSchemaParseError, etree.XMLSyntaxError) as e:
+                    print('Could not compile schema {}: {}'.format(name, e), file=sys.stderr)
+                    return None
+            return COMPILED_SCHEMAS[key]
+
+
+class preflight_validator:
+    # Class which validates Webin XML against the SRA schemas before any files are uploaded, so that malformed submissions fail in milliseconds
+    def __init__(self, parent_dir, base_url=None):
+        self.schemas = schema_store(parent_dir, base_url)
+        self.warned = set()
+
+    def validate(self, webin_elt):
+        """
+        Validate the sets of a Webin XML against their schemas
+        :param webin_elt: WEBIN element, or a single set element
+        :return: List of error messages, empty if the XML is valid or its schemas are unavailable
+        """
+        errors = []
+        for set_elt in ([webin_elt] if webin_elt.tag in SCHEMA_FILES else list(webin_elt)):
+            name = SCHEMA_FILES.get(set_elt.tag)
+            if name is None:
+                errors.append('unexpected element {}'.format(set_elt.tag))
+                continue
+            schema = self.schemas.schema(name)
+            if schema is None:
+                if name not in self.warned:
+                    print('Schema {} is unavailable, {} will not be validated before submission'.format(name, set_elt.tag), file=sys.stderr)
+                    self.warned.add(name)
+                continue
+            if not schema.validate(etree.ElementTree(set_elt)):
+                errors.extend('{}: {}'.format(set_elt.tag, error.message.rstrip('.')) for error in schema.error_log)
+        return errors
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import random, sys, time
+from lazy_modules import lazy_module
+from retry import TransientError
+
+futures = lazy_module('concurrent.futures')           # Imported on first use, as only asynchronous submissions are polled
+http_client = lazy_module('http.client')
+
+POLL_WORKERS = 4            # Maximum number of poll requests in flight at once
+POLL_INITIAL_DELAY = 5          # Seconds before a submission is first polled
+POLL_MAX_DELAY = 300
+POLL_BACKOFF = 2            # Factor the delay between polls of a submission grows by while it remains pending
+POLL_TIMEOUT = 3600
+
+
+class receipt_poller:
+    # Class which polls the Webin REST API for the receipts of queued submissions, backing off while they remain pending
+    def __init__(self, webin, workers=POLL_WORKERS, initial_delay=POLL_INITIAL_DELAY, max_delay=POLL_MAX_DELAY, timeout=POLL_TIMEOUT):
+        self.webin = webin
+        self.workers = workers
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    def poll_once(self, submission_id):
+        """
+        Request the receipt of a queued submission
+        :param submission_id: Submission ID returned by the submit/queue service
+        :return: Tuple of response status, or None if the request failed, and response body
+        """
+        try:
+            return self.webin.request('GET', 'submit/poll/{}'.format(submission_id), headers={'Accept': 'application/xml'})
+        except (OSError, http_client.HTTPException) as e:
+            return None, str(e).encode()
+
+    def backoff(self, pending, submission_id):
+        """
+        Schedule the next poll of a pending submission, with jitter to spread requests out
+        :param pending: Dictionary of submission ID to time of the next poll and current delay
+        :param submission_id: Submission ID to poll again
+        """
+        delay = min(pending[submission_id][1] * POLL_BACKOFF, self.max_delay)
+        pending[submission_id] = (time.monotonic() + delay * random.uniform(0.8, 1.2), delay)
+
+    def poll(self, submission_ids, on_receipt=None):
+        """
+        Poll queued submissions until each has a receipt or the timeout is reached. Submissions which are due are polled
+        together in rounds, and the delay before a submission is polled again doubles each time it is found pending
+        :param submission_ids: List of submission IDs returned by the submit/queue service
+        :param on_receipt: Optional callable given the submission ID and receipt XML of each submission as it completes, raising TransientError if the receipt cannot be read yet
+        :return: Dictionary of submission ID to receipt XML for the completed submissions
+        """
+        now = time.monotonic()
+        deadline = now + self.timeout
+        pending = {submission_id: (now + self.initial_delay, self.initial_delay) for submission_id in submission_ids}      # Time of the next poll and current delay
+        receipts = {}
+
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending:
+                now = time.monotonic()
+                next_poll = min(next_time for next_time, delay in pending.values())
+                if next_poll > deadline:
+                    break
+                if next_poll > now:
+                    time.sleep(next_poll - now)
+                    continue
+
+                due = [submission_id for submission_id, (next_time, delay) in pending.items() if next_time <= now]
+                for submission_id, (status, body) in zip(due, executor.map(self.poll_once, due)):
+                    if status == 200:
+                        try:
+                            if on_receipt is not None:
+                                on_receipt(submission_id, body)
+                        except TransientError as e:
+                            print('> Receipt of submission {} could not be read, polling again: {}'.format(submission_id, e), file=sys.stderr)
+                            self.backoff(pending, submission_id)
+                            continue
+                        del pending[submission_id]
+                        receipts[submission_id] = body
+                    elif status is None or status == 202 or status >= 500:
+                        self.backoff(pending, submission_id)            # Still being processed, or a transient failure
+                    else:
+                        del pending[submission_id]
+                        print('> ERROR - Polling submission {} failed with HTTP {}: {}'.format(submission_id, status, body.decode(errors='replace')), file=sys.stderr)
+
+        for submission_id in pending:
+            print('> Submission {} is still being processed, no receipt after {} seconds'.format(submission_id, self.timeout))
+        return receipts
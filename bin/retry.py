@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import random, sys, time
+
+
+class TransientError(Exception):
+    # Failure which may succeed if the operation is attempted again, e.g. a dropped connection, an HTTP 5xx response or an MD5 mismatch
+    pass
+
+
+class PermanentError(Exception):
+    # Failure which will recur however often the operation is attempted, e.g. validation errors in a submission receipt
+    pass
+
+
+class retry_policy:
+    # Class which attempts an operation until it succeeds, backing off exponentially with jitter between attempts which fail with a transient error
+    def __init__(self, attempts, initial_delay, max_delay, budget, backoff=2):
+        self.attempts = attempts            # Maximum number of attempts of an operation
+        self.initial_delay = initial_delay          # Seconds before the first retry
+        self.max_delay = max_delay
+        self.budget = budget            # Seconds after which an operation is not retried again, however many attempts remain
+        self.backoff = backoff
+
+    def delay(self, attempt):
+        """
+        Obtain the delay before retrying an operation, with full jitter so concurrent retries do not coincide
+        :param attempt: Number of the attempt which failed
+        :return: Delay in seconds
+        """
+        return random.uniform(0, min(self.initial_delay * self.backoff ** (attempt - 1), self.max_delay))
+
+    def run(self, operation, description):
+        """
+        Carry out an operation, retrying it while it fails with a transient error and the retry budget allows
+        :param operation: Callable carrying out one attempt of the operation, raising TransientError or PermanentError on failure
+        :param description: Description of the operation for reporting failed attempts
+        :return: Return value of the operation
+        """
+        deadline = time.monotonic() + self.budget
+        attempt = 1
+        while True:
+            try:
+                return operation()
+            except TransientError as e:
+                delay = self.delay(attempt)
+                if attempt >= self.attempts or time.monotonic() + delay > deadline:
+                    raise
+                print("Attempt {} to {} failed, retrying in {:.1f}s: {}".format(attempt, description, delay, e), file=sys.stderr)
+            time.sleep(delay)
+            attempt += 1
+
+
+def http_error(status, message):
+    """
+    Classify a failed request to the Webin REST API by its response status
+    :param status: HTTP status of the response, or None if no response was received
+    :param message: Error message
+    :return: PermanentError for a client error, which the same request will meet again, otherwise TransientError
+    """
+    if status is not None and 400 <= status < 500:
+        return PermanentError(message)
+    return TransientError(message)
+
+
+UPLOAD_RETRY = retry_policy(attempts=5, initial_delay=5, max_delay=120, budget=3600)
+SUBMISSION_RETRY = retry_policy(attempts=4, initial_delay=10, max_delay=300, budget=1800)
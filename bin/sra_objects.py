@@ -2,25 +2,13 @@
 
 __author__ = "Nadim Rahman"
 
-from lxml import etree
-import os
+import logging, os
+from lazy_modules import lazy_module
 
-import logging
-import sys
-
-#Creating and Configuring Logger
-
-Log_Format = "%(levelname)s %(asctime)s - %(message)s"
-
-logging.basicConfig(stream = sys.stdout, 
-                    filemode = "w",
-                    format = Log_Format, 
-                    level = logging.DEBUG)
+etree = lazy_module('lxml.etree')          # Imported on first use, so scripts start without waiting on lxml
 
 logger = logging.getLogger()
 
-logger.debug("sra_objects: ")
-
 class createAnalysisXML:
     # Class which handles creation of an analysis XML component of the Webin XML
     def __init__(self, webin_elt, alias, project_accession, analysis_date, analysis_file, analysis_title, analysis_description, analysis_attributes, analysis_type, sample_accession="", run_accession="", centre_name=""):
@@ -59,7 +47,7 @@ class createAnalysisXML:
         :return: Adding run section of XML
         """
         for file in self.analysis_file:
-            filename = os.path.basename(file.get('name'))       # Do not need full path in analysis XMl, just the file name - as it is being retrieved from Webin upload area
+            filename = file.get('remote_name') or os.path.basename(file.get('name'))       # Do not need full path in analysis XMl, just the file name - as it is being retrieved from Webin upload area
             fileElt = etree.SubElement(parent_element, 'FILE', filename=filename, filetype=file.get('type'), checksum_method="MD5", checksum=file.get('md5_value'))
         return fileElt
 
@@ -82,7 +70,19 @@ class createAnalysisXML:
         :return: Analysis XML
         """
         analysis_set = etree.SubElement(self.webin_elt, 'ANALYSIS_SET')        # Define the analysis XML object
+        self.build_analysis_element(analysis_set)
 
+        if logger.isEnabledFor(logging.DEBUG):          # Serialising the XML for display is only worthwhile when it is logged
+            logger.debug('Analysis XML:\n%s', etree.tostring(analysis_set, pretty_print=True, encoding='unicode'))
+
+        return analysis_set
+
+    def build_analysis_element(self, analysis_set):
+        """
+        Build the analysis element for this analysis, several of which can be held in one analysis set
+        :param analysis_set: Analysis set element to add the analysis to
+        :return: Analysis XML element
+        """
         if self.centre_name != "":
             analysisElt = etree.SubElement(analysis_set, 'ANALYSIS', alias=self.alias, center_name=self.centre_name, analysis_date=self.analysis_date)
         else:
@@ -102,7 +102,6 @@ class createAnalysisXML:
             runrefElt = self.split_sub_elements(self.run_accession, analysisElt, 'RUN_REF')
 
         analysis_type = etree.SubElement(analysisElt, 'ANALYSIS_TYPE')
-        print(self.analysis_type)
         type = etree.SubElement(analysis_type, self.analysis_type)
 
         files = etree.SubElement(analysisElt, 'FILES')
@@ -110,12 +109,7 @@ class createAnalysisXML:
 
         analysis_attributes = self.add_analysis_attributes(analysisElt)      # Create analysis attributes XML sub-element
 
-        print('*' * 100)
-        print('Analysis XML:\n')
-        print(etree.tostring(analysis_set, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
-        print('*' * 100)
-
-        return analysis_set
+        return analysisElt
 
 
 class createSubmissionXML:
@@ -138,10 +132,8 @@ class createSubmissionXML:
         actionElt = etree.SubElement(actionsElt, 'ACTION')
         actionSub = etree.SubElement(actionElt, self.action)
 
-        print('*' * 100)
-        print('Submission XML: \n')
-        print(etree.tostring(submission_set, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
-        print('*' * 100)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Submission XML:\n%s', etree.tostring(submission_set, pretty_print=True, encoding='unicode'))
 
         return submission_set
 
@@ -181,19 +173,79 @@ class createWebinXML:
         analysis_obj = createAnalysisXML(webin_parent, self.alias, self.project_accession, self.analysis_date, self.analysis_file, self.analysis_title, self.analysis_description, self.analysis_attributes, self.analysis_type, self.sample_accession, self.run_accession, self.centre_name)
         self.analysis_xml = analysis_obj.build_analysis()
 
-        print('*' * 100)
-        print('Final Webin XML: \n')
-        print('*' * 100)
-        logger.debug(f'{webin_xml} webin_xml: ')
-        print(etree.tostring(webin_xml, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
-        print('*' * 100)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Final Webin XML:\n%s', etree.tostring(webin_xml, pretty_print=True, encoding='unicode'))
 
-        # Save the submission XML to a file
+        self.save_webin(webin_xml)
+        return webin_xml
+
+    def webin_filepath(self):
+        """
+        Obtain the path of the file the Webin XML is saved to
+        :return: Full path of the Webin XML
+        """
         xml_filename = 'webin_{}.xml'.format(self.timestamp_now)
         logger.debug(f'{self.parent_dir,xml_filename} xml_filepath before: ')
         xml_filepath = os.path.join(self.parent_dir, xml_filename)
         xml_filepath = xml_filepath.encode().decode('unicode_escape')
         logger.debug(f'{self.parent_dir, xml_filename} xml_filepath after: ')
-        webin_xml.write(xml_filepath, pretty_print=True, xml_declaration=True, encoding='UTF-8')
+        return xml_filepath
 
-        return webin_xml
+    def save_webin(self, webin_xml):
+        """
+        Save the Webin XML to a file in the parent directory
+        :param webin_xml: Webin XML object
+        """
+        webin_xml.write(self.webin_filepath(), pretty_print=True, xml_declaration=True, encoding='UTF-8')
+
+
+class createBatchWebinXML(createWebinXML):
+    # Class which handles creation of a Webin XML holding several analyses, to be submitted to ENA together
+    def __init__(self, alias, configuration, analyses, timestamp_now, parent_dir):
+        super().__init__(alias, configuration, None, None, timestamp_now, None, None, parent_dir)
+        self.analyses = analyses
+
+    def build_webin(self):
+        """
+        Build the Webin XML with a single analysis set containing an analysis element per analysis. The XML is streamed
+        to file an analysis at a time, so memory use does not grow with the number of analyses
+        :return: Full path of the Webin XML
+        """
+        xml_filepath = self.webin_filepath()
+        with etree.xmlfile(xml_filepath, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element('WEBIN'):
+                # Include Submission component of Webin XML, built under a detached parent element which is discarded once written
+                submission_obj = createSubmissionXML(etree.Element('WEBIN'), self.alias, self.action, self.centre_name)
+                xf.write(submission_obj.build_submission(), pretty_print=True)
+
+                # Include an analysis element for each analysis in the batch
+                with xf.element('ANALYSIS_SET'):
+                    for analysis in self.analyses:
+                        analysis_elt = self.build_analysis_element(analysis, etree.Element('ANALYSIS_SET'))
+                        xf.write(analysis_elt, pretty_print=True)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug('Analysis XML:\n%s', etree.tostring(analysis_elt, pretty_print=True, encoding='unicode'))
+        print('> Built Webin XML with {} analyses'.format(len(self.analyses)))
+        return xml_filepath
+
+    def build_analysis_element(self, analysis, analysis_set):
+        """
+        Build the analysis element for an analysis of the batch
+        :param analysis: Dictionary of analysis information
+        :param analysis_set: Analysis set element to add the analysis to
+        :return: Analysis XML element
+        """
+        analysis_obj = createAnalysisXML(None, analysis.get('alias'), analysis.get('project'), analysis.get('analysis_date'), analysis.get('analysis_file'), self.analysis_title, self.analysis_description, self.analysis_attributes, analysis.get('analysis_type'), analysis.get('sample_list'), analysis.get('run_list'), self.centre_name)
+        return analysis_obj.build_analysis_element(analysis_set)
+
+    def build_single(self, analysis):
+        """
+        Build a Webin XML holding the submission and a single analysis of the batch, without saving it, so the analysis can be validated on its own
+        :param analysis: Dictionary of analysis information
+        :return: WEBIN element
+        """
+        webin_parent = etree.Element('WEBIN')
+        createSubmissionXML(webin_parent, self.alias, self.action, self.centre_name).build_submission()
+        self.build_analysis_element(analysis, etree.SubElement(webin_parent, 'ANALYSIS_SET'))
+        return webin_parent
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import collections, struct, zlib
+from lazy_modules import lazy_module
+
+futures = lazy_module('concurrent.futures')           # Imported on first use, as only files compressed on upload need it
+
+COMPRESSION_WORKERS = 4         # Threads compressing blocks of each file in parallel, zlib releases the GIL while compressing
+COMPRESSION_LEVEL = 6
+COMPRESSED_EXTENSIONS = ('.gz', '.bgz', '.bz2', '.xz', '.zst', '.zip', '.bam', '.cram')          # Files already compressed are uploaded as they are
+GZIP_CHUNK_SIZE = 1024 * 1024           # Bytes of input compressed per task for gzip
+GZIP_WINDOW = 32 * 1024         # Bytes of the preceding input used as the dictionary of each chunk, so splitting the input costs little compression
+GZIP_HEADER = bytes([0x1f, 0x8b, 8, 0, 0, 0, 0, 0, 0, 0xff])            # No file name and a zero modification time, so output is reproducible
+BGZF_BLOCK_SIZE = 0xff00            # Bytes of input per BGZF block, so a block of incompressible input still fits the 64 KB limit
+BGZF_TASK_BLOCKS = 16           # BGZF blocks compressed per task
+BGZF_HEADER = struct.Struct('<BBBBIBBHBBHH')
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')         # Empty block marking the end of a BGZF file
+
+
+def compression_for(file_name, file_type):
+    """
+    Choose how a file is compressed before upload
+    :param file_name: Name of the file
+    :param file_type: Type of the file in the analysis XML
+    :return: bgzf for VCF files, so they remain indexable, gzip for other files, or None if the file is already compressed
+    """
+    name = file_name.lower()
+    if name.endswith(COMPRESSED_EXTENSIONS):
+        return None
+    if file_type == 'vcf' or name.endswith('.vcf'):
+        return 'bgzf'
+    return 'gzip'
+
+
+def deflate_chunk(chunk, dictionary, last, level):
+    """
+    Compress a chunk of a gzip stream as raw deflate data which can be concatenated with that of the other chunks
+    :param chunk: Bytes of input
+    :param dictionary: Bytes of input preceding the chunk
+    :param last: Whether this is the final chunk, which ends the deflate stream
+    :param level: Compression level
+    :return: Compressed bytes
+    """
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(chunk) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)           # Sync flush ends on a byte boundary without ending the stream
+
+
+def bgzf_compress(data, level):
+    """
+    Compress input into BGZF blocks, each an independent gzip member
+    :param data: Bytes of input
+    :param level: Compression level
+    :return: Compressed bytes
+    """
+    blocks = []
+    for offset in range(0, len(data), BGZF_BLOCK_SIZE):
+        block = data[offset:offset + BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(block) + compressor.flush()
+        blocks.append(BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(compressed) + BGZF_HEADER.size + 7))
+        blocks.append(compressed)
+        blocks.append(struct.pack('<II', zlib.crc32(block), len(block)))
+    return b''.join(blocks)
+
+
+def compressed_blocks(f, compression='gzip', workers=COMPRESSION_WORKERS, level=COMPRESSION_LEVEL):
+    """
+    Compress a file, compressing chunks of it in parallel while yielding the output in order
+    :param f: File object opened in binary mode
+    :param compression: gzip or bgzf
+    :param workers: Number of threads compressing chunks
+    :param level: Compression level
+    :return: Generator of compressed bytes
+    """
+    gzip_stream = compression == 'gzip'
+    chunk_size = GZIP_CHUNK_SIZE if gzip_stream else BGZF_BLOCK_SIZE * BGZF_TASK_BLOCKS
+    crc, length, dictionary = 0, 0, b''
+    pending = collections.deque()
+    if gzip_stream:
+        yield GZIP_HEADER
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        chunk = f.read(chunk_size)
+        while True:
+            following = f.read(chunk_size) if chunk else b''            # Read ahead, the final chunk of a gzip stream is compressed differently
+            last = not following
+            if gzip_stream:
+                crc = zlib.crc32(chunk, crc)
+                length += len(chunk)
+                pending.append(executor.submit(deflate_chunk, chunk, dictionary, last, level))
+                dictionary = (dictionary + chunk)[-GZIP_WINDOW:]
+            else:
+                pending.append(executor.submit(bgzf_compress, chunk, level))
+            while pending and (last or len(pending) > workers):         # Bounds the input and output held in memory
+                yield pending.popleft().result()
+            if last:
+                break
+            chunk = following
+
+    if gzip_stream:
+        yield struct.pack('<II', crc, length & 0xffffffff)
+    else:
+        yield BGZF_EOF
+
+
+class compressed_reader:
+    # Class which reads a file compressed on the fly, for streaming to an upload without writing the compressed file to disk
+    def __init__(self, f, compression='gzip', workers=COMPRESSION_WORKERS, level=COMPRESSION_LEVEL):
+        self.blocks = compressed_blocks(f, compression, workers, level)
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        """
+        Read compressed bytes
+        :param size: Maximum number of bytes to read, or -1 to read to the end
+        :return: Compressed bytes, empty at the end of the file
+        """
+        while size < 0 or len(self.buffer) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer += block
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        self.blocks.close()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import argparse, http.client, json, os, socket, sys, time
+
+SERVER_HOST = '127.0.0.1'           # As served by submission_server.py, not imported so the client starts without loading the submission modules
+SERVER_PORT = 8750
+WAIT_INTERVAL = 60          # Seconds each request for the state of a job is held open by the server
+FINAL_STATES = ['accessioned', 'queued', 'failed']
+
+
+def get_args():
+    '''
+    Define and obtain script arguments
+    :return: Arguments object
+    '''
+    parser = argparse.ArgumentParser(prog='submission_client.py', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="""
+        + ============================================================ +
+        |  European Nucleotide Archive (ENA) Analysis Submission Tool  |
+        |                                                              |
+        |  Client which sends an analysis to a running                 |
+        |  submission_server.py in place of analysis_submission.py.    |
+        + =========================================================== +
+        """)
+    parser.add_argument('-p', '--project', help='Valid ENA project accession to submit analysis to (e.g. PRJXXXXXXX), defaults to the project of the server', type=str, required=False)
+    parser.add_argument('-s', '--sample_list', help='ENA sample accessions/s to link with the analysis submission (e.g. ERSXXXXX,ERSXXXXX)', required=False)
+    parser.add_argument('-r', '--run_list', help='ENA run accession/s to link with the analysis submission (e.g. ERRXXXXX,ERRXXXXX)', required=False)
+    parser.add_argument('-f', '--file', help='Files of analysis to submit to the project, accepts a list of files (e.g. path/to/file1.csv.gz,path/to/file2.txt.gz), paths must be readable by the server', type=str, required=True)
+    parser.add_argument('-a', '--analysis_type', help='Type of analysis to submit. Options: PATHOGEN_ANALYSIS, COVID19_CONSENSUS, COVID19_FILTERED_VCF, PHYLOGENY_ANALYSIS', type=str, required=True)
+    parser.add_argument('-ad', '--analysis_date', help='Specify date of analysis', type=str, required=False)
+    parser.add_argument('-sk', '--socket', help='Path of the Unix socket of the server. Required unless the server is reached over TCP', type=str, required=False)
+    parser.add_argument('-tc', '--tcp', help='Specify reaching the server over TCP instead of a Unix socket, sending the token of --token_file. Options are true/t or false/f. Default: false/f', type=str.lower, choices=['true', 't', 'false', 'f'], default='false', required=False)
+    parser.add_argument('-ho', '--host', help='Address of the server over TCP. Default: {}'.format(SERVER_HOST), type=str, default=SERVER_HOST, required=False)
+    parser.add_argument('-po', '--port', help='Port of the server over TCP. Default: {}'.format(SERVER_PORT), type=int, default=SERVER_PORT, required=False)
+    parser.add_argument('-tf', '--token_file', help='File holding the token of the server, as written by submission_server.py. Required over TCP', type=str, required=False)
+    parser.add_argument('-w', '--wait', help='Seconds to wait for the job to finish, 0 to return once the server has accepted it. Default: no limit', type=float, required=False)
+    args = parser.parse_args()
+    if args.tcp in ['true', 't'] and args.token_file is None:
+        parser.error('the following arguments are required over TCP: -tf/--token_file')
+    if args.tcp not in ['true', 't'] and args.socket is None:
+        parser.error('the following arguments are required unless -tc is true: -sk/--socket')
+    return args
+
+
+class unix_connection(http.client.HTTPConnection):
+    # Class which sends HTTP requests to the server over a Unix socket
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class submission_client:
+    # Class which sends jobs to the submission server and waits for their outcome
+    def __init__(self, socket_path=None, host=SERVER_HOST, port=SERVER_PORT, token=None):
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.token = token          # Sent with each request over TCP
+
+    def request(self, method, path, payload=None):
+        """
+        Send a request to the job API
+        :param method: HTTP method
+        :param path: Path of the request
+        :param payload: Optional object to send as JSON
+        :return: Tuple of response status and decoded JSON response
+        """
+        timeout = WAIT_INTERVAL + 30
+        if self.socket_path is not None:
+            connection = unix_connection(self.socket_path, timeout)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            body = json.dumps(payload).encode() if payload is not None else None
+            headers = {'Content-Type': 'application/json'}
+            if self.token is not None:
+                headers['Authorization'] = 'Bearer {}'.format(self.token)
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def submit(self, analysis):
+        """
+        Send a job to submit an analysis
+        :param analysis: Dictionary of analysis fields
+        :return: Dictionary of the job state
+        """
+        status, job = self.request('POST', '/jobs', analysis)
+        if status != 202:
+            raise ValueError(job.get('error'))
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """
+        Wait for a job to finish
+        :param job_id: ID of the job
+        :param timeout: Optional seconds to wait before returning the job as it stands
+        :return: Dictionary of the job state
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            interval = WAIT_INTERVAL if deadline is None else max(min(deadline - time.monotonic(), WAIT_INTERVAL), 0)
+            status, job = self.request('GET', '/jobs/{}?wait={}'.format(job_id, interval))
+            if status != 200:
+                raise ValueError(job.get('error'))
+            if job.get('state') in FINAL_STATES or (deadline is not None and time.monotonic() >= deadline):
+                return job
+
+
+if __name__=='__main__':
+    args = get_args()       # Get script arguments
+
+    files = [os.path.abspath(file) for file in args.file.split(',')]           # The server may run from another directory
+    analysis = {'project': args.project, 'run_list': args.run_list, 'sample_list': args.sample_list, 'file': files,
+                'analysis_type': args.analysis_type, 'analysis_date': args.analysis_date}
+    try:
+        if args.tcp in ['true', 't']:
+            with open(args.token_file) as f:
+                client = submission_client(host=args.host, port=args.port, token=f.read().strip())
+        else:
+            client = submission_client(args.socket)
+        job = client.submit(analysis)
+        print('> Job ID: {}'.format(job.get('id')))
+        if args.wait != 0:
+            job = client.wait(job.get('id'), args.wait)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        print('ERROR: Job could not be submitted: {}'.format(e))
+        sys.exit(1)
+
+    if job.get('accession') is not None:
+        print('> Analysis ID: {}'.format(job.get('accession')))
+    elif job.get('submission_id') is not None:
+        print('> Submission ID: {}'.format(job.get('submission_id')))
+    if job.get('state') == 'failed':
+        print('> ERROR - Job {} failed: {}'.format(job.get('id'), job.get('error')))
+        sys.exit(1)
+    if job.get('state') not in FINAL_STATES:
+        print('> Job {} is still {}'.format(job.get('id'), job.get('state')))
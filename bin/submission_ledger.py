@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os, sqlite3, threading, time
+
+LEDGER_FILENAME = 'submission_ledger.sqlite'
+ANALYSIS_STATES = ['hashed', 'uploaded', 'verified', 'submitted', 'accessioned']          # In the order analyses pass through them
+
+
+class submission_ledger:
+    # Class which records the progress of analyses and their data files through each stage of submission, so a restarted run skips completed work
+    def __init__(self, parent_dir):
+        self.ledger_file = os.path.join(parent_dir, LEDGER_FILENAME)
+        self.lock = threading.Lock()            # Stages update the ledger from several threads
+        self.connection = sqlite3.connect(self.ledger_file, timeout=60, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS analyses (alias_stem TEXT NOT NULL, files_md5 TEXT NOT NULL, alias TEXT NOT NULL, state TEXT NOT NULL, '
+                                    'submission_id TEXT, accession TEXT, updated REAL NOT NULL, PRIMARY KEY (alias_stem, files_md5))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files (md5 TEXT NOT NULL, remote_name TEXT NOT NULL, state TEXT NOT NULL, updated REAL NOT NULL, '
+                                    'md5_sent TEXT, size_sent INTEGER, PRIMARY KEY (md5, remote_name))')
+            columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(files)')]
+            if 'md5_sent' not in columns:           # Ledger written before files could be compressed for upload
+                self.connection.execute('ALTER TABLE files ADD COLUMN md5_sent TEXT')
+                self.connection.execute('ALTER TABLE files ADD COLUMN size_sent INTEGER')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS analyses_alias ON analyses (alias)')
+
+    @staticmethod
+    def files_md5(analysis_file):
+        """
+        Combine the MD5 values of the files of an analysis into part of its ledger key
+        :param analysis_file: List of dictionaries of file information
+        :return: String of the sorted MD5 values, of the local files where they are compressed for upload
+        """
+        return ','.join(sorted(file.get('source_md5') or file.get('md5_value') for file in analysis_file))
+
+    def record_analysis(self, alias_stem, files_md5, alias):
+        """
+        Record an analysis whose files have been hashed, unless it is already in the ledger
+        :param alias_stem: Alias of the analysis without the timestamp, stable across runs
+        :param files_md5: Combined MD5 values of the files of the analysis
+        :param alias: Alias to use if the analysis is not in the ledger yet
+        :return: Dictionary of the ledger entry, including the alias used when the analysis was first recorded
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO analyses (alias_stem, files_md5, alias, state, updated) VALUES (?, ?, ?, ?, ?)',
+                                    (alias_stem, files_md5, alias, ANALYSIS_STATES[0], time.time()))
+            row = self.connection.execute('SELECT * FROM analyses WHERE alias_stem = ? AND files_md5 = ?', (alias_stem, files_md5)).fetchone()
+        return dict(row)
+
+    def update_analysis(self, alias, state, submission_id=None, accession=None):
+        """
+        Advance an analysis to a later stage, an analysis never moves back to an earlier stage
+        :param alias: Alias of the analysis
+        :param state: Stage the analysis has completed
+        :param submission_id: Optional submission ID from the asynchronous Webin API
+        :param accession: Optional analysis accession
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT state FROM analyses WHERE alias = ?', (alias,)).fetchone()
+            if row is None or ANALYSIS_STATES.index(row['state']) > ANALYSIS_STATES.index(state):
+                return
+            self.connection.execute('UPDATE analyses SET state = ?, submission_id = COALESCE(?, submission_id), accession = COALESCE(?, accession), updated = ? WHERE alias = ?',
+                                    (state, submission_id, accession, time.time(), alias))
+
+    def file_entry(self, md5, remote_name):
+        """
+        Obtain the stage reached by a data file in the upload area
+        :param md5: MD5 checksum value of the local file
+        :param remote_name: Name of the file in the upload area
+        :return: Dictionary of the stage of the file and the MD5 and size of the bytes sent, or None if it has not been uploaded
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT state, md5_sent, size_sent FROM files WHERE md5 = ? AND remote_name = ?', (md5, remote_name)).fetchone()
+        return dict(row) if row is not None else None
+
+    def update_file(self, md5, remote_name, state, md5_sent=None, size_sent=None):
+        """
+        Record the stage reached by a data file in the upload area
+        :param md5: MD5 checksum value of the local file
+        :param remote_name: Name of the file in the upload area
+        :param state: Stage the file has completed
+        :param md5_sent: Optional MD5 checksum value of the bytes sent, which differs from that of the local file where it was compressed
+        :param size_sent: Optional number of bytes sent
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO files (md5, remote_name, state, updated, md5_sent, size_sent) VALUES (?, ?, ?, ?, ?, ?)',
+                                    (md5, remote_name, state, time.time(), md5_sent, size_sent))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import os, threading, time
+from lazy_modules import lazy_module
+
+json = lazy_module('json')
+
+METRICS_FILENAME = 'metrics.jsonl'
+METRIC_PREFIX = 'ena_submitter'
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 1800)          # Upper bounds in seconds of the Prometheus histogram of stage durations
+METRIC_FIELDS = ('alias', 'file', 'bytes', 'retries', 'queue_wait', 'status', 'error')          # Fields a metric may carry, so nothing else, such as credentials, can be written
+
+
+class metrics_recorder:
+    # Class which records the duration, size, throughput, retries and queue wait of each hashing, upload, verification, XML build, submission and receipt as JSON lines, with totals optionally written in the Prometheus text format
+    def __init__(self):
+        self.output = None
+        self.prometheus_file = None
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def open(self, metrics_file=None, prometheus_file=None):
+        """
+        Start recording metrics
+        :param metrics_file: Path of a file to append JSON lines of metrics to, or None to record none
+        :param prometheus_file: Optional path of a file to write totals to in the Prometheus text format
+        """
+        with self.lock:
+            if self.output is not None:
+                self.output.close()
+            self.output = open(metrics_file, 'a') if metrics_file is not None else None
+            self.prometheus_file = prometheus_file
+
+    def record(self, stage, duration, **fields):
+        """
+        Record a metric of a stage
+        :param stage: Name of the stage (hash, upload, verify, xml, submit or receipt)
+        :param duration: Seconds the stage took
+        :param fields: Optional fields of the metric, of those in METRIC_FIELDS
+        """
+        if self.output is None and self.prometheus_file is None:
+            return
+        metric = {'time': round(time.time(), 3), 'stage': stage, 'duration': round(duration, 6)}
+        metric.update((field, fields[field]) for field in METRIC_FIELDS if fields.get(field) is not None)
+        if 'queue_wait' in metric:
+            metric['queue_wait'] = round(metric['queue_wait'], 6)
+        if metric.get('bytes') and duration > 0:
+            metric['throughput'] = round(metric['bytes'] / duration)            # Bytes per second
+        with self.lock:
+            if self.output is not None:
+                self.output.write(json.dumps(metric) + '\n')
+                self.output.flush()             # Complete lines are readable while a long batch runs
+            totals = self.totals.setdefault(stage, {'count': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0, 'retries': 0, 'queue_wait': 0.0, 'buckets': [0] * len(DURATION_BUCKETS)})
+            totals['count'] += 1
+            totals['errors'] += 1 if 'error' in metric else 0
+            totals['seconds'] += duration
+            totals['bytes'] += metric.get('bytes', 0)
+            totals['retries'] += metric.get('retries', 0)
+            totals['queue_wait'] += metric.get('queue_wait', 0)
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    totals['buckets'][index] += 1
+
+    def prometheus_text(self):
+        """
+        Format the totals of each stage in the Prometheus text exposition format
+        :return: Text of the metrics
+        """
+        lines = []
+        with self.lock:
+            for name, key, kind, description in (('stage_total', 'count', 'counter', 'Number of times each stage ran'),
+                                                 ('stage_errors_total', 'errors', 'counter', 'Number of times each stage failed'),
+                                                 ('stage_bytes_total', 'bytes', 'counter', 'Bytes processed by each stage'),
+                                                 ('stage_retries_total', 'retries', 'counter', 'Retries made by each stage'),
+                                                 ('stage_queue_wait_seconds_total', 'queue_wait', 'counter', 'Seconds spent waiting to start each stage')):
+                lines.append('# HELP {}_{} {}'.format(METRIC_PREFIX, name, description))
+                lines.append('# TYPE {}_{} {}'.format(METRIC_PREFIX, name, kind))
+                lines.extend('{}_{}{{stage="{}"}} {}'.format(METRIC_PREFIX, name, stage, totals[key]) for stage, totals in sorted(self.totals.items()))
+
+            name = '{}_stage_duration_seconds'.format(METRIC_PREFIX)
+            lines.append('# HELP {} Duration of each stage'.format(name))
+            lines.append('# TYPE {} histogram'.format(name))
+            for stage, totals in sorted(self.totals.items()):
+                for bound, count in zip(DURATION_BUCKETS, totals['buckets']):
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, bound, count))
+                lines.append('{}_bucket{{stage="{}",le="+Inf"}} {}'.format(name, stage, totals['count']))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, totals['seconds']))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, totals['count']))
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """
+        Write the totals to the Prometheus file, replacing it whole so a collector never reads it part written
+        """
+        if self.prometheus_file is None:
+            return
+        with open(self.prometheus_file + '.tmp', 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(self.prometheus_file + '.tmp', self.prometheus_file)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.output is not None:
+                self.output.close()
+                self.output = None
+            self.prometheus_file = None
+
+
+METRICS = metrics_recorder()            # Shared by every stage in the process, as the worker threads and pools of a batch have no other common object
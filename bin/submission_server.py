@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+import argparse, hmac, json, os, queue, secrets, signal, socketserver, sys, threading, time, uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from analysis_submission import add_submission_arguments, analysis_outcome, configure_logging, logger, open_metrics, read_analysis, read_config, submit_batch
+from checksum_cache import checksum_cache
+from ftp_upload import WEBIN_FTP_HOST, WEBIN_FTP_PORT, ftp_connection_pool, ftp_uploader, upload_inventory
+from submission_ledger import submission_ledger
+from submission_metrics import METRICS
+from webin_client import webin_session
+
+SERVER_SOCKET = 'submission_server.sock'           # Unix socket of the job API in the output location, unless another is given
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8750
+TOKEN_FILENAME = 'submission_server.token'          # Shared secret required of clients when the job API is served over TCP
+BATCH_WAIT = 2              # Seconds to wait for further jobs before a batch is submitted
+JOB_RETENTION = 24 * 3600           # Seconds the state of a finished job is kept for clients to collect
+JOB_STATES = ['pending', 'running', 'accessioned', 'queued', 'failed']
+RECEIPT_ERROR = 'Receipt reports errors'            # Start of the error of analyses rejected by Webin, which rejects every analysis of a submission together
+
+
+def get_args():
+    '''
+    Define and obtain script arguments
+    :return: Arguments object
+    '''
+    parser = argparse.ArgumentParser(prog='submission_server.py', formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="""
+        + ============================================================ +
+        |  European Nucleotide Archive (ENA) Analysis Submission Tool  |
+        |                                                              |
+        |  Server which keeps connections to Webin open and submits    |
+        |  analysis jobs sent by submission_client.py in batches.      |
+        + =========================================================== +
+        """)
+    parser.add_argument('-p', '--project', help='ENA project accession used for jobs which do not specify their own (e.g. PRJXXXXXXX)', type=str, required=False)
+    parser.add_argument('-sk', '--socket', help='Path of the Unix socket to serve the job API on, accessible only to the account running the server. Default: {} in the output location'.format(SERVER_SOCKET), type=str, required=False)
+    parser.add_argument('-tc', '--tcp', help='Specify serving the job API on a TCP port instead of a Unix socket, with clients required to send the token of --token_file. Options are true/t or false/f. Default: false/f', type=str.lower, choices=['true', 't', 'false', 'f'], default='false', required=False)
+    parser.add_argument('-ho', '--host', help='Address to serve the job API on over TCP. Default: {}'.format(SERVER_HOST), type=str, default=SERVER_HOST, required=False)
+    parser.add_argument('-po', '--port', help='Port to serve the job API on over TCP. Default: {}'.format(SERVER_PORT), type=int, default=SERVER_PORT, required=False)
+    parser.add_argument('-tf', '--token_file', help='File holding the token clients must send when the job API is served over TCP, created with a random token readable only by the account running the server if it does not exist. Default: {} in the output location'.format(TOKEN_FILENAME), type=str, required=False)
+    parser.add_argument('-bw', '--batch_wait', help='Seconds to wait for further jobs before submitting those received as a batch. Default: {}'.format(BATCH_WAIT), type=float, default=BATCH_WAIT, required=False)
+    add_submission_arguments(parser)
+    args = parser.parse_args()
+
+    if args.test in ['true', 't']:
+        args.test = True
+    elif args.test in ['false', 'f']:
+        args.test = False
+    return args
+
+
+def read_token(token_file):
+    """
+    Read the token clients must send over TCP, creating the file with a random token if it does not exist
+    :param token_file: Path of the file holding the token
+    :return: Token
+    """
+    try:
+        descriptor = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)           # Readable only by the account running the server
+    except FileExistsError:
+        with open(token_file) as f:
+            token = f.read().strip()
+        if not token:
+            raise ValueError('{} holds no token'.format(token_file))
+        return token
+    token = secrets.token_hex(32)
+    with os.fdopen(descriptor, 'w') as f:
+        f.write(token + '\n')
+    print('> Created token file {}'.format(token_file))
+    return token
+
+
+class submission_server:
+    # Class which holds the configuration and warm connections to Webin, submitting the jobs received over the job API in batches
+    def __init__(self, configuration, args):
+        self.configuration = configuration
+        self.args = args
+        self.api_service = 'submit/queue' if args.asynchronous in ['true', 't'] else 'submit'
+        self.ftp_pool = ftp_connection_pool(args.analysis_username, args.analysis_password, args.upload_workers,
+                                            configuration.get('WEBIN_FTP_HOST', WEBIN_FTP_HOST), configuration.get('WEBIN_FTP_PORT', WEBIN_FTP_PORT))
+        self.webin = webin_session(args.analysis_username, args.analysis_password, args.test, configuration.get('WEBIN_API_URL'), args.webin_timeout)
+        self.inventory = upload_inventory(ftp_uploader(self.ftp_pool))            # Listing of the upload area, kept current across batches
+        self.jobs = {}
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.dispatcher = threading.Thread(target=self.dispatch, name='dispatcher', daemon=True)
+
+    def add_job(self, payload):
+        """
+        Accept a job to submit an analysis
+        :param payload: Dictionary of analysis fields, as for a row of a manifest
+        :return: Dictionary of job information
+        """
+        job_id = uuid.uuid4().hex
+        analysis = read_analysis(payload, self.args.project, 'Job {}'.format(job_id))
+        for file in analysis.get('file'):
+            if not os.path.isfile(file) or not os.access(file, os.R_OK):
+                raise ValueError('Job {} has a file the server cannot read: {}'.format(job_id, file))          # Rejected now, rather than failing at upload after batching
+        job = {'id': job_id, 'state': 'pending', 'request': analysis, 'analysis': dict(analysis),
+               'result': None, 'received': time.time(), 'finished': None, 'done': threading.Event()}
+        with self.lock:
+            self.expire_jobs()
+            self.jobs[job_id] = job
+        self.pending.put(job)
+        print('> Received job {} for {}'.format(job_id, ','.join(job['analysis'].get('file'))))
+        return job
+
+    def expire_jobs(self):
+        """
+        Forget jobs which finished longer ago than the retention period
+        """
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [job_id for job_id, job in self.jobs.items() if job['finished'] is not None and job['finished'] < cutoff]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id):
+        """
+        Look up a job
+        :param job_id: ID of the job
+        :return: Dictionary of job information, or None if there is no such job
+        """
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    @staticmethod
+    def job_status(job):
+        """
+        Summarise a job for clients of the job API
+        :param job: Dictionary of job information
+        :return: Dictionary of the job state, and once finished its alias, accession or submission ID, error and stage timings
+        """
+        status = {'id': job['id'], 'state': job['state']}
+        if job['result'] is not None:
+            status.update((field, value) for field, value in job['result']._asdict().items() if value is not None)
+        return status
+
+    def counts(self):
+        """
+        Count the jobs held in each state
+        :return: Dictionary of state to number of jobs
+        """
+        with self.lock:
+            states = [job['state'] for job in self.jobs.values()]
+        return {state: states.count(state) for state in JOB_STATES}
+
+    def next_batch(self):
+        """
+        Gather the jobs received within the batch wait of the first, up to the chunk size
+        :return: List of jobs, or None when the server is stopping
+        """
+        job = self.pending.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.monotonic() + self.args.batch_wait
+        while len(batch) < self.args.chunk_size:
+            try:
+                job = self.pending.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if job is None:
+                self.pending.put(None)          # Stop once this batch is submitted
+                break
+            batch.append(job)
+        return batch
+
+    def dispatch(self):
+        """
+        Submit jobs in batches as they arrive, the checksum cache and ledger are opened here as SQLite connections belong to one thread
+        """
+        cache = checksum_cache(self.args.output_location) if self.args.checksum_cache in ['true', 't'] else None
+        ledger = submission_ledger(self.args.output_location) if self.args.ledger in ['true', 't'] else None
+        try:
+            while True:
+                batch = self.next_batch()
+                if batch is None:
+                    break
+                self.submit(batch, cache, ledger)
+        finally:
+            if cache is not None:
+                cache.close()
+            if ledger is not None:
+                ledger.close()
+
+    def submit(self, batch, cache, ledger):
+        """
+        Submit a batch of jobs over the warm connections and record the outcome of each. Webin rejects every analysis of a
+        submission if one is invalid, so jobs rejected together are submitted again one at a time, as they may be from other clients
+        :param batch: List of jobs
+        :param cache: Optional checksum cache object
+        :param ledger: Optional submission ledger object
+        """
+        for job in batch:
+            job['state'] = 'running'
+        print('> Submitting a batch of {} job(s)'.format(len(batch)))
+        self.submit_jobs(batch, cache, ledger)
+        rejected = [job for job in batch if (job['analysis'].get('error') or '').startswith(RECEIPT_ERROR)] if len(batch) > 1 else []
+        if rejected:
+            print('> Webin rejected {} job(s) submitted together, submitting them one at a time'.format(len(rejected)))
+            for job in rejected:
+                job['analysis'] = dict(job['request'])
+                self.submit_jobs([job], cache, ledger)
+
+        for job in batch:
+            job['result'] = analysis_outcome(job['analysis'])
+            job['state'] = job['result'].state
+            job['finished'] = time.time()
+            job['done'].set()
+
+    def submit_jobs(self, jobs, cache, ledger):
+        """
+        Submit the analyses of jobs as a batch
+        :param jobs: List of jobs
+        :param cache: Optional checksum cache object
+        :param ledger: Optional submission ledger object
+        """
+        timestamp_now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        try:
+            submit_batch([job['analysis'] for job in jobs], self.configuration, self.args, self.api_service, timestamp_now, cache, ledger, self.ftp_pool, self.webin, self.inventory)
+        except Exception as e:
+            logger.exception('Batch submission failed')
+            for job in jobs:
+                job['analysis'].setdefault('error', 'Batch submission failed: {}'.format(e))
+
+    def start(self):
+        self.dispatcher.start()
+
+    def close(self):
+        """
+        Submit the jobs already received, then close the connections to Webin
+        """
+        self.pending.put(None)
+        self.dispatcher.join()
+        self.ftp_pool.close()
+        self.webin.close()
+
+
+class job_request_handler(BaseHTTPRequestHandler):
+    # Class which serves the job API: POST /jobs submits a job, GET /jobs/<id> reports its state, waiting up to ?wait=<seconds> for it to finish, and GET /status counts jobs by state
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorised(self):
+        """
+        Check the token of a request over TCP, replying with an error if it is missing or wrong
+        :return: Boolean
+        """
+        if self.server.token is None:
+            return True         # Unix socket, access is governed by its file permissions
+        supplied = self.headers.get('Authorization', '').encode()
+        if hmac.compare_digest(supplied, 'Bearer {}'.format(self.server.token).encode()):
+            return True
+        self.close_connection = True            # Any request body is left unread
+        self.reply(401, {'error': 'Missing or invalid token'})
+        return False
+
+    def do_POST(self):
+        if not self.authorised():
+            return
+        if urlsplit(self.path).path.rstrip('/') != '/jobs':
+            return self.reply(404, {'error': 'Not found'})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(payload, dict):
+                raise ValueError('Job must be a JSON object')
+            job = self.server.submitter.add_job(payload)
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        self.reply(202, self.server.submitter.job_status(job))
+
+    def do_GET(self):
+        if not self.authorised():
+            return
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts == ['status']:
+            return self.reply(200, self.server.submitter.counts())
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self.reply(404, {'error': 'Not found'})
+        job = self.server.submitter.get_job(parts[1])
+        if job is None:
+            return self.reply(404, {'error': 'No job {}'.format(parts[1])})
+        try:
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+        except ValueError:
+            return self.reply(400, {'error': 'Invalid wait'})
+        job['done'].wait(wait)
+        self.reply(200, self.server.submitter.job_status(job))
+
+    def log_message(self, format, *args):
+        logger.debug('job API: ' + format, *args)
+
+
+class unix_http_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Class which serves the job API on a Unix socket, so access is governed by file permissions
+    daemon_threads = True
+
+
+if __name__=='__main__':
+    args = get_args()       # Get script arguments
+    configure_logging(args.log_level)
+
+    if args.output_location is not None:
+        if os.path.isdir(args.output_location) is not True:
+            print('ERROR: Please provide a valid and existing output directory... Exiting.')
+            sys.exit()
+    else:
+        args.output_location = '.'          # Default is the current working directory, unless specified
+    configuration = read_config(args.output_location)           # Read once, for every job
+    open_metrics(args)
+
+    token = None
+    if args.tcp in ['true', 't']:
+        try:
+            token = read_token(args.token_file or os.path.join(args.output_location, TOKEN_FILENAME))
+        except (OSError, ValueError) as e:
+            print('ERROR: Could not read the token file: {}... Exiting.'.format(e))
+            sys.exit(1)
+    else:
+        args.socket = args.socket or os.path.join(args.output_location, SERVER_SOCKET)
+
+    submitter = submission_server(configuration, args)
+    if token is None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)          # Left behind by a server which did not shut down cleanly
+        umask = os.umask(0o177)          # Only the account running the server may connect
+        try:
+            httpd = unix_http_server(args.socket, job_request_handler)
+        finally:
+            os.umask(umask)
+        address = args.socket
+    else:
+        httpd = ThreadingHTTPServer((args.host, args.port), job_request_handler)
+        httpd.daemon_threads = True
+        address = 'http://{}:{}'.format(args.host, args.port)
+    httpd.submitter = submitter
+    httpd.token = token
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    submitter.start()
+    print('> Serving the job API on {}'.format(address))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('> Shutting down, submitting jobs already received')
+        httpd.server_close()
+        submitter.close()
+        METRICS.close()
+        if token is None and os.path.exists(args.socket):
+            os.remove(args.socket)
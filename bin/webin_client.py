@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import base64, os, queue, select, uuid
+from urllib.parse import urlsplit
+from lazy_modules import lazy_module
+
+http_client = lazy_module('http.client')           # Imported on first use, with the ssl and email modules it loads
+
+WEBIN_TEST_URL = 'https://wwwdev.ebi.ac.uk/ena/submit/webin-v2/'
+WEBIN_PRODUCTION_URL = 'https://www.ebi.ac.uk/ena/submit/webin-v2/'
+WEBIN_TIMEOUT = 300             # Seconds to wait on the Webin REST API before a request is abandoned
+BODY_BLOCK_SIZE = 1024 * 1024
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')            # Requests which can be resent without repeating their effect
+
+
+class webin_session:
+    # Class which keeps persistent connections to the Webin REST API, reused across submissions and receipt polls
+    def __init__(self, username, password, test, base_url=None, timeout=WEBIN_TIMEOUT):
+        self.base_url = base_url or (WEBIN_TEST_URL if test else WEBIN_PRODUCTION_URL)
+        url = urlsplit(self.base_url)
+        self.connection_class = http_client.HTTPSConnection if url.scheme == 'https' else http_client.HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path if url.path.endswith('/') else url.path + '/'
+        self.timeout = timeout
+        self.authorization = 'Basic ' + base64.b64encode('{}:{}'.format(username, password).encode()).decode()      # Sent as a header, so credentials are not exposed in the process table
+        self.idle = queue.LifoQueue()
+
+    @staticmethod
+    def dropped(connection):
+        """
+        Check whether an idle connection has been closed by the server, which sends nothing on a keep-alive connection between requests
+        :param connection: HTTP connection object
+        :return: True if the connection cannot be reused
+        """
+        if connection.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)           # The end of the stream, or data which is not the answer to any request
+
+    def request(self, method, service, body=None, headers=None):
+        """
+        Send a request to the Webin REST API over a pooled keep-alive connection
+        :param method: HTTP method
+        :param service: Service path relative to the Webin REST API (e.g. submit)
+        :param body: Optional callable returning the request body, called again if the request has to be resent
+        :param headers: Optional dictionary of additional request headers
+        :return: Tuple of response status and response body
+        """
+        request_headers = {'Authorization': self.authorization, 'Accept': '*/*'}
+        request_headers.update(headers or {})
+        while True:
+            try:
+                connection, reused = self.idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = self.connection_class(self.host, self.port, timeout=self.timeout), False
+            if reused and self.dropped(connection):
+                connection.close()
+                continue
+            try:
+                connection.request(method, self.path + service, body=body() if body else None, headers=request_headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http_client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and method in IDEMPOTENT_METHODS:
+                    continue            # The server closed the idle connection as the request was sent, resend on a fresh one
+                raise           # A submission may have reached the server, so resending is left to the retry policy of the caller
+            except BaseException:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.idle.put(connection)
+            return response.status, data
+
+    def submit(self, service, xml_filepath):
+        """
+        Submit a Webin XML, streaming it from file as a multipart form upload
+        :param service: Submission service of the Webin REST API (submit or submit/queue)
+        :param xml_filepath: Full path of the Webin XML
+        :return: Tuple of response status and response body
+        """
+        boundary = uuid.uuid4().hex
+        preamble = ('--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\nContent-Type: text/xml\r\n\r\n'.format(
+            boundary, os.path.basename(xml_filepath))).encode()
+        epilogue = '\r\n--{}--\r\n'.format(boundary).encode()
+
+        def body():
+            yield preamble
+            with open(xml_filepath, 'rb') as f:
+                for block in iter(lambda: f.read(BODY_BLOCK_SIZE), b''):
+                    yield block
+            yield epilogue
+
+        headers = {'Content-Type': 'multipart/form-data; boundary={}'.format(boundary),
+                   'Content-Length': str(len(preamble) + os.path.getsize(xml_filepath) + len(epilogue))}
+        return self.request('POST', service, body, headers)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
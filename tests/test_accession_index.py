@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import accession_index as accession_index_module
+from accession_index import accession_index
+
+HEADER = 'run_accession\tsample_accession\tstudy_accession\n'
+
+
+class accession_index_test(unittest.TestCase):
+    # Class which checks that reports are indexed incrementally only while they are appended to, and that accessions are looked up in batches
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.report = os.path.join(self.directory, 'report.tsv')
+        self.index = accession_index(self.directory)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, first, last, mode='w'):
+        with open(self.report, mode) as f:
+            if mode == 'w':
+                f.write(HEADER)
+            for number in range(first, last):
+                f.write('ERR{:07d}\tSAMEA{:07d}\tPRJEB{:05d}\n'.format(number, number, number % 3))
+        os.utime(self.report, ns=(0, os.stat(self.report).st_mtime_ns + 1))            # Changed, even within the resolution of the file system clock
+
+    def test_appended_rows(self):
+        self.write(0, 100)
+        self.assertEqual(self.index.refresh(self.report), 100)
+        self.assertEqual(self.index.refresh(self.report), 0)
+        self.write(100, 150, mode='a')
+        self.assertEqual(self.index.refresh(self.report), 50)           # Only the appended rows are read
+        self.assertEqual(self.index.lookup(['ERR0000149', 'SAMEA0000000']), {'ERR0000149': ('run', 'PRJEB00002'), 'SAMEA0000000': ('sample', None)})
+
+    def test_rewritten_report(self):
+        self.write(0, 100)
+        self.index.refresh(self.report)
+        self.write(200, 300)            # Same header and size, different rows
+        self.assertEqual(self.index.refresh(self.report), 100)
+        self.assertEqual(self.index.lookup(['ERR0000000', 'ERR0000200']), {'ERR0000200': ('run', 'PRJEB00002')})
+
+    def test_batched_lookup(self):
+        self.write(0, accession_index_module.LOOKUP_BATCH_SIZE * 2 + 7)
+        self.index.refresh(self.report)
+        wanted = ['ERR{:07d}'.format(number) for number in range(0, accession_index_module.LOOKUP_BATCH_SIZE * 3, 2)]
+        found = self.index.lookup(wanted)
+        self.assertEqual(sorted(found), [accession for accession in wanted if int(accession[3:]) < accession_index_module.LOOKUP_BATCH_SIZE * 2 + 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import ftplib, hashlib, io, os, random, shutil, sys, tempfile, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', directory) for directory in ('bin', 'benchmarks')]
+
+import ftp_upload
+from ftp_standin import ftp_handler, ftp_standin
+from ftp_upload import ftp_connection_pool, ftp_uploader, upload_inventory, upload_state
+
+CHECKPOINT_INTERVAL = 256 * 1024            # Small enough that the files below hold several checkpoints
+
+
+class upload_state_test(unittest.TestCase):
+    # Class which checks that the hash state of an upload is restored correctly at any offset
+    def setUp(self):
+        self.interval = ftp_upload.HASH_CHECKPOINT_INTERVAL
+        ftp_upload.HASH_CHECKPOINT_INTERVAL = CHECKPOINT_INTERVAL
+        self.data = random.Random(0).randbytes(CHECKPOINT_INTERVAL * 5 + 1234)
+
+    def tearDown(self):
+        ftp_upload.HASH_CHECKPOINT_INTERVAL = self.interval
+
+    def test_checkpoints(self):
+        state = upload_state()
+        for offset in range(0, len(self.data), 100 * 1024):
+            state.update(self.data[offset:offset + 100 * 1024])
+        self.assertEqual(state.position, len(self.data))
+        self.assertEqual(state.md5.hexdigest(), hashlib.md5(self.data).hexdigest())
+        positions = [position for position, md5 in state.checkpoints]
+        self.assertEqual(positions[0], 0)
+        self.assertTrue(all(later - earlier >= CHECKPOINT_INTERVAL for earlier, later in zip(positions, positions[1:])))
+        for position, md5 in state.checkpoints:
+            self.assertEqual(md5.hexdigest(), hashlib.md5(self.data[:position]).hexdigest())
+
+    def test_rewind(self):
+        for offset in (0, 1, CHECKPOINT_INTERVAL, CHECKPOINT_INTERVAL * 3 + 17, len(self.data)):
+            state = upload_state()
+            state.update(self.data)
+            f = io.BytesIO(self.data)
+            state.rewind(f, offset)
+            self.assertEqual(state.position, offset)
+            self.assertEqual(f.tell(), offset)          # The upload continues from the offset
+            self.assertEqual(state.md5.hexdigest(), hashlib.md5(self.data[:offset]).hexdigest())
+            self.assertTrue(all(position <= offset for position, md5 in state.checkpoints))
+
+
+class resumed_upload_test(unittest.TestCase):
+    # Class which interrupts uploads to the FTP stand-in and checks they are continued with APPE to an intact copy
+    def setUp(self):
+        self.interval = ftp_upload.HASH_CHECKPOINT_INTERVAL
+        ftp_upload.HASH_CHECKPOINT_INTERVAL = CHECKPOINT_INTERVAL
+        self.directory = tempfile.mkdtemp()
+        self.server = ftp_standin(os.path.join(self.directory, 'upload'), drop_rate=1, seed=1)
+        self.pool = ftp_connection_pool('Webin-0', 'password', 1, '127.0.0.1', self.server.start())
+        self.uploader = ftp_uploader(self.pool)
+        self.file = os.path.join(self.directory, 'ERR0000001.fasta')
+        self.data = random.Random(1).randbytes(6 * 1024 * 1024)         # Larger than the stand-in accepts before dropping a transfer
+        with open(self.file, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+        ftp_upload.HASH_CHECKPOINT_INTERVAL = self.interval
+
+    def test_resume_after_partial_upload(self):
+        state = upload_state()
+        with self.assertRaises(ftplib.all_errors):          # 426 or a reset connection, the transfer is dropped part way through
+            self.uploader.upload_file(self.file, state=state)
+        received = os.path.getsize(os.path.join(self.server.root, 'ERR0000001.fasta'))
+        self.assertLess(received, len(self.data))
+
+        self.server.drop_rate = 0
+        result = self.uploader.upload_file(self.file, state=state)
+        self.assertEqual(result['resumed_from'], received)
+        self.assertEqual(result['bytes'], len(self.data))
+        self.assertEqual(result['md5'], hashlib.md5(self.data).hexdigest())
+        with open(os.path.join(self.server.root, 'ERR0000001.fasta'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_restart_when_remote_copy_is_longer(self):
+        state = upload_state()
+        with self.assertRaises(ftplib.all_errors):
+            self.uploader.upload_file(self.file, state=state)
+        with open(os.path.join(self.server.root, 'ERR0000001.fasta'), 'wb') as f:
+            f.write(b'\0' * (state.position + 1))           # Holds more than this upload ever sent
+
+        self.server.drop_rate = 0
+        result = self.uploader.upload_file(self.file, state=state)
+        self.assertEqual(result['resumed_from'], 0)
+        self.assertEqual(result['md5'], hashlib.md5(self.data).hexdigest())
+        with open(os.path.join(self.server.root, 'ERR0000001.fasta'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+
+class list_only_handler(ftp_handler):
+    # Class which serves FTP as a server without MLSD or OPTS does, so listings fall back to LIST
+    ftp_OPTS = None
+    ftp_MLSD = None
+
+
+class mlsd_only_handler(ftp_handler):
+    # Class which serves FTP as a server which lists with MLSD but does not let the facts be chosen with OPTS
+    ftp_OPTS = None
+    ftp_LIST = None
+
+
+class upload_inventory_test(unittest.TestCase):
+    # Class which checks that the upload area is listed once, with MLSD or LIST, and kept current with the transfers made
+    def start(self, handler=ftp_handler):
+        self.server = ftp_standin(os.path.join(self.directory, 'upload'), handler=handler)
+        for name, size in (('ERR0000001.fasta', 10), ('ERR0000002.fasta', 2048)):
+            with open(os.path.join(self.server.root, name), 'wb') as f:
+                f.write(b'A' * size)
+        self.pool = ftp_connection_pool('Webin-0', 'password', 1, '127.0.0.1', self.server.start())
+        return upload_inventory(ftp_uploader(self.pool))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def check_inventory(self, inventory):
+        self.assertEqual(inventory.size('ERR0000001.fasta'), 10)
+        self.assertEqual(inventory.sizes, {'ERR0000001.fasta': 10, 'ERR0000002.fasta': 2048})            # Listed, rather than queried file by file
+        self.assertIsNone(inventory.size('ERR0000003.fasta'))
+        inventory.record('ERR0000003.fasta', 5)
+        self.assertEqual(inventory.size('ERR0000003.fasta'), 5)
+
+    def test_mlsd(self):
+        self.check_inventory(self.start())
+
+    def test_mlsd_without_opts(self):
+        self.check_inventory(self.start(mlsd_only_handler))
+
+    def test_list(self):
+        self.check_inventory(self.start(list_only_handler))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from preflight_validation import ACCESSION_PATTERNS, check_accessions
+
+
+class accession_pattern_test(unittest.TestCase):
+    # Class which checks the accession formats accepted and rejected before any files are uploaded
+    valid = {
+        'project': ['PRJEB12345', 'PRJNA123', 'PRJDB1', 'ERP123456', 'SRP1234567', 'DRP000001'],
+        'sample': ['SAMEA1234567', 'SAMN01234567', 'SAMD00000001', 'ERS123456', 'SRS1234567', 'DRS000001'],
+        'run': ['ERR123456', 'SRR12345678', 'DRR000001'],
+    }
+    invalid = {
+        'project': ['PRJXB1', 'PRJEB', 'ERP12345', 'prjeb1', 'PRJEB1 ', 'ERR123456'],
+        'sample': ['SAMX1', 'SAMEA', 'ERS12345', 'ERR123456', 'SAMEA1,SAMEA2'],
+        'run': ['ERR12345', 'XRR123456', 'ERR123456a', 'ERS123456', ''],
+    }
+
+    def test_valid(self):
+        for kind, accessions in self.valid.items():
+            for accession in accessions:
+                self.assertIsNotNone(ACCESSION_PATTERNS[kind].fullmatch(accession), '{} {}'.format(kind, accession))
+
+    def test_invalid(self):
+        for kind, accessions in self.invalid.items():
+            for accession in accessions:
+                self.assertIsNone(ACCESSION_PATTERNS[kind].fullmatch(accession), '{} {}'.format(kind, accession))
+
+    def test_check_accessions(self):
+        self.assertEqual(check_accessions('PRJEB1', ['ERR123456'], ['SAMEA1']), [])
+        self.assertEqual(check_accessions('PRJEB1', "", ""), [])            # Empty references are held as an empty string
+        self.assertEqual(check_accessions('PRJEB1', ['ERR1'], ['ERS1']), ["invalid run accession 'ERR1'", "invalid sample accession 'ERS1'"])
+
+    def test_several_projects(self):
+        self.assertEqual(check_accessions('PRJEB1,PRJEB2', ['ERR123456'], ""), [])
+        self.assertEqual(check_accessions('PRJEB1,PRJXX2', [], ""), ["invalid project accession 'PRJXX2'"])
+
+
+if __name__ == '__main__':
+    unittest.main()
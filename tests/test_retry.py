@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from retry import PermanentError, TransientError, http_error, retry_policy
+
+
+class http_error_test(unittest.TestCase):
+    # Class which checks that failed Webin requests are only retried where the failure may not recur
+    def test_client_errors_are_permanent(self):
+        for status in (400, 401, 403, 404, 409, 499):
+            error = http_error(status, 'HTTP {}'.format(status))
+            self.assertIsInstance(error, PermanentError)
+            self.assertEqual(str(error), 'HTTP {}'.format(status))
+
+    def test_server_errors_are_transient(self):
+        for status in (500, 502, 503, 504):
+            self.assertIsInstance(http_error(status, 'HTTP {}'.format(status)), TransientError)
+
+    def test_other_responses_are_transient(self):
+        for status in (None, 200, 202, 301, 399):            # No response, or one without the expected body
+            self.assertIsInstance(http_error(status, 'No receipt returned'), TransientError)
+
+
+class retry_policy_test(unittest.TestCase):
+    # Class which checks that operations are retried on transient errors only
+    def setUp(self):
+        self.policy = retry_policy(attempts=3, initial_delay=0, max_delay=0, budget=60)
+        self.attempts = 0
+
+    def failing(self, error):
+        def operation():
+            self.attempts += 1
+            raise error
+        return operation
+
+    def test_transient_errors_are_retried(self):
+        with self.assertRaises(TransientError):
+            self.policy.run(self.failing(http_error(503, 'HTTP 503')), 'submit')
+        self.assertEqual(self.attempts, 3)
+
+    def test_permanent_errors_are_not_retried(self):
+        with self.assertRaises(PermanentError):
+            self.policy.run(self.failing(http_error(400, 'HTTP 400')), 'submit')
+        self.assertEqual(self.attempts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
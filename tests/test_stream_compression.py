@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import gzip, io, os, random, struct, sys, unittest, zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from stream_compression import BGZF_BLOCK_SIZE, BGZF_EOF, GZIP_CHUNK_SIZE, GZIP_WINDOW, bgzf_compress, compressed_reader, compression_for, deflate_chunk
+
+
+def sample_data(size, seed=0):
+    """
+    Create input which compresses, as analysis files do, with repeats both within and across chunks
+    :param size: Number of bytes
+    :param seed: Seed of the random input
+    :return: Bytes of input
+    """
+    generator = random.Random(seed)
+    lines = [generator.choice('ACGT') * generator.randint(1, 60) + '\n' for _ in range(200)]
+    data = ''.join(generator.choice(lines) for _ in range(size // 30 + 1)).encode()
+    return data[:size]
+
+
+def bgzf_blocks(data):
+    """
+    Split BGZF output into its blocks
+    :param data: Compressed bytes
+    :return: List of blocks, each a complete gzip member
+    """
+    blocks, offset = [], 0
+    while offset < len(data):
+        block_size = struct.unpack_from('<H', data, offset + 16)[0] + 1            # BSIZE of the BC extra field, the block size less one
+        blocks.append(data[offset:offset + block_size])
+        offset += block_size
+    return blocks
+
+
+class deflate_chunk_test(unittest.TestCase):
+    # Class which checks that chunks compressed separately, each primed with the input before it, form a single deflate stream
+    def test_round_trip(self):
+        data = sample_data(3 * 100 * 1024 + 123)
+        chunks = [data[offset:offset + 100 * 1024] for offset in range(0, len(data), 100 * 1024)]
+        compressed, dictionary = b'', b''
+        for index, chunk in enumerate(chunks):
+            compressed += deflate_chunk(chunk, dictionary, index == len(chunks) - 1, 6)
+            dictionary = (dictionary + chunk)[-GZIP_WINDOW:]
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(compressed) + decompressor.flush(), data)
+        self.assertTrue(decompressor.eof)
+
+    def test_single_chunk(self):
+        data = sample_data(1000)
+        self.assertEqual(zlib.decompress(deflate_chunk(data, b'', True, 6), -zlib.MAX_WBITS), data)
+
+
+class bgzf_compress_test(unittest.TestCase):
+    # Class which checks that BGZF output is a series of gzip members of at most 64 KB, each holding one block of input
+    def test_round_trip(self):
+        data = sample_data(3 * BGZF_BLOCK_SIZE + 5)
+        compressed = bgzf_compress(data, 6)
+        self.assertEqual(gzip.decompress(compressed), data)
+        blocks = bgzf_blocks(compressed)
+        self.assertEqual(len(blocks), 4)
+        for index, block in enumerate(blocks):
+            self.assertLessEqual(len(block), 64 * 1024)
+            self.assertEqual(gzip.decompress(block), data[index * BGZF_BLOCK_SIZE:(index + 1) * BGZF_BLOCK_SIZE])
+
+    def test_incompressible_input(self):
+        data = random.Random(0).randbytes(2 * BGZF_BLOCK_SIZE)
+        compressed = bgzf_compress(data, 6)
+        self.assertEqual(gzip.decompress(compressed), data)
+        self.assertTrue(all(len(block) <= 64 * 1024 for block in bgzf_blocks(compressed)))
+
+
+class compressed_reader_test(unittest.TestCase):
+    # Class which checks that files compressed on the fly with several workers decompress to the original, whatever the read sizes
+    def read_all(self, data, compression, workers, size):
+        reader = compressed_reader(io.BytesIO(data), compression, workers)
+        output = b''
+        for block in iter(lambda: reader.read(size), b''):
+            output += block
+        reader.close()
+        return output
+
+    def test_gzip(self):
+        for length in (0, 1, GZIP_CHUNK_SIZE, 2 * GZIP_CHUNK_SIZE + 77):
+            data = sample_data(length, length)
+            for workers in (1, 4):
+                compressed = self.read_all(data, 'gzip', workers, 64 * 1024)
+                self.assertEqual(gzip.decompress(compressed), data)
+        self.assertEqual(self.read_all(data, 'gzip', 4, -1), self.read_all(data, 'gzip', 1, 1000))          # Output is reproducible
+
+    def test_bgzf(self):
+        for length in (0, 1, BGZF_BLOCK_SIZE, 20 * BGZF_BLOCK_SIZE + 77):
+            data = sample_data(length, length)
+            for workers in (1, 4):
+                compressed = self.read_all(data, 'bgzf', workers, 64 * 1024)
+                self.assertEqual(gzip.decompress(compressed), data)
+                self.assertTrue(compressed.endswith(BGZF_EOF))
+
+    def test_compression_for(self):
+        self.assertEqual(compression_for('ERR0000001.vcf', 'vcf'), 'bgzf')
+        self.assertEqual(compression_for('ERR0000001.fasta', 'fasta'), 'gzip')
+        self.assertIsNone(compression_for('ERR0000001.fasta.gz', 'fasta'))
+        self.assertIsNone(compression_for('ERR0000001.CRAM', 'cram'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from submission_ledger import ANALYSIS_STATES, submission_ledger
+
+
+class submission_ledger_test(unittest.TestCase):
+    # Class which checks that analyses only move forward through the ledger, so a resumed run never repeats a completed stage
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger = submission_ledger(self.directory)
+        self.entry = self.ledger.record_analysis('EMC_NAW_ERR0000001', 'a' * 32, 'EMC_NAW_ERR0000001_2024-01-01T00:00:00')
+        self.alias = self.entry['alias']
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.directory)
+
+    def state(self):
+        return self.ledger.record_analysis('EMC_NAW_ERR0000001', 'a' * 32, 'unused')
+
+    def test_recorded_once(self):
+        self.assertEqual(self.entry['state'], ANALYSIS_STATES[0])
+        self.assertEqual(self.state()['alias'], self.alias)            # Later runs reuse the alias of the first
+
+    def test_forward_transitions(self):
+        for state in ANALYSIS_STATES[1:]:
+            self.ledger.update_analysis(self.alias, state)
+            self.assertEqual(self.state()['state'], state)
+
+    def test_no_backward_transitions(self):
+        self.ledger.update_analysis(self.alias, 'submitted', submission_id='ERA-SUBMIT-1')
+        for state in ('verified', 'uploaded', 'hashed'):
+            self.ledger.update_analysis(self.alias, state)
+            self.assertEqual(self.state()['state'], 'submitted')
+        self.ledger.update_analysis(self.alias, 'accessioned', accession='ERZ0000001')
+        self.ledger.update_analysis(self.alias, 'submitted')
+        entry = self.state()
+        self.assertEqual((entry['state'], entry['submission_id'], entry['accession']), ('accessioned', 'ERA-SUBMIT-1', 'ERZ0000001'))
+
+    def test_skipped_stages(self):
+        self.ledger.update_analysis(self.alias, 'accessioned', accession='ERZ0000001')           # Synchronous submissions go straight from verified to accessioned
+        self.ledger.update_analysis(self.alias, 'verified')
+        self.assertEqual(self.state()['state'], 'accessioned')
+
+    def test_persisted(self):
+        self.ledger.update_analysis(self.alias, 'verified')
+        self.ledger.close()
+        self.ledger = submission_ledger(self.directory)
+        self.assertEqual(self.state()['state'], 'verified')
+
+    def test_unknown_alias(self):
+        self.ledger.update_analysis('EMC_NAW_ERR0000002_2024-01-01T00:00:00', 'accessioned')
+        self.assertEqual(self.state()['state'], ANALYSIS_STATES[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import http.client, os, socket, sys, threading, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from webin_client import webin_session
+
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nOK'
+
+
+class closing_server:
+    # Class which answers one request per connection and then closes it, without announcing the close, as an idle timeout does
+    def __init__(self, answer=True):
+        self.answer = answer
+        self.requests = []
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.listener.getsockname()[1])
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            with connection:
+                data = b''
+                while b'\r\n\r\n' not in data:
+                    block = connection.recv(65536)
+                    if not block:
+                        break
+                    data += block
+                if data:
+                    self.requests.append(data.split(b' ', 1)[0].decode())
+                    if self.answer:
+                        connection.sendall(RESPONSE)
+
+    def close(self):
+        self.listener.close()
+
+
+class webin_session_test(unittest.TestCase):
+    # Class which checks that requests on connections closed by the server are resent only when that cannot repeat a submission
+    def setUp(self):
+        self.server = closing_server()
+        self.webin = webin_session('Webin-0', 'password', True, base_url=self.server.url)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_idle_connection_is_replaced(self):
+        for method in ('GET', 'POST', 'POST', 'GET'):
+            self.assertEqual(self.webin.request(method, 'submit', body=(lambda: [b'data']) if method == 'POST' else None,
+                                                headers={'Content-Length': '4'} if method == 'POST' else None), (200, b'OK'))
+        self.assertEqual(self.server.requests, ['GET', 'POST', 'POST', 'GET'])
+
+    def test_unanswered_post_is_not_resent(self):
+        self.server.answer = False
+        with self.assertRaises((http.client.HTTPException, OSError)):
+            self.webin.request('POST', 'submit', body=lambda: [b'data'], headers={'Content-Length': '4'})
+        self.assertEqual(self.server.requests, ['POST'])
+
+
+if __name__ == '__main__':
+    unittest.main()